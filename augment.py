@@ -0,0 +1,89 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the on-the-fly augmentation of the segmentation samples, in the input pipeline (get_batch).
+random flip, 90 degree rotation, scale-crop and color jitter.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    the sample is augmented as the decoded uint8 image and class id mask, before the normalization,
+    so it runs in the input threads (the queue runner / tf.data map threads), in parallel.
+
+    the geometric transforms are done on the image and the mask stacked as one (h, w, 4) tensor,
+    so both get exactly the same flip/rotation/crop. the mask is resized with NEAREST_NEIGHBOR,
+    the class ids are never interpolated. the color jitter is only for the image.
+
+    seed: each random op has the op seed seed + i, with the graph seed (tf.set_random_seed) the
+    sequence of each op is reproducible. the assignment of the random values to the records is only
+    deterministic with one input thread (num_queue_threads = 1), the threads take the records in any order.
+
+    switch: config.augmentation (default for get_batch.batch_input(augment=)), train_main --augment
+"""
+# ===================================================================================== #
+
+
+import tensorflow as tf
+
+
+def _op_seed(seed, i):
+    return None if seed is None else seed + i
+
+
+def augment(img, mask, seed=None, flip=True, rot90=True, max_scale=1.25, color=True):
+    """ augment one sample
+
+    :param
+        img: uint8 tensor (image_size, image_size, 3)
+        mask: uint8 class id tensor (image_size, image_size)
+        seed: inter or None, see Note
+        max_scale: float, the scale-crop: resize by a random scale in [1, max_scale], and crop back
+                    a random image_size window; 1: no scale-crop
+    :return:
+        img, mask, same shape and dtype
+    """
+    with tf.name_scope("augment"):
+        size = img.shape.as_list()[:2]
+
+        if max_scale > 1:
+            scale = tf.random_uniform([], 1., max_scale, seed=_op_seed(seed, 0))
+            scaled = tf.cast(tf.round(scale * size), tf.int32)
+            img = tf.cast(tf.round(tf.image.resize_images(img, scaled)), tf.uint8)
+            mask = tf.cast(tf.image.resize_images(mask[..., None], scaled,
+                                                  method=tf.image.ResizeMethod.NEAREST_NEIGHBOR), tf.uint8)
+            stack = tf.random_crop(tf.concat([img, mask], axis=2), size + [4], seed=_op_seed(seed, 1))
+        else:
+            stack = tf.concat([img, mask[..., None]], axis=2)
+
+        if flip:
+            stack = tf.image.random_flip_left_right(stack, seed=_op_seed(seed, 2))
+            stack = tf.image.random_flip_up_down(stack, seed=_op_seed(seed, 3))
+        if rot90:
+            stack = tf.image.rot90(stack, tf.random_uniform([], 0, 4, tf.int32, seed=_op_seed(seed, 4)))
+
+        stack.set_shape(size + [4])
+        img, mask = stack[..., :3], stack[..., 3]
+
+        if color:
+            # on uint8, the adjust_* convert to float [0, 1] and back (saturate)
+            img = tf.image.random_brightness(img, 0.125, seed=_op_seed(seed, 5))
+            img = tf.image.random_contrast(img, 0.8, 1.2, seed=_op_seed(seed, 6))
+            img = tf.image.random_saturation(img, 0.8, 1.2, seed=_op_seed(seed, 7))
+            img = tf.image.random_hue(img, 0.05, seed=_op_seed(seed, 8))
+
+    return img, mask
+
+
+def augment_batch(imgs, masks, seed=None, **kwargs):
+    """ augment each sample of a batch (tf.map_fn), for the batched pipelines (batch_decode, memmap)
+
+    :param
+        imgs: uint8 tensor (n, image_size, image_size, 3)
+        masks: uint8 tensor (n, image_size, image_size)
+    """
+    imgs_, masks_ = tf.map_fn(lambda x: augment(x[0], x[1], seed, **kwargs), (imgs, masks),
+                              dtype=(tf.uint8, tf.uint8))
+    imgs_.set_shape(imgs.shape)
+    masks_.set_shape(masks.shape)
+    return imgs_, masks_
@@ -0,0 +1,466 @@
+# ===================================================================================== #
+# coding:utf-8
+"""individual module, benchmark of the input pipeline (no model), data only.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    record format report: for each (image_format, compression) variant, create the tfrecord file
+    from the same dataset folder (dataset_gen.create_tfrecord), then report
+        --size_mb: the on-disk size of the record file (and of the source src/ + labels/ folder)
+        --images_per_sec: end-to-end read throughput of get_batch.batch_input (read, decode, batch)
+
+    memmap report (--mode memmap): the raw tfrecord file vs the memory-mapped array dataset,
+    batch_input vs memmap_batch_input
+
+    pipeline report (--mode pipeline): the queue runners vs tf.data (config.input_pipeline)
+    on the same record file, get_batch.queue_batch_input vs get_batch.dataset_batch_input
+
+    decode report (--mode decode): decode-before-batch (get_batch.parse_record) vs batch-before-decode
+    (get_batch.parse_batch), of the records of the same file fed to the parse graph alone
+        --ops_per_image: the op executions per image (traced by tf.RunMetadata)
+        --images_per_sec: the parse/decode/normalize throughput
+    and the end-to-end images/sec of both pipelines with both orders (config.batch_decode)
+
+    augment report (--mode augment): the input images/sec of batch_input without and with the augmentation
+    (augment.py), and the images/sec of the unet train step alone (random input in the graph, no input
+    pipeline). the augmentation does not starve the network while its images/sec stays over the unet one.
+
+    grid report (--mode grid): batch_input alone over the grid of
+    --threads (num_queue_threads) x --capacities (queue_capacity) x --batch_sizes x --formats (image_format/compression)
+    each setting is run in a new process (so the settings do not share memory), and reports
+        --images_per_sec, --batch_ms_p50, --batch_ms_p95: the time of each sess.run of one batch
+        --peak_rss_mb: the peak resident memory of the process (graph, queues, decoded images)
+    to size the input threads of a machine, or to catch an input regression (compare the json reports)
+
+    how to use, eg:
+    $ python benchmark_input.py -d ./data/train/ -o ./bench_records/ -t rgb -c 21 --report report.json
+    $ python benchmark_input.py --mode grid -d ./data/train/ --threads 1,2,4,8 --capacities 100,1000 \
+        --batch_sizes 4,16 --formats raw/none,png/none --report grid.json
+"""
+# ===================================================================================== #
+
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+
+import numpy as np
+import tensorflow as tf
+
+import dataset_gen
+import get_batch
+from config import BS, image_size, num_classes, path_checker, lr, data_format
+from unet import unet, resolve_data_format
+from get_batch import batch_input, memmap_batch_input, queue_batch_input, dataset_batch_input, \
+    parse_record, parse_batch
+
+
+VARIANTS = [('raw', 'none'), ('raw', 'gzip'), ('png', 'none'), ('png', 'gzip'), ('jpeg', 'none')]
+
+
+def folder_size(path):
+    """ the total size (bytes) of the files under path
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for fn in files:
+            total += os.path.getsize(os.path.join(root, fn))
+    return total
+
+
+def batch_times(build_input, num_batches=20, warmup=2):
+    """ drive an input function alone in a new graph, and time each batch
+
+    :param
+        build_input: func, build the input pipeline and return (name_batch, img_batch, label_batch)
+    :return:
+        list of float, the seconds of each sess.run (the warmup batches are not counted)
+    """
+    times = []
+    with tf.Graph().as_default():
+        _, images, labels = build_input()
+
+        with tf.Session() as sess:
+            sess.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+            coord = tf.train.Coordinator()
+            threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+            try:
+                for _ in range(warmup):
+                    sess.run([images, labels])
+
+                for _ in range(num_batches):
+                    start = time.time()
+                    sess.run([images, labels])
+                    times.append(time.time() - start)
+            finally:
+                coord.request_stop()
+                coord.join(threads)
+
+    return times
+
+
+def input_throughput(build_input, num_batches=20, batch_size=BS, warmup=2):
+    """
+    :return:
+        float, images per second of the input function, see batch_times
+    """
+    return num_batches * batch_size / sum(batch_times(build_input, num_batches, warmup))
+
+
+def run_setting(record_path, compression, threads, capacity, batch_size, num_batches=20):
+    """ one grid setting, in this process
+
+    Note:
+        num_queue_threads and queue_capacity are read from the get_batch module at graph build,
+        so they are set on the module here (the process runs only this setting).
+    :return:
+        dict, images_per_sec, batch_ms_p50, batch_ms_p95, peak_rss_mb
+    """
+    get_batch.num_queue_threads = threads
+    get_batch.queue_capacity = capacity
+    get_batch.queue_memory_budget = None    # the capacity of the grid, not the memory budget
+
+    times = batch_times(lambda: batch_input(record_path, batch_size=batch_size, compression=compression),
+                        num_batches)
+    return {'images_per_sec': len(times) * batch_size / sum(times),
+            'batch_ms_p50': float(np.percentile(times, 50)) * 1000,
+            'batch_ms_p95': float(np.percentile(times, 95)) * 1000,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0}   # KB on linux
+
+
+def grid_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes, threads=(4,), capacities=(1000,),
+                batch_sizes=(BS,), formats=('raw/none',), num_batches=20, workers=1):
+    """ the grid of the input settings, each one run in a new process (--mode setting)
+
+    :return:
+        list of dict, one row for each setting
+    """
+    path_checker(out_dir)
+    num_images = len(dataset_gen.dataset_manifest.scan_dataset(dataset_path))
+
+    rows = []
+    for variant in formats:
+        image_format, compression = variant.split('/')
+        record_path = os.path.join(out_dir, 'bench_{}_{}.tfrecords'.format(image_format, compression))
+        dataset_gen.create_tfrecord(record_path, dataset_path, dataset_gen.ShowProcess(num_images, record_path),
+                                    image_size, class_num, label_type, workers=workers,
+                                    image_format=image_format, compression=compression)
+
+        for n in threads:
+            for capacity in capacities:
+                for batch_size in batch_sizes:
+                    row = {'variant': variant, 'threads': n, 'capacity': capacity, 'batch_size': batch_size}
+                    out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--mode', 'setting',
+                                                   '--record', record_path, '--compression', compression,
+                                                   '--threads', str(n), '--capacities', str(capacity),
+                                                   '--batch_sizes', str(batch_size),
+                                                   '--num_batches', str(num_batches)])
+                    row.update(json.loads(out.decode('utf-8').strip().splitlines()[-1]))
+                    logging.info("{}".format(row))
+                    rows.append(row)
+    return rows
+
+
+def read_throughput(record_file, compression='none', num_batches=20, batch_size=BS, warmup=2):
+    """ the images/sec of get_batch.batch_input
+    """
+    return input_throughput(lambda: batch_input(record_file, batch_size=batch_size, compression=compression),
+                            num_batches, batch_size, warmup)
+
+
+def record_format_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes,
+                         variants=VARIANTS, num_batches=20, batch_size=BS, workers=1):
+    """ create the record file of each variant, and measure the size and the read throughput
+
+    :return:
+        list of dict, one row for each variant (and one for the source folder)
+    """
+    path_checker(out_dir)
+    num_images = len(os.listdir(dataset_path + "src/"))
+
+    rows = [{'variant': 'source', 'size_mb': folder_size(dataset_path) / 1024.0 ** 2}]
+    for image_format, compression in variants:
+        record_path = os.path.join(out_dir, 'bench_{}_{}.tfrecords'.format(image_format, compression))
+        process_bar_ = dataset_gen.ShowProcess(num_images, '{}: TFRecords Done!'.format(record_path))
+
+        start = time.time()
+        dataset_gen.create_tfrecord(record_path, dataset_path, process_bar_, image_size, class_num, label_type,
+                                    workers=workers, image_format=image_format, compression=compression)
+        gen_time = time.time() - start
+
+        rows.append({'variant': '{}/{}'.format(image_format, compression),
+                     'size_mb': os.path.getsize(record_path) / 1024.0 ** 2,
+                     'gen_sec': gen_time,
+                     'images_per_sec': read_throughput(record_path, compression, num_batches, batch_size)})
+        logging.info("{}".format(rows[-1]))
+    return rows
+
+
+def memmap_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes,
+                  num_batches=20, batch_size=BS, workers=1):
+    """ the raw tfrecord (batch_input) vs the memmap array dataset (memmap_batch_input),
+    created from the same dataset folder
+
+    :return:
+        list of dict, one row for each backend
+    """
+    path_checker(out_dir)
+    num_images = len(dataset_gen.dataset_manifest.scan_dataset(dataset_path))
+    record_path = os.path.join(out_dir, 'bench_raw_none.tfrecords')
+    memmap_dir = os.path.join(out_dir, 'bench_memmap')
+
+    start = time.time()
+    dataset_gen.create_tfrecord(record_path, dataset_path, dataset_gen.ShowProcess(num_images, record_path),
+                                image_size, class_num, label_type, workers=workers)
+    record_gen = time.time() - start
+
+    start = time.time()
+    dataset_gen.create_memmap(memmap_dir, dataset_path, dataset_gen.ShowProcess(num_images, memmap_dir),
+                              image_size, class_num, label_type, workers=workers)
+    memmap_gen = time.time() - start
+
+    rows = [{'variant': 'tfrecord', 'size_mb': os.path.getsize(record_path) / 1024.0 ** 2, 'gen_sec': record_gen,
+             'images_per_sec': read_throughput(record_path, 'none', num_batches, batch_size)},
+            {'variant': 'memmap', 'size_mb': folder_size(memmap_dir) / 1024.0 ** 2, 'gen_sec': memmap_gen,
+             'images_per_sec': input_throughput(lambda: memmap_batch_input(memmap_dir, batch_size=batch_size),
+                                                num_batches, batch_size)}]
+    for row in rows:
+        logging.info("{}".format(row))
+    return rows
+
+
+def pipeline_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes,
+                    num_batches=20, batch_size=BS, workers=1):
+    """ the queue-runner pipeline vs the tf.data pipeline, reading the same raw record file
+
+    :return:
+        list of dict, one row for each pipeline
+    """
+    path_checker(out_dir)
+    num_images = len(dataset_gen.dataset_manifest.scan_dataset(dataset_path))
+    record_path = os.path.join(out_dir, 'bench_raw_none.tfrecords')
+    dataset_gen.create_tfrecord(record_path, dataset_path, dataset_gen.ShowProcess(num_images, record_path),
+                                image_size, class_num, label_type, workers=workers)
+
+    rows = []
+    for variant, build in (('queue', queue_batch_input), ('dataset', dataset_batch_input)):
+        rows.append({'variant': variant,
+                     'images_per_sec': input_throughput(lambda: build(record_path, batch_size=batch_size),
+                                                        num_batches, batch_size)})
+        logging.info("{}".format(rows[-1]))
+    return rows
+
+
+def traced_ops(sess, fetches, feed_dict):
+    """ the number of op executions of one sess.run
+    """
+    run_metadata = tf.RunMetadata()
+    sess.run(fetches, feed_dict, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+             run_metadata=run_metadata)
+    return sum(len(dev.node_stats) for dev in run_metadata.step_stats.dev_stats)
+
+
+def decode_throughput(serialized, batch_size=BS, repeat=5):
+    """ parse_record (one sess.run for each record) vs parse_batch (one sess.run for each batch)
+    on the given serialized records, no reader and no queue
+
+    :return:
+        list of dict, one row for each decode order
+    """
+    batches = [serialized[i:i + batch_size] for i in range(0, len(serialized) - batch_size + 1, batch_size)]
+    num_images = len(batches) * batch_size * repeat
+    rows = []
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        one = tf.placeholder(tf.string, [])
+        fetches = parse_record(one)
+        ops = traced_ops(sess, fetches, {one: batches[0][0]})
+        start = time.time()
+        for _ in range(repeat):
+            for batch in batches:
+                for record in batch:
+                    sess.run(fetches, {one: record})
+        rows.append({'variant': 'decode_before_batch', 'ops_per_image': float(ops),
+                     'images_per_sec': num_images / (time.time() - start)})
+
+    with tf.Graph().as_default(), tf.Session() as sess:
+        many = tf.placeholder(tf.string, [batch_size])
+        fetches = parse_batch(many)
+        ops = traced_ops(sess, fetches, {many: batches[0]})
+        start = time.time()
+        for _ in range(repeat):
+            for batch in batches:
+                sess.run(fetches, {many: batch})
+        rows.append({'variant': 'batch_before_decode', 'ops_per_image': float(ops) / batch_size,
+                     'images_per_sec': num_images / (time.time() - start)})
+
+    rows[1]['ops_saved'] = 1 - rows[1]['ops_per_image'] / rows[0]['ops_per_image']
+    return rows
+
+
+def decode_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes,
+                  num_batches=20, batch_size=BS, workers=1):
+    """ decode-before-batch vs batch-before-decode, the decode alone and end-to-end with both pipelines
+
+    :return:
+        list of dict
+    """
+    path_checker(out_dir)
+    num_images = len(dataset_gen.dataset_manifest.scan_dataset(dataset_path))
+    record_path = os.path.join(out_dir, 'bench_raw_none.tfrecords')
+    dataset_gen.create_tfrecord(record_path, dataset_path, dataset_gen.ShowProcess(num_images, record_path),
+                                image_size, class_num, label_type, workers=workers)
+
+    serialized = list(tf.python_io.tf_record_iterator(record_path))
+    rows = decode_throughput(serialized, batch_size)
+
+    for pipeline in ('queue', 'dataset'):
+        for batched in (False, True):
+            rows.append({'variant': '{}/{}'.format(pipeline, 'batch_decode' if batched else 'record_decode'),
+                         'images_per_sec': input_throughput(
+                             lambda: batch_input(record_path, batch_size=batch_size, pipeline=pipeline,
+                                                 batched_decode=batched), num_batches, batch_size)})
+    for row in rows:
+        logging.info("{}".format(row))
+    return rows
+
+
+def print_rows(rows):
+    keys = []
+    for row in rows:
+        keys += [k for k in row if k not in keys]
+    print(''.join('{:>16}'.format(k) for k in keys))
+    for row in rows:
+        print(''.join('{:>16}'.format(('{:.2f}'.format(row[k]) if isinstance(row[k], float) else row[k])
+                                      if k in row else '-') for k in keys))
+
+
+def unet_throughput(num_batches=20, batch_size=BS, class_num=num_classes, warmup=2):
+    """ the images/sec of the unet train step (forward + backward + update) alone, on a random input
+    """
+    with tf.Graph().as_default():
+        images = tf.random_uniform([batch_size, image_size, image_size, 3])
+        labels = tf.one_hot(tf.random_uniform([batch_size, image_size, image_size], 0, class_num, tf.int32),
+                            class_num)
+        logits = unet(images, data_format=resolve_data_format(data_format))['output']
+        loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=labels, logits=logits))
+        train_op = tf.train.GradientDescentOptimizer(lr).minimize(loss)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for _ in range(warmup):
+                sess.run(train_op)
+            start = time.time()
+            for _ in range(num_batches):
+                sess.run(train_op)
+            elapsed = time.time() - start
+
+    return num_batches * batch_size / elapsed
+
+
+def augment_report(dataset_path, out_dir, label_type='rgb', class_num=num_classes,
+                   num_batches=20, batch_size=BS, workers=1):
+    """ batch_input without/with augmentation vs the unet train step
+
+    :return:
+        list of dict
+    """
+    path_checker(out_dir)
+    num_images = len(dataset_gen.dataset_manifest.scan_dataset(dataset_path))
+    record_path = os.path.join(out_dir, 'bench_raw_none.tfrecords')
+    dataset_gen.create_tfrecord(record_path, dataset_path, dataset_gen.ShowProcess(num_images, record_path),
+                                image_size, class_num, label_type, workers=workers)
+
+    rows = []
+    for augment in (False, True):
+        rows.append({'variant': 'input/augment' if augment else 'input',
+                     'images_per_sec': input_throughput(
+                         lambda: batch_input(record_path, batch_size=batch_size, augment=augment),
+                         num_batches, batch_size)})
+    rows.append({'variant': 'unet_step', 'images_per_sec': unet_throughput(num_batches, batch_size, class_num)})
+    rows[1]['starves_unet'] = str(rows[1]['images_per_sec'] < rows[2]['images_per_sec'])
+    for row in rows:
+        logging.info("{}".format(row))
+    return rows
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def main(_):
+    if FLAGS.mode == 'setting':
+        # one setting of the grid, called by grid_report, the json result is the last line of stdout
+        print(json.dumps(run_setting(FLAGS.record, FLAGS.compression, int(FLAGS.threads),
+                                     int(FLAGS.capacities), int(FLAGS.batch_sizes), FLAGS.num_batches)))
+        return
+    if FLAGS.mode == 'grid':
+        rows = grid_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                           threads=int_list(FLAGS.threads), capacities=int_list(FLAGS.capacities),
+                           batch_sizes=int_list(FLAGS.batch_sizes), formats=FLAGS.formats.split(','),
+                           num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    elif FLAGS.mode == 'augment':
+        rows = augment_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                              num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    elif FLAGS.mode == 'decode':
+        rows = decode_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                             num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    elif FLAGS.mode == 'pipeline':
+        rows = pipeline_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                               num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    elif FLAGS.mode == 'memmap':
+        rows = memmap_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                             num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    else:
+        rows = record_format_report(FLAGS.dataset_path, FLAGS.out_dir, FLAGS.label_type, FLAGS.num_classes,
+                                    num_batches=FLAGS.num_batches, workers=FLAGS.workers)
+    print_rows(rows)
+
+    if FLAGS.report:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the input pipeline')
+
+    parser.add_argument('--mode', help='formats: record format report; memmap: tfrecord vs memmap backend; '
+                                       'pipeline: queue runners vs tf.data; decode: per record vs batched decode; '
+                                       'grid: the grid of threads/capacities/batch sizes/formats; '
+                                       'augment: input with/without augmentation vs the unet step',
+                        default='formats', choices=('formats', 'memmap', 'pipeline', 'decode', 'grid', 'setting',
+                                                    'augment'))
+    parser.add_argument('--dataset_path', '-d', help='the dir of the data folder (src/ and labels/)',
+                        default="./data/train/")
+    parser.add_argument('--out_dir', '-o', help='the dir for the created tfrecords files',
+                        default="./bench_records/")
+    parser.add_argument('--label_type', '-t', help='label type, rgb or gray', default="rgb")
+    parser.add_argument('--num_classes', '-c', help='inter, the number of classes', default=num_classes, type=int)
+    parser.add_argument('--num_batches', help='inter, the number of timed batches', default=20, type=int)
+    parser.add_argument('--workers', '-w', help='inter, the number of process for record creation',
+                        default=1, type=int)
+    parser.add_argument('--report', help='path of the json report', default=None)
+
+    # --mode grid
+    parser.add_argument('--threads', help='comma separated, the num_queue_threads of the grid',
+                        default=str(get_batch.num_queue_threads))
+    parser.add_argument('--capacities', help='comma separated, the queue_capacity of the grid',
+                        default=str(get_batch.queue_capacity))
+    parser.add_argument('--batch_sizes', help='comma separated, the batch sizes of the grid', default=str(BS))
+    parser.add_argument('--formats', help='comma separated image_format/compression, eg: raw/none,png/gzip',
+                        default='raw/none')
+    # --mode setting (internal)
+    parser.add_argument('--record', help='the record file of the setting', default=None)
+    parser.add_argument('--compression', help='the compression of the setting record file', default='none')
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
@@ -0,0 +1,429 @@
+# ===================================================================================== #
+# coding:utf-8
+"""individual module, benchmark of the network (no input pipeline), model only.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    variants report (--mode variants): unet built with each (depth, upsample_mode, skip_mode, conv_type)
+    of the grid at each of --image_sizes, on a random input held in a local variable
+    (no feed, no input pipeline), and reports
+        --params: the number of trainable parameters
+        --forward_ms: the p50 time of one forward pass of a batch (the logits)
+        --train_ms: the p50 time of one train step of a batch (forward + backward + SGD update)
+        --images_per_sec: of the train step
+    on the CPU set by the environment (CUDA_VISIBLE_DEVICES="" for CPU only).
+    with --train_records, each variant at the size of the records is also trained from scratch for
+    --train_steps and evaluated (--miou on --eval_records), a side-by-side accuracy proxy.
+
+    layers report (--mode layers): static, no session run, the unet graph for the given image_size,
+    batch size, filters and num_classes, one row for each layer of net (conv1_1 ... conv10, in build order),
+    the unet is built in NHWC (the shape column), the macs of an NCHW graph are counted as well (op_macs)
+        --macs: the multiply-adds of the forward pass (Conv2D, conv2d_transpose, depthwise conv, MatMul;
+                bias/relu/pool/resize are not counted)
+        --params: the trainable parameters of the layer scope
+        --act_mb: the forward activation, the output tensor of the layer
+        --train_mb: the training memory of the layer, all the forward tensors of the layer scope
+                    (kept for the backward pass) + the weights and their gradients
+    and the total row: peak_train_mb = the sum of train_mb + 2 x the biggest activation (the gradients of
+    the backward pass), an estimate of the training peak before launching it. with --device_gflops,
+    step_ms is the estimated train step time (3 x the forward macs, 2 flops each).
+
+    recompute report (--mode recompute): for each gradient checkpointing granularity (config.recompute:
+    none, layer, block) at each image size and batch size, a train step on a random input in a new process,
+        --train_ms, images_per_sec: the step time, the recomputation is one more forward pass at most
+        --peak_rss_mb: the peak resident memory of the process, train_mb: minus the memory before the graph
+    to choose the granularity, the tile size and the batch size of the training nodes.
+
+    layout report (--mode layout): forward_ms and train_ms (forward + backward) of unet in NHWC and NCHW
+    (config.data_format) on this cpu; the faster one is written to config.layout_report, config.data_format =
+    'auto' builds unet with it (resolved once by the entry points, unet.resolve_data_format).
+
+    how to use, eg:
+    $ python benchmark_model.py --mode variants --depths 4,5 --upsample transpose,bilinear,resize \
+        --skip concat,add --report variants.json
+    $ python benchmark_model.py --conv_types standard,separable,inverted_residual --image_sizes 256,512 \
+        --train_records ./data_voc/train.tfrecords --eval_records ./data/val.tfrecords --report conv_types.json
+    $ python benchmark_model.py --mode layers --image_size 512 -b 8 --device_gflops 200 --report layers.json
+    $ python benchmark_model.py --mode recompute --image_sizes 256,512,1024 --batch_sizes 4,8 --report recompute.json
+    $ python benchmark_model.py --mode layout
+"""
+# ===================================================================================== #
+
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+
+import numpy as np
+import tensorflow as tf
+
+from config import BS, image_size, num_classes, filters, lr, unet_depth, upsample_mode, skip_mode, conv_type, \
+    layout_report, data_format
+from unet import unet, resolve_data_format
+from benchmark_input import print_rows
+from quantize import record_batches, mean_iou
+
+
+def random_batch(batch_size=BS, size=image_size, class_num=num_classes):
+    """ a random image batch and one-hot label batch, in local variables (initialized once)
+    """
+    images = tf.Variable(tf.random_uniform([batch_size, size, size, 3]), trainable=False,
+                         collections=[tf.GraphKeys.LOCAL_VARIABLES], name='bench_images')
+    labels = tf.Variable(tf.one_hot(tf.random_uniform([batch_size * size * size], 0, class_num, tf.int32),
+                                    class_num), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                         name='bench_labels')
+    return images, labels
+
+
+def run_times(sess, op, num_batches=10, warmup=2):
+    """
+    :return:
+        list of float, the seconds of each sess.run(op) (the warmup runs are not counted)
+    """
+    for _ in range(warmup):
+        sess.run(op)
+    times = []
+    for _ in range(num_batches):
+        start = time.time()
+        sess.run(op)
+        times.append(time.time() - start)
+    return times
+
+
+def model_cost(build_net, batch_size=BS, size=image_size, class_num=num_classes, num_batches=10, warmup=2):
+    """ the parameter number, forward and train step time of a network, in a new graph
+
+    :param
+        build_net: func, input tensor --> net dict with net['output'] the logits (-1, class_num)
+    :return:
+        dict
+    """
+    with tf.Graph().as_default():
+        images, labels = random_batch(batch_size, size, class_num)
+        logits = build_net(images)['output']
+        loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=labels, logits=logits))
+        train_op = tf.train.GradientDescentOptimizer(lr).minimize(loss)
+        params = sum(int(np.prod(v.shape.as_list())) for v in tf.trainable_variables())
+
+        with tf.Session() as sess:
+            sess.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+            forward = run_times(sess, tf.group(logits), num_batches, warmup)
+            train = run_times(sess, train_op, num_batches, warmup)
+
+    return {'params': params,
+            'forward_ms': float(np.percentile(forward, 50)) * 1000,
+            'train_ms': float(np.percentile(train, 50)) * 1000,
+            'images_per_sec': batch_size / float(np.percentile(train, 50))}
+
+
+def short_train_miou(build_net, train_batches, eval_batches, steps=200, class_num=num_classes):
+    """ a quick accuracy proxy of a variant: train it from scratch for steps on the train batches (feed),
+    then the mIoU on the eval batches. only to compare the variants trained the same way, not a final accuracy
+
+    :param
+        train_batches, eval_batches: lists of (normalized images, class id masks), see quantize.record_batches
+    """
+    batch_size, size = train_batches[0][0].shape[:2]
+    with tf.Graph().as_default():
+        images = tf.placeholder(tf.float32, [batch_size, size, size, 3])
+        masks = tf.placeholder(tf.uint8, [batch_size, size, size])
+        logits = build_net(images)['output']
+        labels = tf.reshape(tf.one_hot(masks, class_num), (-1, class_num))
+        loss = tf.reduce_mean(tf.nn.softmax_cross_entropy_with_logits(labels=labels, logits=logits))
+        train_op = tf.train.GradientDescentOptimizer(lr).minimize(loss)
+        predict = tf.nn.softmax(logits)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for step in range(steps):
+                batch_images, batch_masks = train_batches[step % len(train_batches)]
+                sess.run(train_op, {images: batch_images, masks: batch_masks})
+
+            class _Model(object):
+                def predict(self, batch):
+                    return sess.run(predict, {images: batch})
+
+            return mean_iou(_Model(), eval_batches, class_num)[0]
+
+
+def variants_report(depths=(unet_depth,), upsample_modes=(upsample_mode,), skip_modes=(skip_mode,),
+                    conv_types=(conv_type,), sizes=(image_size,), base_filters=filters, batch_size=BS,
+                    num_batches=10, train_records=None, eval_records=None, train_steps=200, data_format_='NHWC'):
+    """ the cost of each unet variant of the grid, at each image size
+
+    :param
+        train_records, eval_records: the tfrecords for the accuracy proxy (short_train_miou), the variants at
+                    the size of the records get a 'miou'; None: no accuracy
+    :return:
+        list of dict, one row for each variant and size
+    """
+    train_batches = eval_batches = None
+    if train_records:
+        train_batches = record_batches(train_records, 50, batch_size)
+        eval_batches = record_batches(eval_records or train_records, 20, batch_size)
+
+    rows = []
+    for size in sizes:
+        for depth in depths:
+            for up in upsample_modes:
+                for skip in skip_modes:
+                    for conv in conv_types:
+                        build = lambda x: unet(x, depth, base_filters, up, skip, conv_type=conv,
+                                               data_format=data_format_)
+                        row = {'variant': 'd{}/{}/{}/{}'.format(depth, up, skip, conv), 'size': size}
+                        row.update(model_cost(build, batch_size, size, num_batches=num_batches))
+                        if train_batches and train_batches[0][0].shape[1] == size:
+                            row['miou'] = short_train_miou(build, train_batches, eval_batches, train_steps)
+                        logging.info("{}".format(row))
+                        rows.append(row)
+    return rows
+
+
+def tensor_bytes(tensor):
+    shape = tensor.shape.as_list()
+    if not shape or None in shape:
+        return 0
+    return int(np.prod(shape)) * tensor.dtype.size
+
+
+def _spatial(tensor, op):
+    """ (batch, height, width) of the 4-d tensor of a conv op, in the data_format of the op
+    """
+    n, a, b, c = tensor.shape.as_list()
+    return (n, b, c) if op.get_attr('data_format') == b'NCHW' else (n, a, b)
+
+
+def op_macs(op):
+    """ the multiply-adds of a conv/matmul op, from the static shapes (the conv in NHWC or NCHW)
+    """
+    if op.type == 'Conv2D':
+        kh, kw, cin, cout = op.inputs[1].shape.as_list()
+        n, h, w = _spatial(op.outputs[0], op)
+        return n * h * w * cout * kh * kw * cin
+    if op.type == 'Conv2DBackpropInput':      # conv2d_transpose, each input pixel times the kernel
+        kh, kw, cout, cin = op.inputs[1].shape.as_list()
+        n, h, w = _spatial(op.inputs[2], op)
+        return n * h * w * cin * kh * kw * cout
+    if op.type == 'DepthwiseConv2dNative':
+        kh, kw, cin, mult = op.inputs[1].shape.as_list()
+        n, h, w = _spatial(op.outputs[0], op)
+        return n * h * w * cin * mult * kh * kw
+    if op.type == 'MatMul':
+        m, k = op.inputs[0].shape.as_list()
+        return m * k * op.outputs[0].shape.as_list()[1]
+    return 0
+
+
+def layer_report(build_net=unet, batch_size=BS, size=image_size, device_gflops=None):
+    """ the static per-layer cost of the network
+
+    :param
+        build_net: func, input tensor --> net dict
+        device_gflops: float or None, the sustained GFLOPS of the machine, for the step time estimate
+    :return:
+        list of dict, one row for each layer and the total row
+    """
+    with tf.Graph().as_default() as graph:
+        net = build_net(tf.placeholder(tf.float32, [batch_size, size, size, 3], name='image'))
+        ops = graph.get_operations()
+        variables = tf.trainable_variables()
+
+        def _in_layer(name, layer):
+            top = name.split('/')[0]
+            return top == layer or top.startswith(layer + '_')
+
+        rows = []
+        for layer, tensor in sorted(net.items(), key=lambda kv: ops.index(kv[1].op)):
+            if layer == 'output':
+                continue
+            layer_ops = [op for op in ops if _in_layer(op.name, layer)]
+            params = sum(int(np.prod(v.shape.as_list())) for v in variables if _in_layer(v.op.name, layer))
+            kept = sum(tensor_bytes(t) for op in layer_ops for t in op.outputs if t.dtype.is_floating)
+            rows.append({'layer': layer,
+                         'shape': 'x'.join(str(d) for d in tensor.shape.as_list()),
+                         'macs': sum(op_macs(op) for op in layer_ops),
+                         'params': params,
+                         'act_mb': tensor_bytes(tensor) / 1024.0 ** 2,
+                         'train_mb': (max(kept, tensor_bytes(tensor)) + 2 * 4 * params) / 1024.0 ** 2})
+
+    total = {'layer': 'total',
+             'macs': sum(r['macs'] for r in rows),
+             'params': sum(r['params'] for r in rows),
+             'act_mb': sum(r['act_mb'] for r in rows),
+             'train_mb': sum(r['train_mb'] for r in rows),
+             'peak_train_mb': sum(r['train_mb'] for r in rows) + 2 * max(r['act_mb'] for r in rows)}
+    if device_gflops:
+        total['step_ms'] = 3 * 2 * total['macs'] / (device_gflops * 1e9) * 1000
+    return rows + [total]
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0     # KB on linux
+
+
+def recompute_setting(granularity, batch_size=BS, size=image_size, num_batches=5, data_format_='NHWC'):
+    """ one setting of the recompute report, in this process
+
+    :return:
+        dict, train_ms, images_per_sec, base_rss_mb (the process before the graph), peak_rss_mb
+    """
+    base = peak_rss_mb()
+    cost = model_cost(lambda x: unet(x, recompute=granularity, data_format=data_format_), batch_size, size,
+                      num_batches=num_batches, warmup=1)
+    return {'train_ms': cost['train_ms'], 'images_per_sec': cost['images_per_sec'],
+            'base_rss_mb': base, 'peak_rss_mb': peak_rss_mb()}
+
+
+def recompute_report(granularities=('none', 'layer', 'block'), sizes=(image_size,), batch_sizes=(BS,),
+                     num_batches=5):
+    """ the peak memory vs the step time of the gradient checkpointing granularities (config.recompute),
+    each setting run in a new process (--mode recompute_setting), the peak RSS is of this setting only.
+    a setting out of memory is reported with the error, the next ones still run.
+
+    :return:
+        list of dict, one row for each setting
+    """
+    rows = []
+    for size in sizes:
+        for batch_size in batch_sizes:
+            for granularity in granularities:
+                row = {'recompute': granularity, 'size': size, 'batch_size': batch_size}
+                try:
+                    out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                                   '--mode', 'recompute_setting', '--recompute', granularity,
+                                                   '--image_size', str(size), '--batch_size', str(batch_size),
+                                                   '--num_batches', str(num_batches)])
+                    row.update(json.loads(out.decode('utf-8').strip().splitlines()[-1]))
+                    row['train_mb'] = row['peak_rss_mb'] - row['base_rss_mb']
+                except subprocess.CalledProcessError as e:
+                    row['error'] = 'exit {}'.format(e.returncode)
+                logging.info("{}".format(row))
+                rows.append(row)
+    return rows
+
+
+def layout_benchmark(batch_size=BS, size=image_size, num_batches=10, report_path=None):
+    """ the forward and train step time of unet in each data format on this machine, and the faster one
+
+    Note:
+        a layout without cpu kernels (eg NCHW conv/pool of a tensorflow built without MKL) fails at the
+        first run, it is reported with the error and never picked.
+
+    :param
+        report_path: the json file of the result, read by unet.resolve_data_format ('auto'); None: not written
+    :return:
+        dict, {'data_format': the faster, 'rows': one row for each layout}
+    """
+    rows = []
+    for data_format in ('NHWC', 'NCHW'):
+        row = {'data_format': data_format, 'batch_size': batch_size, 'size': size}
+        try:
+            row.update(model_cost(lambda x: unet(x, data_format=data_format), batch_size, size,
+                                  num_batches=num_batches))
+        except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError) as e:
+            row['error'] = e.message.splitlines()[0]
+        logging.info("{}".format(row))
+        rows.append(row)
+
+    timed = [row for row in rows if 'train_ms' in row]
+    result = {'data_format': min(timed, key=lambda row: row['train_ms'])['data_format'] if timed else 'NHWC',
+              'rows': rows}
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+def main(_):
+    if FLAGS.mode == 'layout':
+        result = layout_benchmark(FLAGS.batch_size, FLAGS.image_size, FLAGS.num_batches,
+                                  FLAGS.report or layout_report)
+        print_rows(result['rows'])
+        print('the faster data format: {}'.format(result['data_format']))
+        return
+
+    # the layout of the other modes, resolved once ('auto': from the layout report)
+    data_format_ = resolve_data_format(data_format)
+
+    if FLAGS.mode == 'recompute_setting':
+        print(json.dumps(recompute_setting(FLAGS.recompute, FLAGS.batch_size, FLAGS.image_size,
+                                           FLAGS.num_batches, data_format_)))
+        return
+
+    if FLAGS.mode == 'recompute':
+        rows = recompute_report(FLAGS.recompute.split(','), [int(size) for size in FLAGS.image_sizes.split(',')],
+                                [int(b) for b in FLAGS.batch_sizes.split(',')], FLAGS.num_batches)
+        print_rows(rows)
+        if FLAGS.report:
+            with open(FLAGS.report, 'w') as f:
+                json.dump(rows, f, indent=2)
+        return
+
+    if FLAGS.mode == 'layers':
+        rows = layer_report(lambda x: unet(x, base_filters=FLAGS.filters, class_num=FLAGS.num_classes,
+                                           data_format='NHWC'),
+                            FLAGS.batch_size, FLAGS.image_size, FLAGS.device_gflops)
+        print_rows(rows)
+        if FLAGS.report:
+            with open(FLAGS.report, 'w') as f:
+                json.dump(rows, f, indent=2)
+        return
+
+    rows = variants_report([int(d) for d in FLAGS.depths.split(',')], FLAGS.upsample.split(','),
+                           FLAGS.skip.split(','), FLAGS.conv_types.split(','),
+                           [int(size) for size in FLAGS.image_sizes.split(',')], FLAGS.filters, FLAGS.batch_size,
+                           FLAGS.num_batches, FLAGS.train_records, FLAGS.eval_records, FLAGS.train_steps,
+                           data_format_)
+    print_rows(rows)
+
+    if FLAGS.report:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark of the network')
+
+    parser.add_argument('--mode', help='variants: the cost of the unet variants; '
+                                       'layers: the static per-layer macs/params/memory; '
+                                       'recompute: peak memory vs step time of the gradient checkpointing; '
+                                       'layout: step time of NHWC vs NCHW, the faster to --report '
+                                       '(default config.layout_report)',
+                        default='variants', choices=('variants', 'layers', 'recompute', 'recompute_setting',
+                                                     'layout'))
+    parser.add_argument('--depths', help='comma separated, the unet depths of the grid', default=str(unet_depth))
+    parser.add_argument('--upsample', help='comma separated, transpose,bilinear,resize', default=upsample_mode)
+    parser.add_argument('--skip', help='comma separated, concat,add,none', default=skip_mode)
+    parser.add_argument('--conv_types', help='comma separated, standard,separable,inverted_residual',
+                        default=conv_type)
+    parser.add_argument('--image_sizes', help='comma separated, the image sizes of the variants/recompute grid',
+                        default=str(image_size))
+    parser.add_argument('--recompute', help='comma separated, none,layer,block (--mode recompute)',
+                        default='none,layer,block')
+    parser.add_argument('--batch_sizes', help='comma separated, the batch sizes of the recompute grid',
+                        default=str(BS))
+    parser.add_argument('--train_records', help='tfrecords, train each variant for --train_steps for the mIoU',
+                        default=None)
+    parser.add_argument('--eval_records', help='tfrecords of the mIoU, default train_records', default=None)
+    parser.add_argument('--train_steps', help='inter, the steps of the accuracy proxy', default=200, type=int)
+    parser.add_argument('--filters', help='inter, the base filter number', default=filters, type=int)
+    parser.add_argument('--batch_size', '-b', help='inter, the batch size', default=BS, type=int)
+    parser.add_argument('--image_size', help='inter, the image size of the layers/layout report',
+                        default=image_size, type=int)
+    parser.add_argument('--num_classes', '-c', help='inter, the number of classes', default=num_classes, type=int)
+    parser.add_argument('--device_gflops', help='float, the GFLOPS of the machine, for the step time estimate',
+                        default=None, type=float)
+    parser.add_argument('--num_batches', help='inter, the number of timed batches', default=10, type=int)
+    parser.add_argument('--report', help='path of the json report', default=None)
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
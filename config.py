@@ -137,13 +137,54 @@ epochs = 10   # the epoch mean the count, start from 0, so  epochs=10 means 0-9
 iter_each_epoch = dataset_size/BS
 iter_max = iter_each_epoch*epochs
 queue_capacity = 1000
+# bytes, the input queue capacity is queue_memory_budget // bytes of one uint8 element (get_batch.queue_elements),
+# None: queue_capacity elements
+queue_memory_budget = 256 * 1024 ** 2
 
 num_queue_threads = 4
 
+# the input pipeline of get_batch.batch_input,
+# 'queue': queue runners (string_input_producer + shuffle_batch), 'dataset': tf.data
+input_pipeline = 'queue'
+# False: parse/decode each record, then batch (decode-before-batch);
+# True: batch the serialized records, then one tf.parse_example and decode of the whole batch (batch-before-decode)
+batch_decode = False
+
+# keep the decoded uint8 records after the first epoch (the tf.data pipeline, see get_batch.cache_plan),
+# the later epochs are served from the cache and reshuffled
+epoch_cache = False
+cache_max_mb = 1024     # the in-memory cache limit, a bigger set goes to cache_spill_path, or is streamed
+cache_spill_path = None     # eg: "./data_voc/train.cache", on-disk cache file for the sets over cache_max_mb
+
+augmentation = False    # on-the-fly augmentation of the training input (augment.py), train_main --augment
+augment_seed = None     # inter: the op seeds of the augmentation (reproducible with num_queue_threads = 1)
+
+# the label type ('rgb' or 'gray', as dataset_gen --label_type) when a dataset folder (src/ + labels/) is
+# given to get_batch.batch_input instead of a tfrecords file, eg: tfrecord_path_train = "./data/train/"
+folder_label_type = 'rgb'
+synthetic_input = False     # random input batches, no dataset (get_batch.synthetic_batch_input)
+
 filters = 16   # the filter number of the first conv layer
+unet_depth = 5     # the number of encoder blocks of unet (the bottom included)
+upsample_mode = 'transpose'     # 'transpose', 'bilinear' (bilinear initialized transpose) or 'resize' (resize + conv)
+skip_mode = 'concat'    # the skip connection of unet, 'concat', 'add' or 'none'
+conv_type = 'standard'  # the 3x3 conv blocks of unet, 'standard', 'separable' or 'inverted_residual'
+# gradient checkpointing of unet (unet.recompute_segment), the training memory vs one more forward pass:
+# 'none', 'layer' (each conv layer) or 'block' (only the encoder/decoder block boundaries are kept)
+recompute = 'none'
+# the layout of the unet layers, 'NHWC', 'NCHW' (often faster with the MKL/oneDNN cpu kernels) or
+# 'auto': the faster one of benchmark_model.py --mode layout on this machine, read from layout_report
+# (written by the layout benchmark, run it first)
+data_format = 'NHWC'
+layout_report = './layout.json'
 
 tfrecord_path_train = "./data_voc/train.tfrecords"
 tfrecord_path_val = "./data/val.tfrecords"
+record_compression = 'none'     # 'none', 'gzip' or 'zlib', must be same as dataset_gen --compression
+
+# the dataset stats file written by dataset_gen (./data_voc/train.stats.json), None: the fixed mean [104, 117, 123]
+stats_path = None
+class_weighting = False     # weight the loss by the class_weights of stats_path (class imbalance)
 
 
 logging.info("\nparameters:\nbatch_normalization={}\nclass_num={}\n"
@@ -35,92 +35,435 @@ import cv2
 import sys
 import argparse
 import time
+import zlib
+import tempfile
+import functools
+import multiprocessing
+import logging
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import label_codec
+import dataset_manifest
+import record_schema
+import memmap_dataset
+import dataset_stats
+import record_index
+
+TILE_CHUNK = 32     # the tiles of a scene in one chunk (sample_tasks), bounds the memory of the tiling
+
+try:
+    from osgeo import gdal     # optional, windowed reading of large .tif scenes
+except ImportError:
+    gdal = None
+
+
+def label_class_id(rgb_mask, class_num, type_, label_path=''):
+    """ the (h, w, 3) RGB label image --> (h, w) class id matrix, uint8
 
+    :param
+        type_: 'rgb' (VOC colormap) or 'gray' (the class id is the pixel value)
+    """
+    if type_ == "rgb":
+        return label_codec.get_codec('voc').encode(rgb_mask)
 
-def rgb_label_input(rgb_label_image, class_num, image_size):
-    """only for VOC dataset segment, (need change the num_classes, COLORMAP for other dataset)
-    transfer the RGB label image(h, w, 3) to input label matrix (h, w, num_classes),
-    mapping the rgb value to class distribution
+    mask = rgb_mask[:, :, 0]
+    if mask.max() >= class_num:
+        raise ValueError("label {} has class id {} >= num_classes {}".format(label_path, mask.max(), class_num))
+    return mask
 
+
+def load_sample(image_path, label_path, image_size, class_num, type_):
+    """read, resize and label encode one image and its label
     Note:
-        VOC rgb segment label, each color related to particular class,
-        transf_value: is used for rgb value to class id which mapping to class name
-        label_1d: is a (h, w) matrix , which's value is the class id. the label_1d then
-        transform to label (h, w, num_)
+        the paths come from dataset_manifest.scan_dataset (one indexed scan of src/ and labels/)
 
-        the label inpput network is not RGB image !!!!!!
+    :return
+        image: uint8 array (image_size, image_size, 3), RGB
+        mask: uint8 array (image_size, image_size), class id (record_schema.CLASS_ID)
+    """
+    image = cv2.imread(image_path)
+    if image is None:
+        raise IOError("can not read image {}".format(image_path))
 
+    image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_LINEAR)
+    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
 
+    mask = cv2.imread(label_path)
+    if mask is None:
+        raise IOError("can not read label {}".format(label_path))
 
-    :arg
-        rgb_label_image: a rgb image with shape (h, w, 3), dtype is uint8
+    # nearest, the linear interpolation creates new colors/ids at the class borders
+    mask = cv2.resize(mask, (image_size, image_size), interpolation=cv2.INTER_NEAREST)
 
-    :return
-        a np array (only has value 0 and 1) with shape (h, w, num_classes), dtype is int64
+    mask = cv2.cvtColor(mask, cv2.COLOR_RGB2BGR)    # only for VOC label which channel/colormap is (R,G,B)
+    mask = label_class_id(mask, class_num, type_, label_path)
+
+    return image, mask
 
-        but you can change to uint8 by using astype(np.uint8)
-        the third dimension  is the class distribution(which index =1, means which class)
-        eg:  [0 0 0 1 0 0 0 ...]  means 3 class of class and then mapping to the class name.
+
+def encode_image(image, image_format, jpeg_quality=95):
+    """ the image bytes of the record
+    Note:
+        'raw' is image.tobytes(); 'png'/'jpeg' is the encoded file bytes,
+        cv2.imencode expects BGR, so the RGB image is converted back before encoding
+        (and tf.image.decode_image gives RGB again at get_batch)
     """
+    if image_format == 'raw':
+        return image.tobytes()
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    if image_format == 'png':
+        ok, buf = cv2.imencode('.png', image)
+    else:
+        ok, buf = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality])
+    if not ok:
+        raise ValueError("cv2.imencode failed, format: {}".format(image_format))
+    return buf.tobytes()
 
-    VOC_COLORMAP = [[0, 0, 0], [128, 0, 0], [0, 128, 0], [128, 128, 0],
-                    [0, 0, 128], [128, 0, 128], [0, 128, 128], [128, 128, 128],
-                    [64, 0, 0], [192, 0, 0], [64, 128, 0], [192, 128, 0],
-                    [64, 0, 128], [192, 0, 128], [64, 128, 128], [192, 128, 128],
-                    [0, 64, 0], [128, 64, 0], [0, 192, 0], [128, 192, 0],
-                    [0, 64, 128]]
 
-    VOC_CLASSES = ['background', 'aeroplane', 'bicycle', 'bird', 'boat',
-                   'bottle', 'bus', 'car', 'cat', 'chair', 'cow',
-                   'diningtable', 'dog', 'horse', 'motorbike', 'person',
-                   'potted plant', 'sheep', 'sofa', 'train', 'tv/monitor']
+def serialize_example(name, image, mask, image_format='raw', jpeg_quality=95, scene=None, offset=None):
+    """ build the tf.train.Example of one sample, and serialize it to string
+    Note:
+        the mask is the (h, w) class id matrix, see record_schema
+        if the image is encoded (png/jpeg), the mask is stored as png (lossless, class id)
+        scene, offset: only for the tiles, the scene name and the (y, x) pixel offset of the tile
+    """
+    mask_format = 'raw' if image_format == 'raw' else 'png'
+    feature_dict = {
+                    'name': record_schema.bytes_feature(name),
+                    'image': record_schema.bytes_feature(encode_image(image, image_format, jpeg_quality)),
+                    'mask': record_schema.bytes_feature(encode_image(mask, mask_format)),
+                    'schema_version': record_schema.int64_feature(record_schema.SCHEMA_VERSION),
+                    'image_format': record_schema.bytes_feature(image_format),
+                    'mask_format': record_schema.bytes_feature(mask_format)}
+    if scene is not None:
+        feature_dict['scene'] = record_schema.bytes_feature(scene)
+        feature_dict['offset_y'] = record_schema.int64_feature(offset[0])
+        feature_dict['offset_x'] = record_schema.int64_feature(offset[1])
+
+    example = tf.train.Example(features=tf.train.Features(feature=feature_dict))
+    return example.SerializeToString()
+
+
+def windowed(path):
+    """ True if the windows of the scene are read from the file (gdal, .tif), without decoding the whole image
+    """
+    return gdal is not None and path.lower().endswith(('.tif', '.tiff'))
 
-    transf_value = np.zeros((256**3), dtype=np.uint8)
 
-    for i, colormap in enumerate(VOC_COLORMAP):
-        transf_value[(colormap[0]*256*256 + colormap[1]*256 + colormap[2])] = i
+class SceneReader(object):
+    """ read (h, w) windows of a large scene image, RGB uint8
+    Note:
+        for .tif/.tiff and if gdal is installed, only the window is read from the file,
+        so the memory is bounded by the tile size, not the scene size.
+        otherwise the whole image is read once by cv2, and the windows are sliced from it.
+        the window out of the scene is zero padded.
+    """
 
-    '''idx = (rgb_label_image[:, :, 0]*256*256 + rgb_label_image[:, :, 1]*256 + rgb_label_image[:, :, 2])
-    label_2d = transf_value[idx]'''
-    label_2d = np.zeros((image_size, image_size), dtype=np.uint8)
-    for i in range(image_size):
-        for j in range(image_size):
-            idx = (rgb_label_image[i, j, 0] * 256 * 256 + rgb_label_image[i, j, 1] * 256 + rgb_label_image[i, j, 2])
-            label_2d[i, j] = transf_value[idx]
+    def __init__(self, path):
+        self.path = path
+        self.dataset = None
+        self.image = None
+        if windowed(path):
+            self.dataset = gdal.Open(path)
+            if self.dataset is None:
+                raise IOError("can not read scene {}".format(path))
+            self.shape = (self.dataset.RasterYSize, self.dataset.RasterXSize)
+        else:
+            self.image = cv2.imread(path)
+            if self.image is None:
+                raise IOError("can not read scene {}".format(path))
+            self.shape = self.image.shape[:2]
+
+    def read(self, y, x, h, w):
+        h_, w_ = min(h, self.shape[0] - y), min(w, self.shape[1] - x)
+        if self.dataset is not None:
+            window = self.dataset.ReadAsArray(x, y, w_, h_)    # (bands, h, w) or (h, w), band order RGB
+            if window.dtype != np.uint8:
+                raise ValueError("scene {} is {}, only uint8 is supported".format(self.path, window.dtype))
+            window = np.dstack([window] * 3) if window.ndim == 2 else window[:3].transpose(1, 2, 0)
+        else:
+            window = cv2.cvtColor(self.image[y:y + h_, x:x + w_], cv2.COLOR_BGR2RGB)
 
-    h, w, _ = rgb_label_image.shape
-    label = np.zeros(shape=(h, w, class_num), dtype=np.uint8)
+        if (h_, w_) != (h, w):
+            window = np.pad(window, ((0, h - h_), (0, w - w_), (0, 0)), 'constant')
+        return window
 
-    for i in range(h):
-        for j in range(w):
-            k = label_2d[i, j]
-            label[i, j, k] = 1
 
-    return label
+def tile_starts(length, tile, stride):
+    """ the start positions of the tiles along one axis, the last tile is aligned to the end of the scene
+    """
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, stride))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return starts
+
+
+def tile_positions(shape, tile, stride):
+    """ the (y, x) of all the tiles of a (h, w) scene
+    """
+    return [(y, x) for y in tile_starts(shape[0], tile, stride) for x in tile_starts(shape[1], tile, stride)]
 
 
-def gray_label_input(gray_image, class_num):
-    """ the class name and id is changeable
+def iter_tiles(image_path, label_path, tile, class_num, type_, stride=None,
+               skip_background=False, max_background=1.0, nodata=None, positions=None):
+    """ cut a scene and its label into (tile, tile) patches, no resize
 
     :param
-        gray_image:  2d image /a matrix with shape (h, w); this equal to label_2d in rgb_label_maker func
+        stride: inter, the step between two tiles, stride < tile means overlapping, default = tile
+        skip_background: bool, skip the tiles which background (class 0) fraction >= max_background
+        nodata: inter or None, skip the tiles which pixels all equal to nodata in all channel
+        positions: None, all the tiles; or list of (y, x), only these tiles (a chunk, see sample_tasks)
+    :return:
+        a generator of (tile name, (y, x), image (tile, tile, 3) RGB, mask (tile, tile) class id)
+    """
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    image_reader = SceneReader(image_path)
+    label_reader = SceneReader(label_path)
+    if image_reader.shape != label_reader.shape:
+        raise ValueError("scene {} {} and label {} {} have different size".format(
+            image_path, image_reader.shape, label_path, label_reader.shape))
+
+    for y, x in positions if positions is not None else tile_positions(image_reader.shape, tile, stride or tile):
+        image = image_reader.read(y, x, tile, tile)
+        if nodata is not None and (image == nodata).all():
+            continue
+
+        mask = label_class_id(label_reader.read(y, x, tile, tile), class_num, type_, label_path)
+        if skip_background and np.mean(mask == 0) >= max_background:
+            continue
+
+        yield "{}_{}_{}".format(name, y, x), (y, x), image, mask
+
+
+def sample_tasks(sample, image_size, tiling=None):
+    """ the pool tasks of one sample, a generator (the tasks are built as the pool takes them)
+
+    Note:
+        a windowed scene (gdal, the image and the label .tif) is cut into chunks of TILE_CHUNK tiles,
+        one task each: its size is read from the file header, each task reads only the windows of its chunk.
+        another scene is one task: the worker decodes the scene and its label once, and writes its tiles
+        chunk by chunk to a spill file (see Spill), the main process reads them back chunk by chunk.
+        either way a worker holds (and sends back) at most one chunk of tiles.
+    :return:
+        (sample, positions, last): positions is None for a resized image or a whole scene, or the (y, x) of
+        the chunk; last is True for the last task of the sample
+    """
+    if tiling is None or not (windowed(sample[1]) and windowed(sample[2])):
+        yield sample, None, True
+        return
+    positions = tile_positions(SceneReader(sample[1]).shape, image_size, tiling.get('stride') or image_size)
+    for i in range(0, len(positions), TILE_CHUNK):
+        yield sample, positions[i:i + TILE_CHUNK], i + TILE_CHUNK >= len(positions)
+
+
+def sample_results(results):
+    """ the results of the pool for the tasks of one sample (until its last one)
 
     :return:
-        a np array (only has value 0 and 1) with shape (h, w, num_classes), dtype is int64
+        a generator of (name, records, partial stats)
+    """
+    while True:
+        name, records, stats, last = next(results)
+        yield name, records, stats
+        if last:
+            return
+
+
+def load_records(task, image_size, class_num, type_, tiling=None):
+    """ read one task (see sample_tasks), one resized image or one chunk of tiles
+
+    :param
+        task: ((name, image path, label path), positions, last)
+        tiling: None, resize the whole image to image_size;
+                or dict, the kwargs of iter_tiles (stride, skip_background, max_background, nodata),
+                cut the scene into image_size tiles
+    :return
+        list of (record name, image, mask, scene, offset), scene and offset are None if not tiling
+    """
+    (name, image_path, label_path), positions, _ = task
+    if tiling is None:
+        image, mask = load_sample(image_path, label_path, image_size, class_num, type_)
+        return [(name, image, mask, None, None)]
+
+    return [(tile_name, image, mask, name, offset)
+            for tile_name, offset, image, mask in iter_tiles(image_path, label_path, image_size, class_num,
+                                                             type_, positions=positions, **tiling)]
+
+
+class Spill(object):
+    """ the records of a whole scene task, written by the worker to a temporary file (one pickle per chunk);
+    iterated once by the main process, record by record, the file is removed at the end
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        try:
+            with open(self.path, 'rb') as f:
+                while True:
+                    try:
+                        chunk = pickle.load(f)
+                    except EOFError:
+                        break
+                    for record in chunk:
+                        yield record
+        finally:
+            os.remove(self.path)
+
+
+def run_task(task, image_size, class_num, type_, tiling, convert, spill_dir=None):
+    """ one task of sample_tasks in the worker
+
+    :param
+        convert: func, list of records of load_records --> list of the records sent to the main process
+        spill_dir: the folder of the spill files (a whole scene task), None: the system temp folder
+    :return
+        (name, records (list or Spill), partial stats, last)
+    """
+    (name, image_path, label_path), positions, last = task
+    if tiling is None or positions is not None:
+        records = load_records(task, image_size, class_num, type_, tiling)
+        return name, convert(records), \
+            dataset_stats.sample_stats([(image, mask) for _, image, mask, _, _ in records], class_num), last
+
+    # the whole scene, decoded once by iter_tiles, spilled chunk by chunk
+    accumulator = dataset_stats.StatsAccumulator(class_num)
+    fd, path = tempfile.mkstemp(suffix='.spill', dir=spill_dir)
+    with os.fdopen(fd, 'wb') as f:
+        chunk = []
+        tiles = iter_tiles(image_path, label_path, image_size, class_num, type_, **tiling)
+        for tile_name, offset, image, mask in tiles:
+            chunk.append((tile_name, image, mask, name, offset))
+            accumulator.add(image, mask)
+            if len(chunk) == TILE_CHUNK:
+                pickle.dump(convert(chunk), f, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+        if chunk:
+            pickle.dump(convert(chunk), f, pickle.HIGHEST_PROTOCOL)
+    return name, Spill(path), accumulator.partial(), last
+
+
+def encode_sample(task, image_size, class_num, type_, image_format='raw', jpeg_quality=95, tiling=None,
+                  spill_dir=None):
+    """worker func of the process pool, must be a module level func (pickle)
+
+    :param
+        task: see sample_tasks
+        tiling: see load_records
+    :return
+        (name, [(record name, serialized example), ...], partial stats, last), see run_task.
+        one record, or one for each tile of the chunk. the partial stats see dataset_stats.sample_stats
+    """
+    return run_task(task, image_size, class_num, type_, tiling,
+                    lambda records: [(record_name, serialize_example(record_name, image, mask, image_format,
+                                                                     jpeg_quality, scene=scene, offset=offset))
+                                     for record_name, image, mask, scene, offset in records], spill_dir)
+
+
+def load_arrays(task, image_size, class_num, type_, tiling=None, spill_dir=None):
+    """worker func of the process pool for create_memmap
+
+    :return
+        (name, [(record name, image, mask), ...], partial stats, last), see run_task
     """
+    return run_task(task, image_size, class_num, type_, tiling,
+                    lambda records: [(record_name, image, mask) for record_name, image, mask, _, _ in records],
+                    spill_dir)
+
+
+def stats_path(record_path_):
+    """ the stats file of the record file, ./data/train.tfrecords --> ./data/train.stats.json
+    """
+    return os.path.splitext(record_path_)[0] + '.stats.json'
+
+
+def shard_of(name, shards):
+    """ the shard index of the sample, deterministic (crc32 of the name)
+    """
+    return (zlib.crc32(tf.compat.as_bytes(name)) & 0xffffffff) % shards
+
+
+def shard_paths(record_path_, shards):
+    """ the tfrecord file list, eg: ./data/train.tfrecords, 4 -->
+    ./data/train-00000-of-00004.tfrecords ... ./data/train-00003-of-00004.tfrecords
+
+    if shards == 1, the record_path_ itself
+    """
+    if shards == 1:
+        return [record_path_]
+    base, ext = os.path.splitext(record_path_)
+    return ["{}-{:05d}-of-{:05d}{}".format(base, k, shards, ext or ".tfrecords") for k in range(shards)]
+
+
+class ShardWriter(object):
+    """ TFRecordWriter which also tracks the byte offset of each record in the file
+    Note:
+        the tfrecord format of one record is:
+        uint64 length, uint32 masked_crc32_of_length, byte data[length], uint32 masked_crc32_of_data
+        so each record takes length + 16 bytes. the offset is None for the compressed file.
+    """
+
+    def __init__(self, path, compression='none'):
+        self.writer = tf.python_io.TFRecordWriter(path, options=record_schema.record_options(compression))
+        self.offset = 0 if compression == 'none' else None
+
+    def write(self, serialized):
+        """
+        :return
+            (offset, length) of the written record
+        """
+        self.writer.write(serialized)
+        offset = self.offset
+        if self.offset is not None:
+            self.offset += len(serialized) + 16
+        return offset, len(serialized)
+
+    def close(self):
+        self.writer.close()
 
-    h, w = gray_image.shape
-    label = np.zeros(shape=(h, w, class_num), dtype=np.uint8)
 
-    for i in range(h):
-        for j in range(w):
-            k = gray_image[i, j]
-            label[i, j, k] = 1
+class RecordStream(object):
+    """ sequential reader of a record file, get(index) only moves forward
+    """
+
+    def __init__(self, path, compression='none'):
+        self.path = path
+        self.compression = compression
+        self._iter = None
+        self._index = -1
+        self._record = None
 
-    return label
+    def get(self, index):
+        if self._iter is None:
+            self._iter = tf.python_io.tf_record_iterator(self.path, record_schema.record_options(self.compression))
+        while self._index < index:
+            self._record = next(self._iter)
+            self._index += 1
+        return self._record
 
 
-def create_tfrecord(record_path_, dataset_path_, process_bar_, image_size, class_num, type_):
+def count_records(path, compression='none'):
+    """ the number of complete records at the beginning of the file (the tail cut by a crash is not counted)
+    """
+    count = 0
+    try:
+        for _ in tf.python_io.tf_record_iterator(path, record_schema.record_options(compression)):
+            count += 1
+    except tf.errors.DataLossError:
+        pass
+    return count
+
+
+def create_tfrecord(record_path_, dataset_path_, process_bar_, image_size, class_num, type_,
+                    workers=1, shards=1, image_format='raw', compression='none', jpeg_quality=95,
+                    incremental=True, tiling=None):
     """method, to create a TFrecord file, a byte data files,
     which contains the tf.train.Example() protocol memory block (protocol buffer).
 
@@ -142,13 +485,61 @@ def create_tfrecord(record_path_, dataset_path_, process_bar_, image_size, class
 
         3) example  //set up features, be careful to write feature dict
         * check and make sure: "img.tobytes & tf.train.BytesList" pair; "value = []";
+        * the mask is stored as (h, w) class id, not one-hot (record_schema.CLASS_ID),
+          the one-hot expansion is done in get_batch.batch_input
 
         4) write into tfrecord // TFRecordWriter
 
 
 
+        5) parallel and sharded (workers > 1 or shards > 1)
+            a process pool does the read/resize/label encode/serialize (encode_sample),
+            the main process owns the writers and the process bar, so the count stays correct.
+            each image goes to shard crc32(name) % shards, that is deterministic and
+            does not depend on the listdir order or on the number of workers.
+            the shard files are named as train-00000-of-00004.tfrecords (see shard_paths)
+
+        6) encoded and compressed
+            image_format 'png'/'jpeg' stores the encoded image bytes (and the mask as png),
+            compression 'gzip'/'zlib' compresses the whole record file,
+            the same compression must be given to get_batch.batch_input (config.record_compression)
+
+        7) incremental and resumable (see dataset_manifest)
+            a manifest (train.manifest.json) stores for each sample the sha1/mtime of its files and
+            the shard/index/offset of its record. at the next run only the shards with added, changed or
+            deleted samples are rewritten, the unchanged samples of that shards are copied record by record
+            (no decode/encode). a journal is written during the build, so an interrupted build
+            is resumed from the last written sample. incremental=False is a full rebuild.
+
+        8) tiles (tiling is not None)
+            instead of resizing the whole image, the scene is cut into overlapping image_size tiles
+            (stride, see iter_tiles), each tile is a record named scene_y_x, with the 'scene', 'offset_y'
+            and 'offset_x' features. the tiles all background / nodata can be skipped.
+            the scene windows are read by SceneReader (gdal windowed reading for .tif if installed).
+            a scene is encoded in chunks of TILE_CHUNK tiles (sample_tasks), written as they come,
+            the memory is bounded by one chunk per worker, not by the scene times the overlap.
+            without gdal a scene is decoded once by its worker, the chunks go through a spill file next to
+            the record file.
+
+        9) statistics (see dataset_stats)
+            the per-channel mean/std and the per-class pixel histogram are collected in the same pass
+            (each worker returns the partial stats of its sample, kept in the manifest),
+            and written to train.stats.json (stats_path) at the end.
+
+        10) index (see record_index)
+            for the not compressed files, the offset index (train.index.json) is written from the
+            manifest: record name --> (shard, offset, length), for the random access by name.
+
     :param
-        path_: the path to data, (data/train, or data/test)
+        record_path_: the path of tfrecord file, (data/train.tfrecords),
+                    if shards > 1, it is the base name of the shard files
+        workers: inter, the number of process of the pool, 1 means no pool
+        shards: inter, the number of output tfrecord files
+        image_format: string, 'raw', 'png' or 'jpeg'
+        compression: string, 'none', 'gzip' or 'zlib'
+        jpeg_quality: inter, 0-100, only for 'jpeg'
+        incremental: bool, reuse the records of the last build (manifest) and of the interrupted build (journal)
+        tiling: None or dict, the kwargs of iter_tiles, see encode_sample
         dataset_path_: the path to the src image, (only .jpg or .png format),
                         and the labels are 2 channel (no matter rgb or gray),
                         if gray, then the 3 channel are have same value.
@@ -158,56 +549,188 @@ def create_tfrecord(record_path_, dataset_path_, process_bar_, image_size, class
 
     """
 
-    writer = tf.python_io.TFRecordWriter(record_path_)
-
+    build_options = {'image_size': int(image_size), 'class_num': int(class_num), 'type': type_,
+                     'shards': shards, 'image_format': image_format, 'compression': compression,
+                     'jpeg_quality': jpeg_quality, 'schema_version': record_schema.SCHEMA_VERSION,
+                     'tiling': tiling, 'stats_version': dataset_stats.STATS_VERSION}
+    files = shard_paths(record_path_, shards)
+    m_path = dataset_manifest.manifest_path(record_path_)
+    j_path = dataset_manifest.journal_path(record_path_)
+
+    old, resume = {}, {}
+    if incremental:
+        old = dataset_manifest.load_manifest(m_path, build_options)
+        done, partial = dataset_manifest.load_journal(j_path, build_options)
+
+        # the shards finished by the interrupted build replace the old content of that shards
+        for k, entries in done.items():
+            if k not in partial and os.path.exists(files[k] + '.tmp'):
+                os.rename(files[k] + '.tmp', files[k])
+            old = dict((n, e) for n, e in old.items() if e['shard'] != k)
+            old.update(entries)
+
+        # the records of the unfinished shard are reused, if they are readable (not cut by the crash)
+        for k, entries in partial.items():
+            if os.path.exists(files[k] + '.tmp'):
+                os.rename(files[k] + '.tmp', files[k] + '.resume')
+                valid = count_records(files[k] + '.resume', compression)
+                resume.update((e['name'], e) for e in entries if e['index'] + len(e['records']) <= valid)
+
+        if done or partial:
+            # the manifest matches the shard files on disk again, and a new journal is started
+            dataset_manifest.save_manifest(m_path, build_options, files, old)
+
+    # the entries of missing shard files can not be copied, re-encode them
+    old = dict((n, e) for n, e in old.items() if os.path.exists(files[e['shard']]))
+
+    samples = dataset_manifest.scan_dataset(dataset_path_)
+    current, by_shard, dirty = {}, {}, set()
+    for name, (image_path, label_path) in samples.items():
+        info = dataset_manifest.sample_info(image_path, label_path, old.get(name, resume.get(name)))
+        info['shard'] = shard_of(name, shards)
+        current[name] = info
+        by_shard.setdefault(info['shard'], []).append(name)
+        if not dataset_manifest.same_content(info, old.get(name)):
+            dirty.add(info['shard'])
+    for name, entry in old.items():
+        if name not in current:
+            dirty.add(entry['shard'])
+    dirty.update(k for k in range(shards) if not os.path.exists(files[k]))
+
+    # where each sample of the dirty shards comes from: copy the records ('old', 'resume') or encode (None)
+    source = {}
+    for k in dirty:
+        for name in by_shard.get(k, []):
+            if dataset_manifest.same_content(current[name], resume.get(name)):
+                source[name] = ('resume', resume[name])
+            elif dataset_manifest.same_content(current[name], old.get(name)):
+                source[name] = ('old', old[name])
+            else:
+                source[name] = None
+
+    todo = [(name, current[name]['src'], current[name]['label'])
+            for k in sorted(dirty) for name in sorted(by_shard.get(k, [])) if source[name] is None]
+    logging.info("{}: {} samples, {} shards to write, {} samples to encode".format(
+        record_path_, len(current), len(dirty), len(todo)))
+
+    # the process bar counts the samples written into the dirty shards
+    process_bar_.max_steps = max(len(source), 1)
+
+    # one task for each image or scene, or for each chunk of tiles of a windowed scene
+    tasks = (task for sample in todo for task in sample_tasks(sample, image_size, tiling))
+
+    encode = functools.partial(encode_sample, image_size=image_size, class_num=class_num, type_=type_,
+                               image_format=image_format, jpeg_quality=jpeg_quality, tiling=tiling,
+                               spill_dir=os.path.dirname(os.path.abspath(record_path_)))
+    pool = None
+    if workers > 1 and todo:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(encode, tasks, chunksize=1 if tiling else 4)
+    else:
+        results = (encode(task) for task in tasks)
+
+    journal = dataset_manifest.Journal(j_path, build_options)
+    entries = dict((n, dict(old[n], **current[n])) for n in current if current[n]['shard'] not in dirty)
     count = 1
+    try:
+        for k in sorted(dirty):
+            journal.start(k)
+            streams = {'old': RecordStream(files[k], compression),
+                       'resume': RecordStream(files[k] + '.resume', compression)}
+            writer = ShardWriter(files[k] + '.tmp', compression)
+
+            index = 0
+            for name in sorted(by_shard.get(k, [])):
+                # the records are written chunk by chunk (encoded) or one by one (copied), never all the
+                # tiles of a scene at once
+                if source[name] is None:
+                    chunks = sample_results(results)
+                else:
+                    stream, prev = source[name]
+                    chunks = [(name, ((record[0], streams[stream].get(prev['index'] + i))
+                                      for i, record in enumerate(prev['records'])), prev['stats'])]
+
+                entries[name] = dict(current[name], index=index, records=[])
+                accumulator = dataset_stats.StatsAccumulator(class_num)
+                for chunk_name, records, stats in chunks:
+                    assert chunk_name == name
+                    for record_name, serialized in records:
+                        offset, length = writer.write(serialized)
+                        entries[name]['records'].append([record_name, offset, length])
+                    accumulator.merge(stats)
+                entries[name]['stats'] = accumulator.partial()
+                index += len(entries[name]['records'])
+                journal.entry(name, entries[name])
+
+                process_bar_.show_process(count)
+                count = count + 1
+
+            writer.close()
+            journal.done(k)
+            os.rename(files[k] + '.tmp', files[k])
+            if os.path.exists(files[k] + '.resume'):
+                os.remove(files[k] + '.resume')
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    dataset_manifest.save_manifest(m_path, build_options, files, entries)
+    journal.remove()
+
+    accumulator = dataset_stats.StatsAccumulator(class_num)
+    for entry in entries.values():
+        accumulator.merge(entry['stats'])
+    accumulator.save(stats_path(record_path_))
+
+    if compression == 'none':
+        record_index.save_index(record_index.index_path(record_path_), record_index.index_from_manifest(files, entries))
+    for path in files:
+        if os.path.exists(path + '.resume'):
+            os.remove(path + '.resume')
+
+
+def create_memmap(out_dir, dataset_path_, process_bar_, image_size, class_num, type_, workers=1, tiling=None):
+    """method, to create the memory-mapped array dataset (see memmap_dataset), instead of the tfrecord file.
+    Note:
+        the images and masks are written as fixed-shape uint8 raw arrays, so get_batch.memmap_batch_input
+        can index the batches directly from the OS page cache, no protobuf parsing.
+        the same load/resize/label encode/tiling as create_tfrecord, but always a full rebuild (no manifest).
 
-    for image_name in os.listdir(dataset_path_ + "src/"):
-        name = os.path.splitext(image_name)[0]
-
-        image_path = dataset_path_ + "src/" + name + ".jpg"
-        image = cv2.imread(image_path)
-        if np.array(image).shape == ():
-            image_path = dataset_path_ + "src/" + name + ".png"
-            image = cv2.imread(image_path)
-
-        image = cv2.resize(image, (image_size, image_size), interpolation=cv2.INTER_LINEAR)
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        i = count
-        process_bar_. show_process(i)
-
-        image_raw = image.tobytes()
-
-        label_path = dataset_path_ + "labels/" + name + ".png"
-        mask = cv2.imread(label_path)
-        if np.array(mask).shape == ():
-            label_path = dataset_path_ + "labels/" + name + ".jpg"
-            mask = cv2.imread(label_path)
-
-        mask = cv2.resize(mask, (image_size, image_size), interpolation=cv2.INTER_LINEAR)
-
-        if type_ == "rgb":
-            mask = cv2.cvtColor(mask, cv2.COLOR_RGB2BGR)    # only for VOC label which channel/colormap is (R,G,B)
-            mask = rgb_label_input(mask, class_num, image_size)    # output (h, w, num_classes)
-        else:
-            if type_ == "gray":
-                mask = mask[:, :, 0]
-                mask = gray_label_input(mask, class_num)
-
-        mask_raw = mask.tobytes()
-
-        feature_dict = {
-                        'name': tf.train.Feature(bytes_list=tf.train.BytesList(value=[name])),
-                        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_raw])),
-                        'mask': tf.train.Feature(bytes_list=tf.train.BytesList(value=[mask_raw]))}
-
-        example = tf.train.Example(features=tf.train.Features(feature=feature_dict))
-
-        writer.write(example.SerializeToString())
-
-        count = count+1
+    :param
+        out_dir: the folder of the array files, (./data/train_memmap/)
+        see create_tfrecord for the others
+    """
+    samples = dataset_manifest.scan_dataset(dataset_path_)
+    tasks = (task for name in sorted(samples)
+             for task in sample_tasks((name, samples[name][0], samples[name][1]), image_size, tiling))
+    process_bar_.max_steps = max(len(samples), 1)
+
+    load = functools.partial(load_arrays, image_size=image_size, class_num=class_num, type_=type_, tiling=tiling,
+                             spill_dir=os.path.dirname(os.path.abspath(out_dir.rstrip('/'))))
+    pool = None
+    if workers > 1 and samples:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap(load, tasks, chunksize=1 if tiling else 4)
+    else:
+        results = (load(task) for task in tasks)
+
+    writer = memmap_dataset.MemmapWriter(out_dir, image_size, class_num)
+    accumulator = dataset_stats.StatsAccumulator(class_num)
+    count = 1
+    try:
+        for _, records, stats, last in results:
+            for record_name, image, mask in records:
+                writer.write(record_name, image, mask)
+            accumulator.merge(stats)
+
+            if last:
+                process_bar_.show_process(count)
+                count = count + 1
+    finally:
+        if pool is not None:
+            pool.terminate()
     writer.close()
+    accumulator.save(os.path.join(out_dir, memmap_dataset.STATS))
 
 
 class ShowProcess():
@@ -273,23 +796,32 @@ class ShowProcess():
 
 
 def main(_):
-    ds = 0
-    for fn in os.listdir(FLAGS.dataset_path + "src/"):
-        ds = ds + 1
-    dataset_size = ds
-    max_steps = dataset_size
+    max_steps = len(dataset_manifest.scan_dataset(FLAGS.dataset_path))
+
+    tiling = None
+    if FLAGS.tile:
+        tiling = {'stride': FLAGS.tile_stride, 'skip_background': FLAGS.skip_background,
+                  'max_background': FLAGS.max_background, 'nodata': FLAGS.nodata}
 
     process_bar_ = ShowProcess(max_steps, '{}: TFRecords Done!'.format(FLAGS.record_path))
 
+    if FLAGS.output_format == 'memmap':
+        create_memmap(FLAGS.record_path, FLAGS.dataset_path, process_bar_, FLAGS.image_size, FLAGS.num_classes,
+                      FLAGS.label_type, workers=FLAGS.workers, tiling=tiling)
+        return
+
     create_tfrecord(FLAGS.record_path, FLAGS.dataset_path, process_bar_,
-                    FLAGS.image_size, FLAGS.num_classes, FLAGS.label_type)
+                    FLAGS.image_size, FLAGS.num_classes, FLAGS.label_type,
+                    workers=FLAGS.workers, shards=FLAGS.shards, image_format=FLAGS.image_format,
+                    compression=FLAGS.compression, jpeg_quality=FLAGS.jpeg_quality,
+                    incremental=not FLAGS.rebuild, tiling=tiling)
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description='Eval Unet on given tfrecords.')
 
-    parser.add_argument('--image_size', help='inter, size of reshape', default=256)
+    parser.add_argument('--image_size', help='inter, size of reshape', default=256, type=int)
     parser.add_argument('--num_classes', '-c', help='inter, the number of classes',
                         required=True, default=21, type=np.uint8)
 
@@ -297,12 +829,40 @@ if __name__ == "__main__":
 
     parser.add_argument('--dataset_path', '-d', help='the dir of the data folder',
                         required=True, default="./data/train/")
-    parser.add_argument('--record_path', '-r', help='path of the created tfrecords file',
+    parser.add_argument('--record_path', '-r', help='path of the created tfrecords file '
+                                                    '(the folder for --output_format memmap)',
                         required=True, default="./data/train.tfrecords")    # "./data/val.tfrecords"
 
     parser.add_argument('--label_type', '-t', help='label type, rgb or gray',
                         required=True, default="rgb", type=str)
 
+    parser.add_argument('--workers', '-w', help='inter, the number of process for decode/resize/encode',
+                        default=1, type=int)
+    parser.add_argument('--shards', '-s', help='inter, the number of output tfrecords files, '
+                                               'named as train-00000-of-0000M.tfrecords',
+                        default=1, type=int)
+
+    parser.add_argument('--output_format', help='tfrecord, or memmap (fixed-shape uint8 array files)',
+                        default='tfrecord', choices=('tfrecord', 'memmap'))
+    parser.add_argument('--image_format', help='raw, png or jpeg, how the image is stored in the record',
+                        default='raw', choices=record_schema.IMAGE_FORMATS)
+    parser.add_argument('--compression', help='none, gzip or zlib, the compression of the record file',
+                        default='none', choices=record_schema.COMPRESSIONS)
+    parser.add_argument('--jpeg_quality', help='inter, 0-100, only for --image_format jpeg',
+                        default=95, type=int)
+    parser.add_argument('--rebuild', help='full rebuild, ignore the manifest of the last build',
+                        action='store_true')
+
+    parser.add_argument('--tile', help='cut the scenes into image_size tiles, instead of resizing',
+                        action='store_true')
+    parser.add_argument('--tile_stride', help='inter, the step between tiles, < image_size means overlapping',
+                        default=None, type=int)
+    parser.add_argument('--skip_background', help='skip the tiles with background fraction >= max_background',
+                        action='store_true')
+    parser.add_argument('--max_background', help='float, 0-1, see --skip_background', default=1.0, type=float)
+    parser.add_argument('--nodata', help='inter, skip the tiles whose pixels all equal to nodata',
+                        default=None, type=int)
+
     FLAGS, _ = parser.parse_known_args()
 
     tf.app.run()
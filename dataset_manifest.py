@@ -0,0 +1,216 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the dataset manifest of dataset_gen: which sample is in which record shard,
+and the file hash/mtime of its source image and label, for incremental and resumable builds.
+
+2026/10/18
+python ==2.7.15
+
+Note:
+    the files next to the record file (./data/train.tfrecords):
+        ./data/train.manifest.json: written at the end of each successful build
+            {"version": 1,
+             "options": {...},          # the build options, a different option means full rebuild
+             "files": [shard paths],
+             "samples": {name: {"src": , "label": ,
+                                "src_sha1": , "src_mtime": , "src_size": ,
+                                "label_sha1": , "label_mtime": , "label_size": ,
+                                "shard": k, "index": i, "records": [[record name, offset, length], ...]}}}
+            index: the first record of the sample is the i-th record of the shard,
+            records: one record, or one for each tile of the scene (dataset_gen --tile),
+                     offset/length: the byte offset of the record in the shard file and the length of
+                     the serialized example (offset is None if the file is compressed)
+
+        ./data/train.manifest.journal: one json line per event of the running build,
+            {"options": {...}}, {"start": k}, {"entry": {...}} (one for each written sample), {"done": k}
+            it is removed after the manifest is written, so if it exists the last build was interrupted.
+            a shard is written to shard.tmp, and renamed to the shard file after its "done" line.
+
+    the sha1 of a file is only recomputed when its mtime or size changed.
+"""
+# ===================================================================================== #
+
+
+import os
+import json
+import hashlib
+import logging
+
+
+MANIFEST_VERSION = 1
+
+SRC_EXTS = ('.jpg', '.png', '.tif', '.tiff')     # the priority order, if both name.jpg and name.png exist
+LABEL_EXTS = ('.png', '.jpg', '.tif', '.tiff')
+
+
+def manifest_path(record_path_):
+    return os.path.splitext(record_path_)[0] + '.manifest.json'
+
+
+def journal_path(record_path_):
+    return os.path.splitext(record_path_)[0] + '.manifest.journal'
+
+
+def index_dir(path, exts):
+    """ one scan of the folder
+
+    :return:
+        dict {name: file path}, if several files have the same name, the first ext in exts wins
+    """
+    index = {}
+    for fn in os.listdir(path):
+        name, ext = os.path.splitext(fn)
+        ext = ext.lower()
+        if ext not in exts:
+            continue
+        if name in index and exts.index(os.path.splitext(index[name])[1].lower()) <= exts.index(ext):
+            continue
+        index[name] = os.path.join(path, fn)
+    return index
+
+
+def scan_dataset(dataset_path_):
+    """ index the src/ and labels/ folder
+
+    :return:
+        dict {name: (src path, label path)}, the images without label are skipped (warning)
+    """
+    src = index_dir(dataset_path_ + "src/", SRC_EXTS)
+    labels = index_dir(dataset_path_ + "labels/", LABEL_EXTS)
+
+    missing = sorted(set(src) - set(labels))
+    if missing:
+        logging.warning("{} images without label are skipped: {}".format(len(missing), missing[:10]))
+
+    return dict((name, (src[name], labels[name])) for name in src if name in labels)
+
+
+def file_sha1(path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def sample_info(src_path, label_path, prev=None):
+    """ the file fingerprint of one sample, the sha1 of prev is reused if mtime and size are not changed
+
+    :param
+        prev: the manifest entry of the last build, or None
+    :return:
+        dict, src/label path, sha1, mtime and size
+    """
+    info = {'src': src_path, 'label': label_path}
+    for key, path in (('src', src_path), ('label', label_path)):
+        stat = os.stat(path)
+        info[key + '_mtime'] = stat.st_mtime
+        info[key + '_size'] = stat.st_size
+        if (prev is not None and prev.get(key) == path and prev.get(key + '_mtime') == stat.st_mtime
+                and prev.get(key + '_size') == stat.st_size):
+            info[key + '_sha1'] = prev[key + '_sha1']
+        else:
+            info[key + '_sha1'] = file_sha1(path)
+    return info
+
+
+def same_content(info, prev):
+    """ True if the sample was already encoded from the same src and label content
+    """
+    return (prev is not None and info['src_sha1'] == prev.get('src_sha1')
+            and info['label_sha1'] == prev.get('label_sha1'))
+
+
+def load_manifest(path, options):
+    """
+    :return:
+        dict {name: entry} of the last build, empty if there is no manifest or the options changed
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('options') != options:
+        logging.info("manifest {}: build options changed, full rebuild".format(path))
+        return {}
+    return manifest['samples']
+
+
+def save_manifest(path, options, files, samples):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'options': options, 'files': files, 'samples': samples},
+                  f, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def load_journal(path, options):
+    """ read the journal of an interrupted build
+
+    :return:
+        done: dict {shard: {name: entry}}, the shards finished by the interrupted build
+        partial: dict {shard: [entry, ...]}, the shard being written when interrupted, in write order
+    """
+    done, partial = {}, {}
+    if not os.path.exists(path):
+        return done, partial
+
+    with open(path) as f:
+        lines = f.readlines()
+
+    try:
+        header = json.loads(lines[0])
+    except (IndexError, ValueError):
+        header = {}
+    if header.get('options') != options:
+        logging.info("journal {}: build options changed, not resumed".format(path))
+        return done, partial
+
+    for line in lines[1:]:
+        try:
+            event = json.loads(line)
+        except ValueError:
+            break     # the last line may be cut by the crash
+        if 'start' in event:
+            partial[event['start']] = []
+        elif 'entry' in event:
+            partial[event['entry']['shard']].append(event['entry'])
+        elif 'done' in event:
+            entries = partial.pop(event['done'])
+            done[event['done']] = dict((entry['name'], entry) for entry in entries)
+
+    logging.info("resume the interrupted build: {} finished shards, {} samples of unfinished shards".format(
+        len(done), sum(len(entries) for entries in partial.values())))
+    return done, partial
+
+
+class Journal(object):
+    """ the append-only journal of the running build, each line is flushed to disk
+    Note:
+        a new journal is started by each build (the state of the interrupted build is
+        already saved to the manifest by then)
+    """
+
+    def __init__(self, path, options):
+        self.path = path
+        self.f = open(path, 'w')
+        self._write({'options': options})
+
+    def _write(self, event):
+        self.f.write(json.dumps(event) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def start(self, shard):
+        self._write({'start': shard})
+
+    def entry(self, name, entry):
+        self._write({'entry': dict(entry, name=name)})
+
+    def done(self, shard):
+        self._write({'done': shard})
+
+    def remove(self):
+        self.f.close()
+        os.remove(self.path)
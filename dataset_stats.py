@@ -0,0 +1,104 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the dataset statistics collected in the same pass that creates the dataset (dataset_gen),
+per-channel mean/std of the images, and per-class pixel histogram of the masks.
+
+2026/10/18
+python ==2.7.15
+numpy
+
+Note:
+    streaming: each sample gives a partial (sum, sum of squares, pixel count, class histogram),
+    computed by the worker process which already has the decoded arrays. the partials are just added,
+    so the order of the samples and the number of workers do not matter, and no second read is needed.
+    the partials are also kept in the manifest, so an incremental build has the stats of the whole set.
+
+    the stats file (./data/train.stats.json):
+        {"version": 1, "channel_order": "rgb", "count": n images, "pixels": n pixels,
+         "mean": [r, g, b], "std": [r, g, b],
+         "class_pixels": [...], "class_freq": [...], "class_weights": [...]}
+    class_weights: median frequency balancing, median(freq) / freq_c, 0 for the absent classes
+
+    the stats file is used by get_batch.batch_input(stats_file=) for normalization
+    and by train_main (config.class_weighting) for the loss weights.
+"""
+# ===================================================================================== #
+
+
+import json
+
+import numpy as np
+
+
+STATS_VERSION = 1
+
+
+def sample_stats(images_masks, class_num):
+    """ the partial stats of one sample (one image, or all the tiles of a scene)
+
+    :param
+        images_masks: list of (image (h, w, 3) uint8, mask (h, w) class id)
+    :return:
+        dict, json serializable
+    """
+    acc = StatsAccumulator(class_num)
+    for image, mask in images_masks:
+        acc.add(image, mask)
+    return acc.partial()
+
+
+class StatsAccumulator(object):
+
+    def __init__(self, class_num):
+        self.class_num = int(class_num)
+        self.count = 0
+        self.pixels = 0
+        self.sum = np.zeros(3, dtype=np.float64)
+        self.sumsq = np.zeros(3, dtype=np.float64)
+        self.hist = np.zeros(self.class_num, dtype=np.int64)
+
+    def add(self, image, mask):
+        pixels = image.reshape(-1, 3).astype(np.float64)
+        self.count += 1
+        self.pixels += pixels.shape[0]
+        self.sum += pixels.sum(axis=0)
+        self.sumsq += np.square(pixels).sum(axis=0)
+        self.hist += np.bincount(mask.ravel(), minlength=self.class_num)[:self.class_num]
+
+    def partial(self):
+        return {'count': self.count, 'pixels': self.pixels, 'sum': self.sum.tolist(),
+                'sumsq': self.sumsq.tolist(), 'hist': self.hist.tolist()}
+
+    def merge(self, partial):
+        self.count += partial['count']
+        self.pixels += partial['pixels']
+        self.sum += partial['sum']
+        self.sumsq += partial['sumsq']
+        self.hist += np.array(partial['hist'], dtype=np.int64)
+
+    def result(self):
+        pixels = max(self.pixels, 1)
+        mean = self.sum / pixels
+        std = np.sqrt(np.maximum(self.sumsq / pixels - np.square(mean), 0))
+
+        freq = self.hist / float(max(self.hist.sum(), 1))
+        present = freq > 0
+        weights = np.zeros(self.class_num)
+        if present.any():
+            weights[present] = np.median(freq[present]) / freq[present]
+
+        return {'version': STATS_VERSION, 'channel_order': 'rgb', 'count': self.count, 'pixels': self.pixels,
+                'mean': mean.tolist(), 'std': std.tolist(),
+                'class_pixels': self.hist.tolist(), 'class_freq': freq.tolist(), 'class_weights': weights.tolist()}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.result(), f, indent=1)
+
+
+def load_stats(path):
+    with open(path) as f:
+        stats = json.load(f)
+    if stats.get('version') != STATS_VERSION:
+        raise ValueError("stats file {} version {} is not supported".format(path, stats.get('version')))
+    return stats
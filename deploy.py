@@ -16,6 +16,18 @@ Note:
     there are two way to save and load trained model, here we using frozen model,
     as the checkpoint are to complex and slow for predict.
 
+    --model ./final_model/model.tflite: the int8 model of quantize.py, by tflite_predictor, same interface.
+    both predictors normalize the image as get_batch.normalize (the training input) before the predict
+    (--stats: the dataset stats file of the training, if any), except for a model with the normalization
+    folded in (optimize_model.py, export_model.takes_raw_pixels), fed with the raw pixels.
+
+    the model.pb of train_main (export_model.py) has a dynamic input: the single image is fed as a batch of 1,
+    at any --image_size; --batch_size N feeds N copies, to measure the batch throughput.
+
+    --img synthetic: a random image instead of ./predict_image/, and --repeat N times the predict
+    (images/sec logged), to measure the model alone on a machine without dataset, eg:
+    $ python deploy.py --colormap voc --img synthetic --class_num 21 --batch_size 4 --image_size 512 --repeat 20
+
     !!! the output of network is (BS*h*w, num_class) with the value float 0 to 1 such as 0.01
     !!! a distribution that do not pass through softmax
 """
@@ -31,6 +43,7 @@ from visualization import *
 import cv2
 import numpy as np
 from tensorflow.python.platform import gfile
+from export_model import RAW_INPUT_NODE, takes_raw_pixels
 
 
 def ckpt_single_image_predictor(img_, meta_, trained_model_path_, h_, w_, class_num_):
@@ -88,7 +101,13 @@ def ckpt_single_image_predictor(img_, meta_, trained_model_path_, h_, w_, class_
         return rgb_image_
 
 
-def frozen_predictor(pd_file_path_, single_img, h_, w_, class_num_, BS):
+def synthetic_image(h_, w_, seed=0):
+    """ a random rgb uint8 image (h_, w_, 3), the synthetic input of the predictors
+    """
+    return np.random.RandomState(seed).randint(0, 256, size=(h_, w_, 3)).astype(np.uint8)
+
+
+def frozen_predictor(pd_file_path_, single_img, h_, w_, class_num_, BS, repeat=1, stats_file=None):
     """ predictor single image, using trained frozen model file.
     Note:
         the input shape of network during triain is (batch_size, h, w, channel),
@@ -104,20 +123,16 @@ def frozen_predictor(pd_file_path_, single_img, h_, w_, class_num_, BS):
         img_: a rgb image that wait to predict
         meta_: the .meta files from checkpoint, and the graph are stored in .meta file
         pd_file_path_: : the frozen model file model.pd path
-        h_, w_: the image shape of net input, (BS, h_, w_, class_num)
+        h_, w_: the image shape of net input, (BS, h_, w_, class_num), a multiple of 16 (default unet)
         class_num: length of a single distribute vector
+        BS: the number of copies of the image in the fed batch (1: the single image at its true cost)
+        repeat: inter, run the predict repeat times (the first one is the warmup), and log the images/sec
+        stats_file: the normalization of the training, see normalize_image
 
     :return:
         a rgb image with shape (h_, w_, 3)
     """
 
-    single_img = cv2.resize(single_img, (h_, w_), interpolation=cv2.INTER_LINEAR)
-
-    # tmp for single image predict
-    img_feed = np.zeros((BS, h_, w_, 3), dtype=np.uint8)
-    for i in range(BS):
-        img_feed[i, :, :] = single_img
-
     with tf.Session() as sess:
         with gfile.FastGFile(pd_file_path_ + 'model.pb', 'rb') as f:
             graph_def = tf.GraphDef()
@@ -131,11 +146,33 @@ def frozen_predictor(pd_file_path_, single_img, h_, w_, class_num_, BS):
 
         logging.info("{}".format(image_tensor))
 
+        # the exported model (export_model.py) takes any batch and image size; a fixed shape model.pb
+        # (older train_main) only its own, the image is copied to its batch
+        fixed_bs, fixed_h, fixed_w, _ = image_tensor.shape.as_list()
+        if fixed_bs is not None:
+            logging.info("fixed shape model, the image is copied {} times".format(fixed_bs))
+            BS = fixed_bs
+        if fixed_h is not None:
+            h_, w_ = fixed_h, fixed_w
+
+        single_img = cv2.resize(single_img, (w_, h_), interpolation=cv2.INTER_LINEAR)
+        if takes_raw_pixels(graph_def):
+            img_feed = np.repeat(single_img[np.newaxis].astype(np.float32), BS, axis=0)
+        else:
+            img_feed = np.repeat(normalize_image(single_img[np.newaxis], stats_file), BS, axis=0)
+
         op = sess.graph.get_tensor_by_name('predict/predict:0')
         logging.info("{}".format(op))
 
         logging.info("predict ...")
         predict = sess.run(op, feed_dict={image_tensor: img_feed})
+        if repeat > 1:
+            start = time.time()
+            for _ in range(repeat - 1):
+                predict = sess.run(op, feed_dict={image_tensor: img_feed})
+            elapsed = time.time() - start
+            logging.info("predict: {:.2f} ms/batch, {:.2f} images/sec".format(
+                elapsed * 1000 / (repeat - 1), (repeat - 1) * BS / elapsed))
         # predict = sess.run(tf.nn.softmax(predict))
 
         #  just tmp, for single image predict
@@ -154,12 +191,80 @@ def frozen_predictor(pd_file_path_, single_img, h_, w_, class_num_, BS):
         return rgb_image_
 
 
+def normalize_image(img, stats_file=None):
+    """ the numpy get_batch.normalize: uint8 image(s) --> the float32 network input
+
+    :param
+        stats_file: None, the fixed mean [104, 117, 123] and scale 1/255;
+                    or the dataset stats file of the training, (img - mean) / std
+    """
+    if stats_file:
+        import dataset_stats
+        stats = dataset_stats.load_stats(stats_file)
+        mean, scale = stats['mean'], 1. / np.maximum(stats['std'], 1e-3)
+    else:
+        mean, scale = [104.0, 117.0, 123.0], 1. / 255
+    return ((img.astype(np.float32) - np.asarray(mean, np.float32)) * np.asarray(scale, np.float32)) \
+        .astype(np.float32)
+
+
+def tflite_predictor(model_path_, single_img, h_, w_, class_num_, BS, repeat=1, stats_file=None):
+    """ predictor single image, using the tflite model of quantize.py, same interface as frozen_predictor
+
+    :arg
+        model_path_: the .tflite file
+        repeat: inter, run the predict repeat times (the first one is the warmup), and log the images/sec
+        stats_file: the normalization of the training, see normalize_image
+    :return:
+        a rgb image with shape (h_, w_, 3)
+    """
+    from quantize import TFLiteModel
+
+    model = TFLiteModel(model_path_)
+    # the tflite model of an optimized model.pb keeps the input normalization node
+    raw = any(tensor['name'] == RAW_INPUT_NODE for tensor in model.interpreter.get_tensor_details())
+    # the tflite input has the fixed shape of the conversion
+    BS, h_, w_ = model.input['shape'][:3]
+
+    single_img = cv2.resize(single_img, (w_, h_), interpolation=cv2.INTER_LINEAR)
+    if raw:
+        img_feed = np.repeat(single_img[np.newaxis].astype(np.float32), BS, axis=0)
+    else:
+        img_feed = np.repeat(normalize_image(single_img[np.newaxis], stats_file), BS, axis=0)
+
+    logging.info("predict ...")
+    predict = model.predict(img_feed)
+    if repeat > 1:
+        start = time.time()
+        for _ in range(repeat - 1):
+            predict = model.predict(img_feed)
+        elapsed = time.time() - start
+        logging.info("predict: {:.2f} ms/batch, {:.2f} images/sec".format(
+            elapsed * 1000 / (repeat - 1), (repeat - 1) * BS / elapsed))
+
+    predict = predict.reshape((BS, h_, w_, class_num_))[0, :, :, :]
+    logging.info("predict output shape: {}".format(predict.shape))
+
+    logging.info("visualization ...")
+    mat_2d = predict_2_labelmat_new(predict, h_, w_)
+
+    return labelmat_2_rgb(mat_2d, FLAGS.colormap)
+
+
 def main(_):
 
-    img = cv2.imread('./predict_image/' + FLAGS.img)
-    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+    if FLAGS.img == 'synthetic':
+        img = synthetic_image(h, w)
+    else:
+        img = cv2.imread('./predict_image/' + FLAGS.img)
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
-    rgb_image = frozen_predictor(pd_file_path, img, h, w, FLAGS.class_num, FLAGS.batch_size)
+    if FLAGS.model and FLAGS.model.endswith('.tflite'):
+        rgb_image = tflite_predictor(FLAGS.model, img, h, w, FLAGS.class_num, FLAGS.batch_size, FLAGS.repeat,
+                                     FLAGS.stats)
+    else:
+        rgb_image = frozen_predictor(pd_file_path, img, h, w, FLAGS.class_num, FLAGS.batch_size, FLAGS.repeat,
+                                     FLAGS.stats)
 
     rgb_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
     cv2.imwrite('./predict_image/predict.png', rgb_image)
@@ -174,21 +279,31 @@ if __name__ == "__main__":
 
     pd_file_path = "./final_model/"
 
-    h, w = 256, 256
-
     parser = argparse.ArgumentParser()
 
     parser.add_argument('--colormap',help="yuuuav, or voc, using for visualization",
                         required=True, default='voc', type=str)
-    parser.add_argument('--img', help="image file for predic",
+    parser.add_argument('--img', help="image file for predic, or synthetic (a random image)",
                         required=True, default='test.jpg', type=str)
     parser.add_argument('--class_num', help="the number of class to be classified at training stage",
                         required=True, type=int)
 
-    parser.add_argument('--batch_size', help="the batch_size of frozen model",
-                        required=True, type=int)
+    parser.add_argument('--batch_size', help="the batch size fed to the model (copies of the image), "
+                                             "a fixed shape model.pb uses its own",
+                        default=1, type=int)
+    parser.add_argument('--image_size', help="the input size of the model, a multiple of 16 (default unet)",
+                        default=256, type=int)
+    parser.add_argument('--model', help="a .tflite model (quantize.py), default the frozen ./final_model/model.pb",
+                        default=None, type=str)
+    parser.add_argument('--repeat', help="run the predict repeat times, and log the images/sec",
+                        default=1, type=int)
+    parser.add_argument('--stats', help="the dataset stats file of the training normalization, "
+                                        "default the fixed mean [104, 117, 123] and scale 1/255",
+                        default=None, type=str)
 
     FLAGS, _ = parser.parse_known_args()
 
+    h, w = FLAGS.image_size, FLAGS.image_size
+
     tf.app.run()
 
@@ -126,7 +126,7 @@ def main(_):
     """
     with tf.Session() as sess:
 
-        name_val, image_val, label_val = batch_input(tfrecord_path_val, batch_size=16)
+        name_val, image_val, label_val = batch_input(tfrecord_path_val, batch_size=16, augment=False)
 
         label_val_ = tf.reshape(label_val, (-1, 3))
 
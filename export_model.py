@@ -0,0 +1,160 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, export the trained unet to the frozen model.pb for the deploy, with a dynamic input:
+any batch size and any image size (a multiple of 2^(unet_depth-1), 16 for the default unet).
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    the training graph is built on the batch of the input queue, (BS, image_size, image_size, 3),
+    its freeze only accepts exactly this shape. the exported graph is a new one:
+        source_input/image_batch/image_tensor: placeholder float32 (None, None, None, 3)
+        --> unet (same variables, loaded with the trained values) --> predict/predict (batch*h*w, class_num)
+    the tensor names are the same as before, deploy.py and quantize.py load both.
+    the dropout is removed (strip_dropout) and the batch norms use the moving statistics
+    (unet is_training=False), the predict is deterministic.
+
+    train_main writes the exported model at the end of the training (export_model(sess, path)).
+    an existing fixed shape model.pb is converted with the constants of its variables:
+    $ python export_model.py -m ./final_model/model.pb -o ./final_model/model_dynamic.pb
+"""
+# ===================================================================================== #
+
+
+import logging
+import argparse
+
+import tensorflow as tf
+from tensorflow.python.framework import graph_util, tensor_util
+
+from config import data_format
+from unet import unet, resolve_data_format
+
+
+INPUT_TENSOR = 'source_input/image_batch/image_tensor'
+OUTPUT_TENSOR = 'predict/predict'
+# the input normalization folded into the model (optimize_model.py), its input then takes the raw pixels
+RAW_INPUT_NODE = 'input_normalization/sub'
+
+
+def load_graph_def(pb_path):
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(pb_path, 'rb') as f:
+        graph_def.ParseFromString(f.read())
+    return graph_def
+
+
+def takes_raw_pixels(graph_def):
+    """ True if the model normalizes its input itself (RAW_INPUT_NODE): feed the raw pixels (0-255, float);
+    else feed the normalized image (get_batch.normalize)
+    """
+    return any(node.name == RAW_INPUT_NODE for node in graph_def.node)
+
+
+def strip_dropout(graph_def):
+    """ replace each tf.nn.dropout (x / keep_prob * floor(keep_prob + uniform)) by the identity of x
+
+    :return:
+        a new GraphDef, the random ops of the dropout are not used any more (pruned by extract_sub_graph)
+    """
+    nodes = dict((node.name, node) for node in graph_def.node)
+    output = tf.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        new = output.node.add()
+        new.CopyFrom(node)
+        div = nodes.get(node.input[0].split(':')[0]) if node.input else None
+        if node.op == 'Mul' and node.name.endswith('dropout/mul') and div is not None \
+                and div.name.endswith('dropout/div'):
+            new.op = 'Identity'
+            del new.input[:]
+            new.input.append(div.input[0])
+            dtype = node.attr['T']
+            new.attr.clear()
+            new.attr['T'].CopyFrom(dtype)
+    return output
+
+
+def inference_net(image):
+    """ unet of the config, without the gradient checkpointing (forward only), the batch norms in inference
+    mode (the moving statistics), in the layout of config.data_format
+    """
+    return unet(image, recompute='none', is_training=False, data_format=resolve_data_format(data_format))
+
+
+def inference_graph_def(values, build_net=inference_net):
+    """ the frozen inference graph with the dynamic input
+
+    :param
+        values: callable, list of variable names --> list of their values (numpy)
+        build_net: image tensor --> net dict, net['output'] the logits
+    :return:
+        GraphDef
+    """
+    with tf.Graph().as_default() as graph:
+        with tf.variable_scope("source_input"):
+            with tf.variable_scope("image_batch"):
+                image = tf.placeholder(tf.float32, [None, None, None, 3], name='image_tensor')
+
+        net = build_net(image)
+
+        with tf.variable_scope("predict"):
+            tf.nn.softmax(net['output'], name="predict")
+
+        variables = tf.global_variables()
+        with tf.Session() as sess:
+            for variable, value in zip(variables, values([v.op.name for v in variables])):
+                variable.load(value, sess)
+            graph_def = graph_util.convert_variables_to_constants(sess, graph.as_graph_def(), [OUTPUT_TENSOR])
+
+    return tf.graph_util.extract_sub_graph(strip_dropout(graph_def), [OUTPUT_TENSOR])
+
+
+def session_values(sess):
+    """ the values of the variables of the training session, by name
+    """
+    trained = dict((v.op.name, v) for v in sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES))
+    return lambda names: sess.run([trained[name] for name in names])
+
+
+def frozen_values(graph_def):
+    """ the values of the variables of a frozen model, from the constants of the same name
+    """
+    consts = dict((node.name, node) for node in graph_def.node if node.op == 'Const')
+
+    def values(names):
+        missing = [name for name in names if name not in consts]
+        if missing:
+            # eg the moving statistics of the batch norms, not frozen in a model of the batch statistics
+            raise ValueError("{} variables are not in the frozen model, eg {}".format(len(missing), missing[:3]))
+        return [tensor_util.MakeNdarray(consts[name].attr['value'].tensor) for name in names]
+    return values
+
+
+def save(graph_def, path):
+    with tf.gfile.FastGFile(path, mode='wb') as f:
+        f.write(graph_def.SerializeToString())
+    logging.info("exported model {}, input {} (any batch and image size)".format(path, INPUT_TENSOR))
+
+
+def export_model(sess, path, build_net=inference_net):
+    """ export the trained model of the training session to path (model.pb)
+    """
+    save(inference_graph_def(session_values(sess), build_net), path)
+
+
+def main(_):
+    save(inference_graph_def(frozen_values(load_graph_def(FLAGS.model))), FLAGS.out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='export a fixed shape frozen model with a dynamic input')
+
+    parser.add_argument('--model', '-m', help='the frozen model.pb', default='./final_model/model.pb')
+    parser.add_argument('--out', '-o', help='the exported model path', default='./final_model/model_dynamic.pb')
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
@@ -1,6 +1,6 @@
 # ===================================================================================== #
 # coding:utf-8
-"""module, service for network as a batch input. creating a queue-based input pipeline.
+"""module, service for network as a batch input. creating a queue-based or a tf.data input pipeline.
 define the core method batch_input, and also can do module testing
 
 2018/12/04
@@ -12,17 +12,334 @@ Note:
     coord.join(threads): hang on, and waiting to stop,
                         (the threads will stop after the coord-threads stop)
     tf.local_variables_initializer() is needed, and must before the cooord= and threads=
+
+    config.input_pipeline selects the pipeline of batch_input: 'queue' (queue_batch_input) or
+    'dataset' (dataset_batch_input). the tf.data pipeline has no queue runner, so
+    start_queue_runners starts no thread, and the end of the epochs is the same tf.errors.OutOfRangeError.
+
+    config.batch_decode: parse_record (one example, decode, then batch) or parse_batch (batch the
+    serialized records, then one parse_example and one decode of the batch tensor), both pipelines.
+
+    config.epoch_cache: the decoded uint8 records of the first epoch are kept in memory (or in the
+    cache_spill_path file), the later epochs do not read and decode the record files again,
+    only with the tf.data pipeline (batch_input switches to it).
+
+    config.augmentation: random flip/rot90/scale-crop/color jitter of the decoded uint8 samples (augment.py),
+    in the input threads, before the normalization. batch_input(augment=) switches it for one pipeline,
+    eg: the evaluation input is built with augment=False.
+
+    batch_input of a dataset folder (src/ and labels/, eg: ./data/train/) reads the images directly
+    (folder_batch_input), without dataset_gen, for the quick experiments.
+
+    config.synthetic_input (train_main --synthetic): random images and masks, no dataset at all
+    (synthetic_batch_input), to measure the model compute alone.
 """
 # ===================================================================================== #
 
 
 import tensorflow as tf
 import numpy as np
-from config import image_size, BS, queue_capacity, epochs, num_queue_threads, iter_each_epoch, num_classes
+from config import image_size, BS, queue_capacity, epochs, num_queue_threads, iter_each_epoch, num_classes, \
+    record_compression, stats_path, input_pipeline, batch_decode, epoch_cache, cache_max_mb, cache_spill_path, \
+    queue_memory_budget, augmentation, augment_seed, folder_label_type, synthetic_input
+import os
+import json
+import augment as aug
+import dataset_gen
+import dataset_manifest
+import logging
+import record_schema
+import memmap_dataset
+import dataset_stats
+import record_index
+import threading
+
+
+def record_file_list(record_file):
+    """ the tfrecords file list of the input pipeline
+
+    :param
+        record_file: a file path string, a glob pattern string (eg: ./data/train-*-of-00004.tfrecords),
+                    or a list of file path (eg: dataset_gen.shard_paths())
+    :return:
+        a sorted list of file path
+    """
+    if isinstance(record_file, (list, tuple)):
+        files = list(record_file)
+    elif any(c in record_file for c in '*?['):
+        files = sorted(tf.gfile.Glob(record_file))
+    else:
+        files = [record_file]
+
+    if not files:
+        raise ValueError("no tfrecords file match: {}".format(record_file))
+    return files
+
+
+def decode_image(image_raw, image_format):
+    """ decode the image bytes of any image_format ('raw', 'png', 'jpeg') to (image_size, image_size, 3) uint8
+    """
+    img = tf.cond(tf.equal(image_format, 'raw'),
+                  lambda: tf.reshape(tf.decode_raw(image_raw, tf.uint8), [image_size, image_size, 3]),
+                  lambda: tf.reshape(tf.image.decode_image(image_raw, channels=3), [image_size, image_size, 3]))
+    img.set_shape([image_size, image_size, 3])
+    return img
+
+
+def decode_mask(mask_raw, schema_version, mask_format='raw', class_num=num_classes):
+    """ decode the mask bytes of any schema version to the (image_size, image_size) class id matrix
+
+    Note:
+        version 2 (record_schema.CLASS_ID) is stored as class id, just reshape (or decode the png);
+        version 1 (record_schema.ONE_HOT, the old records) is stored as one-hot, argmax back to class id.
+    :return:
+        uint8 tensor with shape (image_size, image_size)
+    """
+    def _raw_mask():
+        mask_ = tf.decode_raw(mask_raw, tf.uint8)
+        return tf.cond(tf.equal(schema_version, record_schema.CLASS_ID),
+                       lambda: tf.reshape(mask_, [image_size, image_size]),
+                       lambda: tf.cast(tf.argmax(tf.reshape(mask_, [image_size, image_size, class_num]), axis=2),
+                                       tf.uint8))
+
+    mask = tf.cond(tf.equal(mask_format, 'png'),
+                   lambda: tf.reshape(tf.image.decode_png(mask_raw, channels=1), [image_size, image_size]),
+                   _raw_mask)
+    mask.set_shape([image_size, image_size])
+    return mask
+
+
+def normalize(img, stats_file=None):
+    """ uint8 image(s) --> the float32 network input
+
+    :param
+        stats_file: None, the fixed mean [104, 117, 123] and scale 1/255;
+                    or the dataset stats file (dataset_gen, see dataset_stats), (img - mean) / std
+    """
+    if stats_file:
+        stats = dataset_stats.load_stats(stats_file)
+        return (tf.cast(img, tf.float32) - stats['mean']) * (1. / np.maximum(stats['std'], 1e-3))
+
+    return (tf.cast(img, tf.float32) - [104.0, 117.0, 123.0]) * (1. / 255)   # ?
+    # img = (tf.cast(img, tf.float32))
+
+    # img = tf.cast(img, tf.float32) * (1. / 255) - 0.5
+
+
+def decode_record(serialized_example, class_num=num_classes, augment=False):
+    """ parse and decode one serialized example, not normalized
+
+    :param
+        augment: bool, augment the decoded sample (augment.augment, config.augment_seed)
+    :return:
+        name, uint8 image (image_size, image_size, 3), class id mask (image_size, image_size)
+    """
+    with tf.name_scope("input"):
+        features = tf.parse_single_example(serialized_example, features=record_schema.feature_dict())
+
+    with tf.name_scope("decode_process"):
+        img = decode_image(features['image'], features['image_format'])
+
+        # the mask/lable, is not rgb image. is label ID
+        mask = decode_mask(features['mask'], features['schema_version'], features['mask_format'], class_num)
+
+    if augment:
+        img, mask = aug.augment(img, mask, augment_seed)
+
+    return features['name'], img, mask
+
+
+def parse_record(serialized_example, class_num=num_classes, stats_file=stats_path, augment=False):
+    """ parse and decode one serialized example
+
+    :return:
+        name, normalized float32 image (image_size, image_size, 3), class id mask (image_size, image_size)
+    """
+    nm, img, mask = decode_record(serialized_example, class_num, augment)
+
+    with tf.name_scope("decode_process"):
+        img = normalize(img, stats_file)
+
+    return nm, img, mask
+
+
+def record_count(files, compression=record_compression):
+    """ the number of records of the files, without reading them
+
+    Note:
+        from the dataset manifest (dataset_manifest) or the offset index (record_index) written by dataset_gen
+        next to the record file (the shards train-k-of-n.tfrecords --> train.tfrecords); for the not
+        compressed files of neither, estimated as the file size / the size of its first record.
+    :return:
+        inter, or None if unknown: a compressed file of neither (its size does not tell the records)
+    """
+    files_set = set(os.path.abspath(path) for path in files)
+    bases = set(record_index.base_path(path) for path in files)
+
+    counted = {}
+    for base in bases:
+        m_path = dataset_manifest.manifest_path(base)
+        i_path = record_index.index_path(base)
+        if os.path.exists(m_path):
+            with open(m_path) as f:
+                manifest = json.load(f)
+            shard_files = manifest['files']
+            for entry in manifest['samples'].values():
+                path = os.path.abspath(shard_files[entry['shard']])
+                counted[path] = counted.get(path, 0) + len(entry['records'])
+        elif os.path.exists(i_path):
+            with open(i_path) as f:
+                index = json.load(f)
+            for file_id, _, _ in index['records'].values():
+                path = os.path.abspath(index['files'][file_id])
+                counted[path] = counted.get(path, 0) + 1
+
+    count = 0
+    for path in files_set:
+        if path in counted:
+            count += counted[path]
+            continue
+        if compression != 'none':
+            logging.info("{}: compressed, no manifest or index, the records are not counted".format(path))
+            return None
+        first = next(tf.python_io.tf_record_iterator(path, record_schema.record_options(compression)), None)
+        if first is not None:
+            estimate = os.path.getsize(path) // (len(first) + 16)
+            logging.info("{}: no manifest or index, about {} records (file size)".format(path, estimate))
+            count += estimate
+    return count
+
+
+def cache_plan(files, compression=record_compression, max_mb=cache_max_mb, spill_path=cache_spill_path):
+    """ where to cache the decoded records of the files
+
+    Note:
+        the decoded size is (image_size * image_size * 4) bytes a record (uint8 rgb image + class id mask),
+        the records are counted by record_count (no read of the records), an unknown count (compressed
+        files without manifest or index) is not cached in memory.
+    :return:
+        'memory', spill_path or None (too big, stream)
+    """
+    record_bytes = image_size * image_size * 4
+    count = record_count(files, compression)
+    if count is not None and count * record_bytes <= max_mb * 1024 ** 2:
+        return 'memory'
+
+    if spill_path:
+        logging.info("epoch cache: the records are over {} MB (or not counted), cached in {}".format(
+            max_mb, spill_path))
+        return spill_path
+    logging.warning("epoch cache: the records are over {} MB (or not counted) and no cache_spill_path, "
+                    "streamed".format(max_mb))
+    return None
+
+
+def decode_batch(serialized_batch, class_num=num_classes, augment=False):
+    """ parse and decode a batch of serialized examples, the batched version of decode_record, not normalized
+
+    Note:
+        one tf.parse_example for the batch, and for the raw images/class id masks (the default records),
+        one decode_raw + reshape of the whole batch tensor.
+        if any record of the batch is png/jpeg or an old one-hot record, the batch falls back to
+        decode_image/decode_mask of each record (tf.map_fn), so the mixed files still work.
+    :param
+        serialized_batch: string tensor with shape (n,)
+    :return:
+        names (n,), uint8 images (n, image_size, image_size, 3), class id masks (n, image_size, image_size)
+    """
+    n = serialized_batch.shape[0]
+
+    with tf.name_scope("input"):
+        features = tf.parse_example(serialized_batch, features=record_schema.feature_dict())
+
+    with tf.name_scope("decode_process"):
+        img = tf.cond(tf.reduce_all(tf.equal(features['image_format'], 'raw')),
+                      lambda: tf.reshape(tf.decode_raw(features['image'], tf.uint8), [-1, image_size, image_size, 3]),
+                      lambda: tf.map_fn(lambda x: decode_image(x[0], x[1]),
+                                        (features['image'], features['image_format']), dtype=tf.uint8))
+        img.set_shape([n, image_size, image_size, 3])
+
+        raw_id = tf.logical_and(tf.reduce_all(tf.equal(features['mask_format'], 'raw')),
+                                tf.reduce_all(tf.equal(features['schema_version'], record_schema.CLASS_ID)))
+        mask = tf.cond(raw_id,
+                       lambda: tf.reshape(tf.decode_raw(features['mask'], tf.uint8), [-1, image_size, image_size]),
+                       lambda: tf.map_fn(lambda x: decode_mask(x[0], x[1], x[2], class_num),
+                                         (features['mask'], features['schema_version'], features['mask_format']),
+                                         dtype=tf.uint8))
+        mask.set_shape([n, image_size, image_size])
+
+    if augment:
+        img, mask = aug.augment_batch(img, mask, augment_seed)
+
+    return features['name'], img, mask
+
+
+def parse_batch(serialized_batch, class_num=num_classes, stats_file=stats_path, augment=False):
+    """ parse, decode and normalize a batch of serialized examples, the batched version of parse_record
+
+    :return:
+        names (n,), normalized float32 images (n, image_size, image_size, 3),
+        class id masks (n, image_size, image_size)
+    """
+    nm, img, mask = decode_batch(serialized_batch, class_num, augment)
+
+    with tf.name_scope("decode_process"):
+        img = normalize(img, stats_file)
+
+    return nm, img, mask
 
 
-def batch_input(record_file, batch_size=BS, class_num=num_classes):
-    """core method for input pipeline
+def queue_elements(element_bytes, batch_size=BS):
+    """ the capacity (elements) of a queue, from config.queue_memory_budget
+
+    :param
+        element_bytes: inter, the bytes of one queue element
+    :return:
+        inter, budget // element_bytes (at least 2 batches), or config.queue_capacity if there is no budget
+    """
+    if not queue_memory_budget:
+        capacity = queue_capacity
+    else:
+        capacity = max(int(queue_memory_budget // element_bytes), 2 * batch_size)
+    logging.info("input queue: capacity {} elements of {:.2f} MB, {:.1f} MB".format(
+        capacity, element_bytes / 1024.0 ** 2, capacity * element_bytes / 1024.0 ** 2))
+    return capacity
+
+
+def batch_input(record_file, batch_size=BS, class_num=num_classes, sparse_label=False,
+                compression=record_compression, stats_file=stats_path, pipeline=input_pipeline,
+                batched_decode=batch_decode, augment=augmentation, synthetic=synthetic_input):
+    """core method for input pipeline, see queue_batch_input and dataset_batch_input for the params
+
+    :param
+        pipeline: string, 'queue' or 'dataset', default config.input_pipeline
+        batched_decode: bool, default config.batch_decode
+        augment: bool, default config.augmentation
+        synthetic: bool, default config.synthetic_input, record_file is not read
+    :return:
+        name_batch, img_batch, label_batch
+    """
+    if synthetic:
+        return synthetic_batch_input(batch_size, class_num, sparse_label)
+    if isinstance(record_file, str) and os.path.isdir(record_file):
+        return folder_batch_input(record_file, batch_size, class_num, sparse_label, stats_file=stats_file,
+                                  augment=augment)
+    if epoch_cache and pipeline == 'queue':
+        logging.info("epoch cache: the tf.data pipeline is used")
+        pipeline = 'dataset'
+    if pipeline == 'dataset':
+        return dataset_batch_input(record_file, batch_size, class_num, sparse_label, compression, stats_file,
+                                   batched_decode, epoch_cache, augment)
+    if pipeline != 'queue':
+        raise ValueError("pipeline must be 'queue' or 'dataset', got {}".format(pipeline))
+    return queue_batch_input(record_file, batch_size, class_num, sparse_label, compression, stats_file,
+                             batched_decode, augment)
+
+
+def queue_batch_input(record_file, batch_size=BS, class_num=num_classes, sparse_label=False,
+                      compression=record_compression, stats_file=stats_path, batched_decode=batch_decode,
+                      augment=augmentation):
+    """the queue-runner input pipeline
     Note:
         capacity:An integer. The maximum number of elements in the queue.
         min_after_dequeue: Minimum number elements in the queue after a
@@ -34,47 +351,332 @@ def batch_input(record_file, batch_size=BS, class_num=num_classes):
         eg: epochs=10. then who to set num_epochs?  it must be >=  epochs,
         otherwise it will stop before your max_iters. set to None should be fine.
 
+        the image is enqueued as uint8 and the mask as (h, w) class id (uint8), the normalization
+        (float32) and the one-hot expansion are done on the dequeued batch, so the queue holds
+        4 times less image memory and num_classes times less label memory.
+        the capacity of the queue is set by the bytes of config.queue_memory_budget (see queue_elements),
+        eg: image_size 256, 1000 elements: 786 MB float32 images + 1.3 GB one-hot masks before,
+        262 MB now; a budget of 256 MB is 1000 elements.
+
+        the png/jpeg decoding is part of the enqueue op, so it runs in the num_queue_threads
+        threads of shuffle_batch in parallel.
+
     :param
-        record_filelist: A string list, consist of the tfrecords filename list.
+        record_file: A tfrecords filename, a glob pattern or a filename list (the shards),
+                    see record_file_list.
         batch_size: a inter, define how many images  pass to the network each time.
         and I think the batch_size for the evaluate(val/test) should be much bigger than train
+        sparse_label: bool, if True, the label batch is the class id (batch_size, h, w) uint8,
+                    otherwise one-hot (batch_size, h, w, class_num) uint8
+        compression: string, 'none', 'gzip' or 'zlib', same as the writer (dataset_gen --compression)
+        stats_file: None or the dataset stats file for the normalization, see normalize
+        batched_decode: bool, if True the serialized records are batched, then parsed and decoded
+                    as one batch by parse_batch, else each record is decoded by parse_record,
+                    both in the queue runner threads
+        augment: bool, augment the decoded samples in the queue runner threads (augment.py)
     :return:
         A batch, (a tensor ) with shape (batch_size, image_size, image_size, channel), for rgb, the channel=3
     """
-    feature_dict = {
-        'name': tf.FixedLenFeature([], tf.string),
-        'image': tf.FixedLenFeature([], tf.string),
-        'mask': tf.FixedLenFeature([], tf.string)}
 
     with tf.name_scope("input"):
-        filename_queue = tf.train.string_input_producer([record_file], num_epochs=epochs)
+        filename_queue = tf.train.string_input_producer(record_file_list(record_file), num_epochs=epochs)
 
-        reader = tf.TFRecordReader()
+        reader = tf.TFRecordReader(options=record_schema.record_options(compression))
         _, serialized_example = reader.read(filename_queue)
 
-        features = tf.parse_single_example(serialized_example, features=feature_dict)
+    element_bytes = image_size * image_size * 4     # uint8 rgb image + class id mask (or a raw record)
 
-    nm = features['name']
+    if batched_decode:
+        serialized_batch = tf.train.shuffle_batch([serialized_example], batch_size=batch_size,
+                                                  capacity=queue_elements(element_bytes, batch_size),
+                                                  min_after_dequeue=0, num_threads=num_queue_threads)
+        nm, img, mask = decode_batch(serialized_batch, class_num, augment)
 
+        # the decoded batches are prepared by queue runner threads too, not in the training step
+        name_batch, img_batch, label_batch = tf.train.batch([nm, img, mask], batch_size=batch_size,
+                                                            capacity=2 * batch_size, enqueue_many=True,
+                                                            num_threads=num_queue_threads)
+    else:
+        nm, img, mask = decode_record(serialized_example, class_num, augment)
+
+        name_batch, img_batch, label_batch = tf.train.shuffle_batch([nm, img, mask],
+                                                                    batch_size=batch_size,
+                                                                    capacity=queue_elements(element_bytes,
+                                                                                            batch_size),
+                                                                    min_after_dequeue=0,
+                                                                    num_threads=num_queue_threads)
     with tf.name_scope("decode_process"):
-        img = tf.decode_raw(features['image'], tf.uint8)
-        img = tf.reshape(img, [image_size, image_size, 3])
+        img_batch = normalize(img_batch, stats_file)
+
+    if not sparse_label:
+        with tf.name_scope("one_hot"):
+            label_batch = tf.one_hot(label_batch, class_num, dtype=tf.uint8)
+
+    return name_batch, img_batch, label_batch
+
+
+def dataset_batch_input(record_file, batch_size=BS, class_num=num_classes, sparse_label=False,
+                        compression=record_compression, stats_file=stats_path, batched_decode=batch_decode,
+                        cache=epoch_cache, augment=augmentation):
+    """the tf.data input pipeline, the same (name_batch, img_batch, label_batch) contract as queue_batch_input
+
+    Note:
+        the shards are read by parallel_interleave (cycle_length: up to num_queue_threads files at once),
+        the serialized records are shuffled (buffer queue_capacity, the strings are small, not the
+        decoded images), then parse_record runs in num_queue_threads parallel calls,
+        batched with drop_remainder (static batch shape, as shuffle_batch) and prefetched.
+        the decode threads are the tf.data runtime threads, no python coordinated queue runner.
 
-        img = (tf.cast(img, tf.float32) - [104.0, 117.0, 123.0]) * (1. / 255)   # ?
-        # img = (tf.cast(img, tf.float32))
+        batched_decode: batch the serialized records first, then map parse_batch on the batches.
+
+        cache: the decoded uint8 records (decode_record) are cached at the end of the first epoch,
+        in memory or in the spill file (see cache_plan), then shuffled each epoch (reshuffle_each_iteration,
+        a buffer of queue_elements decoded records, config.queue_memory_budget), normalized and batched.
+        the memory is at most cache_max_mb + the shuffle buffer, the first batch does not wait for the cache.
+        batched_decode is ignored with the cache (the batches would be cached as they are).
+        augment: in the map threads; with the cache, after the cache, so each epoch gets new random transforms.
+
+        the graph pulls the batch from a one-shot iterator, nothing to initialize,
+        after config.epochs the get_next raises tf.errors.OutOfRangeError.
+    """
+    files = record_file_list(record_file)
+
+    with tf.name_scope("input"):
+        dataset = tf.data.Dataset.from_tensor_slices(files)
+        dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+            lambda f: tf.data.TFRecordDataset(f, compression_type=record_schema.compression_type(compression)),
+            cycle_length=min(len(files), num_queue_threads), sloppy=True))
+        place = cache_plan(files, compression) if cache else None
+        if place is not None:
+            dataset = dataset.map(lambda serialized: decode_record(serialized, class_num),
+                                  num_parallel_calls=num_queue_threads)
+            dataset = dataset.cache('' if place == 'memory' else place)
+            # a bounded buffer (not a second copy of the whole cache), reshuffled each epoch
+            dataset = dataset.shuffle(queue_elements(image_size * image_size * 4, batch_size)).repeat(epochs)
+            if augment:
+                dataset = dataset.map(lambda nm, img, mask: (nm,) + aug.augment(img, mask, augment_seed),
+                                      num_parallel_calls=num_queue_threads)
+            dataset = dataset.map(lambda nm, img, mask: (nm, normalize(img, stats_file), mask),
+                                  num_parallel_calls=num_queue_threads)
+            dataset = dataset.batch(batch_size, drop_remainder=True)
+        elif batched_decode:
+            dataset = dataset.shuffle(queue_capacity).repeat(epochs)
+            dataset = dataset.batch(batch_size, drop_remainder=True)
+            dataset = dataset.map(lambda serialized: parse_batch(serialized, class_num, stats_file, augment),
+                                  num_parallel_calls=num_queue_threads)
+        else:
+            dataset = dataset.shuffle(queue_capacity).repeat(epochs)
+            dataset = dataset.map(lambda serialized: parse_record(serialized, class_num, stats_file, augment),
+                                  num_parallel_calls=num_queue_threads)
+            dataset = dataset.batch(batch_size, drop_remainder=True)
+        dataset = dataset.prefetch(2)
+
+        name_batch, img_batch, label_batch = dataset.make_one_shot_iterator().get_next()
+
+    if not sparse_label:
+        with tf.name_scope("one_hot"):
+            label_batch = tf.one_hot(label_batch, class_num, dtype=tf.uint8)
+
+    return name_batch, img_batch, label_batch
+
+
+def folder_batch_input(dataset_path_, batch_size=BS, class_num=num_classes, sparse_label=False,
+                       label_type=folder_label_type, stats_file=stats_path, cache=epoch_cache, augment=augmentation):
+    """input pipeline reading the dataset folder directly (no tfrecord), the same
+    (name_batch, img_batch, label_batch) contract as batch_input.
+
+    Note:
+        the folder is only listed at start (dataset_manifest.scan_dataset, no image is read),
+        so the first batch is ready after batch_size images are loaded, whatever the folder size.
+        each image is loaded by dataset_gen.load_sample (the same resize and label encoding as
+        create_tfrecord) in a tf.py_func, num_queue_threads in parallel (cv2 releases the GIL).
+
+        cache: the loaded uint8 samples are kept after the first epoch, in memory if the set is under
+        config.cache_max_mb, else in config.cache_spill_path, else not cached (streamed).
+        without cache, the paths are shuffled; with the cache, the cached samples.
+
+    :param
+        dataset_path_: the folder with src/ and labels/
+        label_type: 'rgb' or 'gray', as dataset_gen --label_type
+    """
+    samples = dataset_manifest.scan_dataset(dataset_path_)
+    if not samples:
+        raise ValueError("no image with label in {}".format(dataset_path_))
+    names = sorted(samples)
+
+    place = None
+    if cache:
+        size_mb = len(names) * image_size * image_size * 4 / 1024.0 ** 2
+        if size_mb <= cache_max_mb:
+            place = ''
+        elif cache_spill_path:
+            place = cache_spill_path
+        else:
+            logging.warning("epoch cache: {:.0f} MB is over {} MB and no cache_spill_path, streamed".format(
+                size_mb, cache_max_mb))
+
+    def _load(name, src, label):
+        image, mask = dataset_gen.load_sample(tf.compat.as_str(src), tf.compat.as_str(label), image_size,
+                                              class_num, label_type)
+        return name, image, mask
+
+    def _load_sample(name, src, label):
+        nm, img, mask = tf.py_func(_load, [name, src, label], [tf.string, tf.uint8, tf.uint8], stateful=False)
+        nm.set_shape([])
+        img.set_shape([image_size, image_size, 3])
+        mask.set_shape([image_size, image_size])
+        return nm, img, mask
+
+    with tf.name_scope("input"):
+        dataset = tf.data.Dataset.from_tensor_slices((names, [samples[n][0] for n in names],
+                                                      [samples[n][1] for n in names]))
+        if place is None:
+            dataset = dataset.shuffle(len(names)).repeat(epochs)
+            dataset = dataset.map(_load_sample, num_parallel_calls=num_queue_threads)
+        else:
+            dataset = dataset.map(_load_sample, num_parallel_calls=num_queue_threads)
+            dataset = dataset.cache(place)
+            dataset = dataset.shuffle(queue_elements(image_size * image_size * 4, batch_size)).repeat(epochs)
+        if augment:
+            dataset = dataset.map(lambda nm, img, mask: (nm,) + aug.augment(img, mask, augment_seed),
+                                  num_parallel_calls=num_queue_threads)
+        dataset = dataset.map(lambda nm, img, mask: (nm, normalize(img, stats_file), mask),
+                              num_parallel_calls=num_queue_threads)
+        dataset = dataset.batch(batch_size, drop_remainder=True).prefetch(2)
 
-        # img = tf.cast(img, tf.float32) * (1. / 255) - 0.5
+        name_batch, img_batch, label_batch = dataset.make_one_shot_iterator().get_next()
 
-        mask = tf.decode_raw(features['mask'], tf.uint8)
-        mask = tf.reshape(mask, [image_size, image_size, class_num])    # the mask/lable, is not rgb image. is label ID
+    if not sparse_label:
+        with tf.name_scope("one_hot"):
+            label_batch = tf.one_hot(label_batch, class_num, dtype=tf.uint8)
+
+    return name_batch, img_batch, label_batch
+
+
+def synthetic_batch_input(batch_size=BS, class_num=num_classes, sparse_label=False, seed=0, size=image_size):
+    """synthetic input, the same (name_batch, img_batch, label_batch) contract as batch_input, no dataset
+
+    Note:
+        one batch of random images (uniform uint8, normalized) and masks (random class id blocks of
+        16 x 16 pixels, valid ids in [0, class_num)) is generated once, by the initializer of local variables
+        (tf.local_variables_initializer), then the same batch is returned at each step,
+        so the input costs nothing: the step time is the model time.
+        it never ends (no tf.errors.OutOfRangeError), the loop is limited by its own iteration count.
+
+    :param
+        seed: inter, the op seed of the random batch
+        size: inter, the image size, default config.image_size
+    """
+    with tf.name_scope("synthetic_input"):
+        img = tf.random_uniform([batch_size, size, size, 3], 0, 256, tf.int32, seed=seed)
+        img = normalize(tf.cast(img, tf.uint8))
+
+        blocks = tf.random_uniform([batch_size, max(size // 16, 1), max(size // 16, 1), 1], 0, class_num, tf.int32,
+                                   seed=seed + 1)
+        mask = tf.cast(tf.image.resize_nearest_neighbor(blocks, [size, size])[..., 0], tf.uint8)
+        label = mask if sparse_label else tf.one_hot(mask, class_num, dtype=tf.uint8)
+
+        img_batch = tf.Variable(img, trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                name='image_buffer')
+        label_batch = tf.Variable(label, trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                  name='label_buffer')
+        name_batch = tf.constant(['synthetic_{}'.format(i) for i in range(batch_size)])
+
+    return name_batch, tf.identity(img_batch), tf.identity(label_batch)
+
+
+def memmap_batch_input(dataset_dir, batch_size=BS, class_num=num_classes, sparse_label=False, seed=None,
+                       stats_file=stats_path, augment=augmentation):
+    """input pipeline of the memory-mapped array dataset (dataset_gen --output_format memmap),
+    the same (name_batch, img_batch, label_batch) contract as batch_input.
+
+    Note:
+        the batches are fancy-indexed from the memmap by a tf.py_func (see memmap_dataset),
+        a new permutation each epoch, and stop with tf.errors.OutOfRangeError after config.epochs,
+        same as the num_epochs of batch_input.
+        the py_func runs in a queue-runner thread (tf.train.batch, enqueue_many),
+        so the next batch is prepared while the network runs, start_queue_runners is needed as before.
+
+    :param
+        dataset_dir: the folder of the array files
+        seed: inter or None, the seed of the permutation
+        stats_file: see normalize
+        augment: bool, augment the batch before the enqueue (augment.augment_batch)
+    :return:
+        name_batch, img_batch, label_batch
+    """
+    dataset = memmap_dataset.MemmapDataset(dataset_dir)
+    if dataset.meta['image_size'] != image_size:
+        raise ValueError("memmap dataset {} image_size is {}, config.image_size is {}".format(
+            dataset_dir, dataset.meta['image_size'], image_size))
+    batches = dataset.batch_iterator(batch_size, num_epochs=epochs, seed=seed)
+
+    def _next_batch():
+        return next(batches)    # StopIteration --> tf.errors.OutOfRangeError
+
+    with tf.name_scope("input"):
+        nm, img, mask = tf.py_func(_next_batch, [], [tf.string, tf.uint8, tf.uint8], stateful=True)
+        nm.set_shape([batch_size])
+        img.set_shape([batch_size, image_size, image_size, 3])
+        mask.set_shape([batch_size, image_size, image_size])
+
+        if augment:
+            img, mask = aug.augment_batch(img, mask, augment_seed)
+
+        name_batch, img_batch, label_batch = tf.train.batch([nm, img, mask], batch_size=batch_size,
+                                                            capacity=2 * batch_size, enqueue_many=True,
+                                                            num_threads=1)
+
+    with tf.name_scope("decode_process"):
+        img_batch = normalize(img_batch, stats_file)
+
+    if not sparse_label:
+        with tf.name_scope("one_hot"):
+            label_batch = tf.one_hot(label_batch, class_num, dtype=tf.uint8)
+
+    return name_batch, img_batch, label_batch
+
+
+def indexed_batch_input(index_file, batch_size=BS, class_num=num_classes, sparse_label=False, seed=0,
+                        stats_file=stats_path, augment=augmentation):
+    """input pipeline of the indexed tfrecord files (record_index), with exact per-epoch shuffling,
+    the same (name_batch, img_batch, label_batch) contract as batch_input.
+
+    Note:
+        each epoch is a true permutation of all the records (record_index.RecordIndex.epoch_order),
+        the records are read by seek + read, so no shuffle buffer is needed (shuffle_batch with
+        min_after_dequeue=0 mixes only the records already in the queue).
+        the py_func only reads the bytes, the parse/decode runs in num_queue_threads threads.
+
+    :param
+        index_file: the index file of dataset_gen or record_index.py (./data/train.index.json)
+        seed: inter, the permutation of epoch e is reproducible by (seed, e)
+    """
+    index = record_index.RecordIndex(index_file)
+    records = index.iter_epochs(num_epochs=epochs, seed=seed)
+    lock = threading.Lock()
+
+    def _next_record():
+        with lock:
+            return next(records)    # StopIteration --> tf.errors.OutOfRangeError
+
+    with tf.name_scope("input"):
+        serialized_example = tf.py_func(_next_record, [], tf.string, stateful=True)
+        serialized_example.set_shape([])
+
+    nm, img, mask = decode_record(serialized_example, class_num, augment)
+
+    name_batch, img_batch, label_batch = tf.train.batch([nm, img, mask], batch_size=batch_size,
+                                                        capacity=queue_elements(image_size * image_size * 4,
+                                                                                batch_size),
+                                                        num_threads=num_queue_threads)
+    with tf.name_scope("decode_process"):
+        img_batch = normalize(img_batch, stats_file)
 
-        # mask = (tf.cast(mask, tf.float32) - [104.0, 117.0, 123.0]) * (1. / 255)
-        # mask = tf.cast(mask, tf.float32) * (1. / 255) - 0.5
+    if not sparse_label:
+        with tf.name_scope("one_hot"):
+            label_batch = tf.one_hot(label_batch, class_num, dtype=tf.uint8)
 
-    name_batch, img_batch, label_batch = tf.train.shuffle_batch([nm, img, mask],
-                                                                batch_size=batch_size,
-                                                                capacity=queue_capacity,
-                                                                min_after_dequeue=0, num_threads=num_queue_threads)
     return name_batch, img_batch, label_batch
 
 
@@ -0,0 +1,215 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the label codec: mapping between colormap label images and class id matrices.
+
+2026/10/18
+python ==2.7.15
+numpy
+
+Note:
+    the lookup table (color -> class id) is built only once for each colormap,
+    and then whole images (h, w, 3) or image stacks (n, h, w, 3) are encoded with array operations,
+    there is no python loop over the pixels.
+
+    the color of a pixel is packed into one integer key: R*256*256 + G*256 + B,
+    and the key is used as the index of the lookup table.
+    the colors which are not in the colormap are mapped to unknown_id (default: 255),
+    they can be reported by find_unknown(), or mapped to the background by encode(..., strict=False)
+
+    the order of colormap element is [R_value,  G_value, B_value],
+    so the label image must be RGB image, not the BGR image from cv2.imread
+
+    how to use, eg:
+        codec = get_codec('voc')
+        label_2d = codec.encode(rgb_label_image)        # (h, w), class id
+        label = codec.one_hot(label_2d)                 # (h, w, num_classes)
+"""
+# ===================================================================================== #
+
+
+import logging
+import time
+
+import numpy as np
+
+
+VOC_COLORMAP = [[0, 0, 0], [128, 0, 0], [0, 128, 0], [128, 128, 0],
+                [0, 0, 128], [128, 0, 128], [0, 128, 128], [128, 128, 128],
+                [64, 0, 0], [192, 0, 0], [64, 128, 0], [192, 128, 0],
+                [64, 0, 128], [192, 0, 128], [64, 128, 128], [192, 128, 128],
+                [0, 64, 0], [128, 64, 0], [0, 192, 0], [128, 192, 0],
+                [0, 64, 128]]
+
+VOC_CLASSES = ['background', 'aeroplane', 'bicycle', 'bird', 'boat',
+               'bottle', 'bus', 'car', 'cat', 'chair', 'cow',
+               'diningtable', 'dog', 'horse', 'motorbike', 'person',
+               'potted plant', 'sheep', 'sofa', 'train', 'tv/monitor']
+
+# 0:background, 1: building, 2: car, 3: river, 4: green
+YUUAV_COLORMAP = [[0, 0, 0], [192, 128, 0], [128, 128, 128], [0, 64, 128], [0, 129, 0]]
+
+YUUAV_CLASSES = ['background', 'building', 'car', 'river', 'green']
+
+UNKNOWN_ID = 255
+
+
+def color_key(rgb):
+    """pack the rgb value of the last axis into one integer key, R*256*256 + G*256 + B
+
+    :param
+        rgb: a uint8 array with shape (..., 3)
+    :return:
+        a int32 array with shape (...)
+    """
+    rgb = np.asarray(rgb)
+    return (rgb[..., 0].astype(np.int32) << 16) | (rgb[..., 1].astype(np.int32) << 8) | rgb[..., 2].astype(np.int32)
+
+
+class LabelCodec(object):
+    """colormap label codec, encode rgb label images into class id matrices and back.
+
+    Note:
+        the lookup table has 256**3 entries (16 MB), it is built once at __init__,
+        so create the codec once (or using get_codec) and reuse it for the whole dataset.
+    """
+
+    def __init__(self, colormap, class_names=None, unknown_id=UNKNOWN_ID):
+        """
+        :param
+            colormap: list of [R, G, B], the index of the color is the class id
+            class_names: list of string, optional
+            unknown_id: inter, the class id for colors which are not in the colormap
+        """
+        self.colormap = np.array(colormap, dtype=np.uint8)
+        self.num_classes = len(colormap)
+        self.class_names = class_names
+        self.unknown_id = unknown_id
+
+        self.keys = color_key(self.colormap)
+
+        self.table = np.full((256 ** 3), unknown_id, dtype=np.uint8)
+        self.table[self.keys] = np.arange(self.num_classes, dtype=np.uint8)
+
+    def encode(self, rgb_label, strict=False):
+        """rgb label image(s) to class id matrix
+
+        :param
+            rgb_label: uint8 array with shape (h, w, 3) or (n, h, w, 3), RGB order
+            strict: bool, if True raise ValueError when there are unknown colors,
+                    otherwise the unknown colors are mapped to background (class 0) and logged
+        :return:
+            uint8 array with shape (h, w) or (n, h, w), the value is class id
+        """
+        label_2d = self.table[color_key(rgb_label)]
+
+        unknown = label_2d == self.unknown_id
+        if unknown.any():
+            colors = self.find_unknown(rgb_label)
+            if strict:
+                raise ValueError("label contains {} pixels with unknown colors: {}".format(
+                    int(unknown.sum()), colors.tolist()))
+            logging.warning("label contains {} pixels with unknown colors {}, "
+                            "mapped to background".format(int(unknown.sum()), colors.tolist()[:10]))
+            label_2d[unknown] = 0
+
+        return label_2d
+
+    def find_unknown(self, rgb_label):
+        """ report the colors that are not in the colormap
+
+        :return:
+            uint8 array with shape (k, 3), the unique unknown colors (RGB)
+        """
+        keys = color_key(rgb_label)
+        unknown_keys = np.unique(keys[self.table[keys] == self.unknown_id])
+        return np.stack([(unknown_keys >> 16) & 255,
+                         (unknown_keys >> 8) & 255,
+                         unknown_keys & 255], axis=-1).astype(np.uint8)
+
+    def one_hot(self, label_2d):
+        """class id matrix (..., h, w) to one-hot label (..., h, w, num_classes), dtype uint8
+        """
+        return one_hot(label_2d, self.num_classes)
+
+    def decode(self, label_2d):
+        """class id matrix (..., h, w) to RGB label image (..., h, w, 3)
+        """
+        return self.colormap[label_2d]
+
+
+def one_hot(label_2d, class_num):
+    """ class id matrix (..., h, w) to one-hot label (..., h, w, class_num), dtype uint8
+    """
+    return (np.asarray(label_2d)[..., np.newaxis] == np.arange(class_num, dtype=np.uint8)).astype(np.uint8)
+
+
+_CODECS = {}
+
+COLORMAPS = {'voc': (VOC_COLORMAP, VOC_CLASSES),
+             'yuuav': (YUUAV_COLORMAP, YUUAV_CLASSES)}
+
+
+def get_codec(type_cp='voc'):
+    """return the cached codec of the given colormap, 'voc' or 'yuuav'
+    """
+    if type_cp not in _CODECS:
+        colormap, class_names = COLORMAPS[type_cp]
+        _CODECS[type_cp] = LabelCodec(colormap, class_names)
+    return _CODECS[type_cp]
+
+
+def _loop_encode(rgb_label_image, class_num):
+    """ the per-pixel loop version (the old rgb_label_input), only used for the benchmark
+    """
+    transf_value = np.zeros((256**3), dtype=np.uint8)
+    for i, colormap in enumerate(VOC_COLORMAP):
+        transf_value[(colormap[0]*256*256 + colormap[1]*256 + colormap[2])] = i
+
+    h, w, _ = rgb_label_image.shape
+    label_2d = np.zeros((h, w), dtype=np.uint8)
+    for i in range(h):
+        for j in range(w):
+            idx = (int(rgb_label_image[i, j, 0]) * 256 * 256 + int(rgb_label_image[i, j, 1]) * 256
+                   + int(rgb_label_image[i, j, 2]))
+            label_2d[i, j] = transf_value[idx]
+
+    label = np.zeros(shape=(h, w, class_num), dtype=np.uint8)
+    for i in range(h):
+        for j in range(w):
+            label[i, j, label_2d[i, j]] = 1
+    return label
+
+
+def benchmark(image_size=256, num_images=8, loop_images=2):
+    """ micro-benchmark, the per-pixel loop encode vs the vectorized codec
+
+    :return:
+        dict, seconds per image of each method and the speedup
+    """
+    rng = np.random.RandomState(0)
+    codec = get_codec('voc')
+    ids = rng.randint(0, codec.num_classes, size=(num_images, image_size, image_size)).astype(np.uint8)
+    rgb = codec.decode(ids)
+
+    start = time.time()
+    for k in range(loop_images):
+        loop_label = _loop_encode(rgb[k], codec.num_classes)
+    loop_time = (time.time() - start) / loop_images
+
+    start = time.time()
+    label = codec.one_hot(codec.encode(rgb, strict=True))
+    vec_time = (time.time() - start) / num_images
+
+    assert (label[loop_images - 1] == loop_label).all()
+
+    return {'image_size': image_size,
+            'loop_sec_per_image': loop_time,
+            'vectorized_sec_per_image': vec_time,
+            'speedup': loop_time / vec_time}
+
+
+if __name__ == '__main__':
+    print('***************** module testing ******************')
+    result = benchmark()
+    print('loop: {loop_sec_per_image:.4f}s/image, vectorized: {vectorized_sec_per_image:.6f}s/image, '
+          'speedup: x{speedup:.0f}'.format(**result))
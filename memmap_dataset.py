@@ -0,0 +1,113 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the memory-mapped array dataset, an alternative to the tfrecord file
+for the small fixed-shape datasets (written by dataset_gen --output_format memmap).
+
+2026/10/18
+python ==2.7.15
+numpy
+
+Note:
+    the dataset folder:
+        images.u8: uint8 raw array (n, image_size, image_size, 3), RGB
+        masks.u8: uint8 raw array (n, image_size, image_size), class id
+        names.txt: the n record names, one per line
+        meta.json: {"version": 1, "count": n, "image_size": , "num_classes": }
+        stats.json: the dataset statistics (dataset_stats)
+
+    the files are opened with np.memmap(mode='r'), so the pages are loaded on demand from the OS cache,
+    and several training processes reading the same dataset share the same pages.
+    a batch is built by fancy-indexing the memmap with the (sorted) sample indices, that copies only
+    the batch itself, there is no protobuf parsing and no decode.
+"""
+# ===================================================================================== #
+
+
+import os
+import json
+
+import numpy as np
+
+
+MEMMAP_VERSION = 1
+
+IMAGES = 'images.u8'
+MASKS = 'masks.u8'
+NAMES = 'names.txt'
+META = 'meta.json'
+STATS = 'stats.json'     # dataset_stats, written by dataset_gen.create_memmap
+
+
+class MemmapWriter(object):
+    """ append the samples to the array files, the meta.json is written at close()
+    """
+
+    def __init__(self, out_dir, image_size, class_num):
+        if not os.path.exists(out_dir):
+            os.makedirs(out_dir)
+        self.out_dir = out_dir
+        self.image_size = int(image_size)
+        self.class_num = int(class_num)
+        self.count = 0
+        self.images = open(os.path.join(out_dir, IMAGES), 'wb')
+        self.masks = open(os.path.join(out_dir, MASKS), 'wb')
+        self.names = open(os.path.join(out_dir, NAMES), 'w')
+
+    def write(self, name, image, mask):
+        if image.shape != (self.image_size, self.image_size, 3) or mask.shape != (self.image_size, self.image_size):
+            raise ValueError("sample {}: image {} / mask {} do not match image_size {}".format(
+                name, image.shape, mask.shape, self.image_size))
+        self.images.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+        self.masks.write(np.ascontiguousarray(mask, dtype=np.uint8).tobytes())
+        self.names.write(name + '\n')
+        self.count += 1
+
+    def close(self):
+        for f in (self.images, self.masks, self.names):
+            f.close()
+        with open(os.path.join(self.out_dir, META), 'w') as f:
+            json.dump({'version': MEMMAP_VERSION, 'count': self.count,
+                       'image_size': self.image_size, 'num_classes': self.class_num}, f, indent=1)
+
+
+class MemmapDataset(object):
+    """ read-only view of the array files
+    """
+
+    def __init__(self, dataset_dir):
+        with open(os.path.join(dataset_dir, META)) as f:
+            self.meta = json.load(f)
+        n, size = self.meta['count'], self.meta['image_size']
+
+        self.images = np.memmap(os.path.join(dataset_dir, IMAGES), dtype=np.uint8, mode='r',
+                                shape=(n, size, size, 3))
+        self.masks = np.memmap(os.path.join(dataset_dir, MASKS), dtype=np.uint8, mode='r',
+                               shape=(n, size, size))
+        with open(os.path.join(dataset_dir, NAMES)) as f:
+            self.names = np.array([line.rstrip('\n').encode('utf-8') for line in f], dtype=object)
+
+    def __len__(self):
+        return self.meta['count']
+
+    def batch(self, indices):
+        """
+        :return:
+            (names, images, masks) of the given sample indices
+        """
+        indices = np.sort(indices)     # sequential page access
+        return self.names[indices], self.images[indices], self.masks[indices]
+
+    def batch_iterator(self, batch_size, num_epochs=None, shuffle=True, seed=None):
+        """ generator of (names, images, masks) batches, a new permutation for each epoch,
+        the last incomplete batch of each epoch is dropped
+
+        :param
+            num_epochs: inter or None (forever)
+        """
+        rng = np.random.RandomState(seed)
+        epoch = 0
+        while num_epochs is None or epoch < num_epochs:
+            order = rng.permutation(len(self)) if shuffle else np.arange(len(self))
+            for start in range(0, len(self) - batch_size + 1, batch_size):
+                yield self.batch(order[start:start + batch_size])
+            epoch += 1
@@ -0,0 +1,340 @@
+# ===================================================================================== #
+# coding:utf-8
+"""individual module, optimize the frozen model.pb for the inference, and report the node count,
+the file size and the latency before and after.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    the steps, on the GraphDef:
+    1. input: the node source_input/image_batch/image_tensor (the identity of the input queue batch in the
+       model.pb of the older train_main) is replaced by a placeholder of the same name and shape,
+       the deploy code is unchanged. the placeholder of the exported model (export_model.py) is kept.
+    2. dropout: removed (export_model.strip_dropout).
+    3. prune: only the ancestors of predict/predict are kept, the tfrecord reader, the queues, the decode
+       and the training ops are dropped.
+    4. input normalization (default, --no_fold_input to skip): (x - mean) * scale (get_batch.normalize, the fixed
+       mean [104, 117, 123] and scale 1/255, or the --stats file) moves into the model, the optimized model
+       takes the raw pixels (0-255, float): the scale is folded into the weights of the first conv, the mean
+       is subtracted by one Sub node on the input. the zero padding (SAME) of the first conv still pads
+       x - mean with 0, the result is exact at the border too (max_abs_diff of the report: float rounding).
+       the input name is unchanged, the Sub node (export_model.RAW_INPUT_NODE) tells the raw pixel input:
+       deploy.py and quantize.py feed the raw pixels to such a model, the normalized image to the others.
+    5. batch norms: the batch norms of unet follow the bias of their conv (conv / conv2d_transpose -->
+       BiasAdd --> FusedBatchNorm), a pattern fold_old_batch_norms does not match; they are folded here into
+       the weights and the bias of the conv (fold_batch_norms). the batch norms of the exported model
+       (unet is_training=False) use the moving statistics; a model with batch norms in training mode
+       (batch statistics, an older train_main model.pb) is refused, re-export it first:
+       $ python export_model.py -m model.pb -o model_dynamic.pb
+    6. graph transforms (tensorflow.tools.graph_transforms): remove the identity ops, constant folding,
+       fold the batch norms directly on a conv (if any), sort by execution order.
+
+    report: one row for the original model, the clean model (steps 1-3) and the optimized model:
+        --nodes, batch_norms (the FusedBatchNorm nodes left), size_mb, ms_per_batch (p50 on a random batch),
+          and for the optimized model the
+          max_abs_diff of the softmax and the pixel agreement of the argmax against the clean model
+          (same pixels; the original keeps the random dropout, it is not comparable)
+
+    how to use, eg:
+    $ python optimize_model.py -m ./final_model/model.pb -o ./final_model/model_opt.pb --report optimize.json
+    $ python deploy.py --colormap voc --img test.jpg --class_num 21    # with ./final_model/model_opt.pb as model.pb
+"""
+# ===================================================================================== #
+
+
+import os
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from config import image_size
+from export_model import INPUT_TENSOR, OUTPUT_TENSOR, RAW_INPUT_NODE, load_graph_def, strip_dropout
+import dataset_stats
+
+
+MEAN = [104.0, 117.0, 123.0]
+SCALE = [1. / 255] * 3
+
+TRANSFORMS = ['remove_nodes(op=Identity, op=CheckNumerics)',
+              'fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'fold_old_batch_norms',
+              'sort_by_execution_order']
+
+
+def input_shape(graph_def):
+    """ the static shape (list, None for unknown) of the input tensor of the frozen model
+    """
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        return graph.get_tensor_by_name(INPUT_TENSOR + ':0').shape.as_list()
+
+
+def clean_graph_def(graph_def):
+    """ steps 1-3 of the Note: the input placeholder, no dropout, pruned to the predict
+    """
+    shape = input_shape(graph_def)
+    output = tf.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        new = output.node.add()
+        if node.name == INPUT_TENSOR and node.op != 'Placeholder':
+            new.name = INPUT_TENSOR
+            new.op = 'Placeholder'
+            new.attr['dtype'].type = tf.float32.as_datatype_enum
+            new.attr['shape'].shape.CopyFrom(tf.TensorShape(shape).as_proto())
+        else:
+            new.CopyFrom(node)
+    return tf.graph_util.extract_sub_graph(strip_dropout(output), [OUTPUT_TENSOR])
+
+
+def _const_of(nodes, name):
+    """ the Const node behind name, through the Identity ops (the variable/read of the frozen variables)
+    """
+    node = nodes[name.split(':')[0].lstrip('^')]
+    while node.op == 'Identity':
+        node = nodes[node.input[0].split(':')[0]]
+    if node.op != 'Const':
+        raise ValueError("{} is not a constant ({})".format(name, node.op))
+    return node
+
+
+def fold_input_normalization(graph_def, mean=MEAN, scale=SCALE):
+    """ (x - mean) * scale in the model: x - mean by a Sub node after the input, the scale folded into the
+    first conv, w' = w * scale[c]
+
+    Note:
+        the mean is not folded into the bias (b - sum(w' * mean)), the zero padding of the conv would then
+        stand for the pixel 0 instead of the mean, and the border pixels would differ.
+    :return:
+        a new GraphDef, the input takes the raw pixels
+    """
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    consumers = {}
+    for node in output.node:
+        for name in node.input:
+            consumers.setdefault(name.split(':')[0], []).append(node)
+
+    # the input --> (the NCHW transpose) --> the first conv
+    first = consumers.get(INPUT_TENSOR, [])
+    top = INPUT_TENSOR
+    conv = None
+    while conv is None:
+        next_ = consumers.get(top, [])
+        if len(next_) != 1 or next_[0].op not in ('Transpose', 'Conv2D'):
+            raise ValueError("the input {} is not followed by one conv ({})".format(
+                INPUT_TENSOR, [n.op for n in next_]))
+        if next_[0].op == 'Conv2D':
+            conv = next_[0]
+        top = next_[0].name
+
+    weights_node = _const_of(nodes, conv.input[1])
+    weights = tensor_util.MakeNdarray(weights_node.attr['value'].tensor)   # (k, k, 3, filters)
+    scale = np.asarray(scale, np.float32)
+    folded_weights = weights * scale[None, None, :, None]
+    weights_node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(folded_weights.astype(np.float32)))
+
+    # input --> input_normalization/sub (x - mean) --> the first consumer
+    mean_node = output.node.add()
+    mean_node.name = 'input_normalization/mean'
+    mean_node.op = 'Const'
+    mean_node.attr['dtype'].type = tf.float32.as_datatype_enum
+    mean_node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(np.asarray(mean, np.float32)))
+    sub = output.node.add()
+    sub.name = RAW_INPUT_NODE
+    sub.op = 'Sub'
+    sub.input.extend([INPUT_TENSOR, mean_node.name])
+    sub.attr['T'].type = tf.float32.as_datatype_enum
+    for i, name in enumerate(first[0].input):
+        if name.split(':')[0] == INPUT_TENSOR:
+            first[0].input[i] = sub.name
+
+    logging.info("input normalization: the mean subtracted on the input, the scale folded into {}".format(
+        conv.name))
+    return output
+
+
+def batch_norm_count(graph_def):
+    return sum(1 for node in graph_def.node if node.op.startswith('FusedBatchNorm'))
+
+
+def fold_batch_norms(graph_def):
+    """ step 5 of the Note: conv --> BiasAdd --> FusedBatchNorm (inference mode) becomes conv --> BiasAdd,
+    with f = gamma / sqrt(variance + epsilon) on the output channels: w' = w * f, b' = (b - mean) * f + beta
+
+    :return:
+        a new GraphDef, pruned to the predict
+    """
+    training_norms = [node.name for node in graph_def.node
+                      if node.op.startswith('FusedBatchNorm') and node.attr['is_training'].b]
+    if training_norms:
+        raise ValueError("{} batch norms in training mode (batch statistics), eg {}, can not be folded: "
+                         "re-export the model with export_model.py (inference mode)".format(
+                             len(training_norms), training_norms[0]))
+
+    output = tf.GraphDef()
+    output.CopyFrom(graph_def)
+    nodes = dict((node.name, node) for node in output.node)
+    consumers = {}
+    for node in output.node:
+        for name in node.input:
+            consumers.setdefault(name.split(':')[0].lstrip('^'), []).append(node)
+
+    # the output channel axis of the weights: conv2d (k, k, in, out), conv2d_transpose (k, k, out, in)
+    out_axis = {'Conv2D': 3, 'Conv2DBackpropInput': 2}
+    folded = {}
+    for norm in output.node:
+        if not norm.op.startswith('FusedBatchNorm'):
+            continue
+        bias_add = nodes[norm.input[0].split(':')[0]]
+        conv = nodes[bias_add.input[0].split(':')[0]] if bias_add.op == 'BiasAdd' else None
+        if conv is None or conv.op not in out_axis or len(consumers[bias_add.name]) != 1 \
+                or len(consumers[conv.name]) != 1:
+            continue
+
+        gamma, beta, mean, variance = [tensor_util.MakeNdarray(_const_of(nodes, name).attr['value'].tensor)
+                                       for name in norm.input[1:5]]
+        factor = gamma / np.sqrt(variance + norm.attr['epsilon'].f)
+        weights_node = _const_of(nodes, conv.input[1])
+        bias_node = _const_of(nodes, bias_add.input[1])
+        weights = tensor_util.MakeNdarray(weights_node.attr['value'].tensor)
+        bias = tensor_util.MakeNdarray(bias_node.attr['value'].tensor)
+        shape = [1, 1, 1, 1]
+        shape[out_axis[conv.op]] = -1
+        weights_node.attr['value'].tensor.CopyFrom(
+            tensor_util.make_tensor_proto((weights * factor.reshape(shape)).astype(np.float32)))
+        bias_node.attr['value'].tensor.CopyFrom(
+            tensor_util.make_tensor_proto(((bias - mean) * factor + beta).astype(np.float32)))
+        folded[norm.name] = bias_add.name
+
+    # the consumers of the batch norm output read the bias add
+    for node in output.node:
+        for i, name in enumerate(node.input):
+            if name.split(':')[0] in folded and name.split(':')[1:] in ([], ['0']):
+                node.input[i] = folded[name.split(':')[0]]
+
+    logging.info("{} batch norms folded, {} left".format(len(folded), batch_norm_count(graph_def) - len(folded)))
+    return tf.graph_util.extract_sub_graph(output, [OUTPUT_TENSOR])
+
+
+def transform(graph_def):
+    """ step 6 of the Note
+    """
+    return TransformGraph(graph_def, [INPUT_TENSOR], [OUTPUT_TENSOR], TRANSFORMS)
+
+
+def optimize(graph_def, fold_input=True, mean=MEAN, scale=SCALE):
+    """ all the steps of the Note
+
+    :return:
+        the clean GraphDef (the reference of the report), the optimized GraphDef
+    """
+    clean = clean_graph_def(graph_def)
+    optimized = fold_input_normalization(clean, mean, scale) if fold_input else clean
+    return clean, transform(fold_batch_norms(optimized))
+
+
+def run_model(graph_def, batch, repeat=10):
+    """
+    :return:
+        the output of the batch, and the p50 ms of the repeat runs (after one warmup)
+    """
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        image = graph.get_tensor_by_name(INPUT_TENSOR + ':0')
+        predict = graph.get_tensor_by_name(OUTPUT_TENSOR + ':0')
+        with tf.Session() as sess:
+            output = sess.run(predict, {image: batch})
+            times = []
+            for _ in range(repeat):
+                start = time.time()
+                sess.run(predict, {image: batch})
+                times.append(time.time() - start)
+    return output, float(np.percentile(times, 50)) * 1000
+
+
+def optimize_report(pb_path, out_path, fold_input=True, stats_file=None, batch_size=1, size=image_size,
+                    repeat=10):
+    """ optimize the frozen model to out_path, and compare the models
+
+    :return:
+        list of dict, the original, clean and optimized rows
+    """
+    if stats_file:
+        stats = dataset_stats.load_stats(stats_file)
+        mean, scale = stats['mean'], list(1. / np.maximum(stats['std'], 1e-3))
+    else:
+        mean, scale = MEAN, SCALE
+
+    original = load_graph_def(pb_path)
+    clean, optimized = optimize(original, fold_input, mean, scale)
+    with tf.gfile.FastGFile(out_path, mode='wb') as f:
+        f.write(optimized.SerializeToString())
+
+    # the fixed dims of the input (an older model.pb), else batch_size, size
+    shape = [d if d is not None else default for d, default in zip(input_shape(original),
+                                                                    [batch_size, size, size, 3])]
+    pixels = np.random.RandomState(0).randint(0, 256, size=shape).astype(np.float32)
+    normalized = (pixels - np.asarray(mean, np.float32)) * np.asarray(scale, np.float32)
+
+    rows = []
+    reference = None
+    for variant, graph_def, batch in (('original', original, normalized), ('clean', clean, normalized),
+                                      ('optimized', optimized, pixels if fold_input else normalized)):
+        output, latency = run_model(graph_def, batch, repeat)
+        row = {'variant': variant, 'nodes': len(graph_def.node), 'batch_norms': batch_norm_count(graph_def),
+               'size_mb': graph_def.ByteSize() / 1024.0 ** 2, 'ms_per_batch': latency}
+        if variant == 'clean':
+            reference = output
+        elif variant == 'optimized':
+            row['max_abs_diff'] = float(np.abs(output - reference).max())
+            row['argmax_agree'] = float(np.mean(output.argmax(axis=1) == reference.argmax(axis=1)))
+        logging.info("{}".format(row))
+        rows.append(row)
+    rows[0]['size_mb'] = os.path.getsize(pb_path) / 1024.0 ** 2
+    return rows
+
+
+def main(_):
+    from benchmark_input import print_rows
+
+    out_path = FLAGS.out or os.path.splitext(FLAGS.model)[0] + '_opt.pb'
+    rows = optimize_report(FLAGS.model, out_path, not FLAGS.no_fold_input, FLAGS.stats, FLAGS.batch_size,
+                           FLAGS.image_size, FLAGS.repeat)
+    print_rows(rows)
+
+    if FLAGS.report:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='optimize the frozen model for the inference')
+
+    parser.add_argument('--model', '-m', help='the frozen model.pb', default='./final_model/model.pb')
+    parser.add_argument('--out', '-o', help='the optimized model path, default: model_opt.pb next to the model',
+                        default=None)
+    parser.add_argument('--no_fold_input', action='store_true',
+                        help='keep the input normalization out of the model (the input is normalized)')
+    parser.add_argument('--stats', help='the dataset stats file of the training normalization, '
+                                        'default the fixed mean [104, 117, 123] and scale 1/255', default=None)
+    parser.add_argument('--batch_size', '-b', help='inter, the batch of the latency (a fixed shape model: its own)',
+                        default=1, type=int)
+    parser.add_argument('--image_size', help='inter, the image size of the latency (a fixed shape model: its own)',
+                        default=image_size, type=int)
+    parser.add_argument('--repeat', help='inter, the timed runs of each model', default=10, type=int)
+    parser.add_argument('--report', help='path of the json report', default=None)
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
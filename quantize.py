@@ -0,0 +1,323 @@
+# ===================================================================================== #
+# coding:utf-8
+"""individual module, post-training int8 quantization of the frozen model (model.pb of train_main)
+to a TFLite flatbuffer for the CPU inference, and the report against the float model.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    1. inference graph: the frozen model.pb holds the input queue and the dropout of the training graph,
+       the input tensor (source_input/image_batch/image_tensor) is replaced by a placeholder, the dropout
+       is removed (export_model.strip_dropout) and the graph is pruned to predict/predict
+       (placeholder_graph_def).
+    2. calibration set: batches of normalized images decoded from the tfrecords (get_batch.parse_batch),
+       the same input as at training; the raw pixels for a model with the input normalization folded in
+       (optimize_model.py, export_model.takes_raw_pixels).
+    3. quantization (TFLite converter):
+        --mode weights: int8 weights, float activations (post_training_quantize), about 4x smaller
+        --mode full: uint8 weights and activations. with a converter supporting representative_dataset
+                     (newer tensorflow), each tensor is calibrated on the calibration set; with the
+                     tensorflow 1.11 TOCO, the range of the input and of each activation is measured by
+                     running the float graph on the calibration set, and a FakeQuantWithMinMaxVars with
+                     this min/max is inserted after each activation (fake_quant_graph_def), TOCO reads
+                     the range of each array from it.
+    4. report: size (MB), latency (ms/batch) and mIoU on the evaluation records, float vs int8, and the deltas.
+
+    the .tflite model is loaded by deploy.py (--model ./final_model/model.tflite) with the same interface
+    as the frozen model.
+
+    how to use, eg:
+    $ python quantize.py -m ./final_model/model.pb -r ./data_voc/train.tfrecords -e ./data/val.tfrecords \
+        --mode full --report quantize.json
+"""
+# ===================================================================================== #
+
+
+import os
+import json
+import time
+import logging
+import argparse
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+
+from config import BS, image_size, num_classes, record_compression
+from get_batch import parse_batch, decode_batch
+from export_model import INPUT_TENSOR, OUTPUT_TENSOR, load_graph_def, strip_dropout, takes_raw_pixels
+import record_schema
+
+
+INPUT_NAME = 'input_image'
+
+lite = tf.lite if hasattr(tf, 'lite') else tf.contrib.lite
+
+
+def placeholder_graph_def(pb_path, batch_size=BS, size=image_size):
+    """ the inference graph of the frozen model: placeholder INPUT_NAME (batch_size, size, size, 3) float32
+    --> OUTPUT_TENSOR, without the input queue and the dropout
+    """
+    with tf.Graph().as_default() as graph:
+        image = tf.placeholder(tf.float32, [batch_size, size, size, 3], name=INPUT_NAME)
+        tf.import_graph_def(strip_dropout(load_graph_def(pb_path)), input_map={INPUT_TENSOR + ':0': image},
+                            name='')
+        return tf.graph_util.extract_sub_graph(graph.as_graph_def(), [INPUT_NAME, OUTPUT_TENSOR])
+
+
+def record_batches(record_file, num_batches, batch_size=BS, compression=record_compression, normalize=True):
+    """ the first num_batches batches of (normalized images, class id masks) of the record file
+
+    :param
+        normalize: False, the raw pixels (float32 0-255), for a model with the normalization folded in
+    """
+    with tf.Graph().as_default():
+        serialized = tf.placeholder(tf.string, [batch_size])
+        if normalize:
+            _, images, masks = parse_batch(serialized)
+        else:
+            _, images, masks = decode_batch(serialized)
+            images = tf.cast(images, tf.float32)
+        records = tf.python_io.tf_record_iterator(record_file, record_schema.record_options(compression))
+
+        batches = []
+        with tf.Session() as sess:
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) == batch_size:
+                    batches.append(sess.run([images, masks], {serialized: batch}))
+                    batch = []
+                    if len(batches) == num_batches:
+                        break
+    return batches
+
+
+def activation_ranges(graph_def, images):
+    """ the min/max of the input and of each activation of the float graph, on the calibration images
+
+    Note:
+        the activations are the float outputs of all the ops but the constants (and their Identity reads),
+        the input and the output (the softmax range is fixed by the converter).
+        each range contains 0, as the quantized ranges must.
+    :return:
+        (input min, input max), dict {op name: (min, max)}
+    """
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        image = graph.get_tensor_by_name(INPUT_NAME + ':0')
+        tensors = [op.outputs[0] for op in graph.get_operations()
+                   if op.type not in ('Const', 'Identity', 'Placeholder') and op.outputs
+                   and op.outputs[0].dtype == tf.float32 and op.name != OUTPUT_TENSOR]
+        ranges = {}
+        with tf.Session() as sess:
+            for batch in images:
+                for tensor, value in zip(tensors, sess.run(tensors, {image: batch})):
+                    low, high = ranges.get(tensor.op.name, (0., 0.))
+                    ranges[tensor.op.name] = (min(low, float(value.min())), max(high, float(value.max())))
+    inputs = np.concatenate(images)
+    return (float(inputs.min()), float(inputs.max())), ranges
+
+
+def _const_node(name, value):
+    node = tf.NodeDef()
+    node.name = name
+    node.op = 'Const'
+    node.attr['dtype'].type = tf.float32.as_datatype_enum
+    node.attr['value'].tensor.CopyFrom(tensor_util.make_tensor_proto(value, tf.float32))
+    return node
+
+
+def fake_quant_graph_def(graph_def, ranges):
+    """ insert a FakeQuantWithMinMaxVars after each op of ranges, its min/max are the constants of the
+    calibration range, the consumers of the op read the fake quant instead
+
+    :param
+        ranges: dict {op name: (min, max)}, see activation_ranges
+    :return:
+        a new GraphDef
+    """
+    def fake_quant_input(name):
+        op_name, _, port = name.partition(':')
+        return op_name + '/fake_quant' if op_name in ranges and port in ('', '0') else name
+
+    output = tf.GraphDef()
+    output.versions.CopyFrom(graph_def.versions)
+    for node in graph_def.node:
+        new = output.node.add()
+        new.CopyFrom(node)
+        del new.input[:]
+        new.input.extend(fake_quant_input(name) for name in node.input)
+
+    for name in sorted(ranges):
+        low, high = ranges[name]
+        output.node.extend([_const_node(name + '/fake_quant/min', low),
+                            _const_node(name + '/fake_quant/max', max(high, low + 1e-6))])
+        node = output.node.add()
+        node.name = name + '/fake_quant'
+        node.op = 'FakeQuantWithMinMaxVars'
+        node.input.extend([name, name + '/fake_quant/min', name + '/fake_quant/max'])
+        node.attr['num_bits'].i = 8
+        node.attr['narrow_range'].b = False
+    return output
+
+
+def _converter(graph_def):
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        image = graph.get_tensor_by_name(INPUT_NAME + ':0')
+        predict = graph.get_tensor_by_name(OUTPUT_TENSOR + ':0')
+        converter_cls = getattr(lite, 'TFLiteConverter', None) or lite.TocoConverter
+        return converter_cls(graph_def, [image], [predict])
+
+
+def convert(graph_def, out_path, calibration, mode='full'):
+    """ convert the inference graph to the tflite model
+
+    :param
+        calibration: list of the calibration image batches
+        mode: 'weights' or 'full', see the module Note
+    """
+    converter = _converter(graph_def)
+
+    if mode == 'weights':
+        converter.post_training_quantize = True
+    elif hasattr(converter, 'representative_dataset'):
+        converter.optimizations = [lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([batch.astype(np.float32)] for batch in calibration)
+    else:
+        (in_min, in_max), ranges = activation_ranges(graph_def, calibration)
+        converter = _converter(fake_quant_graph_def(graph_def, ranges))
+        std = 255. / (in_max - in_min)
+        converter.inference_type = lite.constants.QUANTIZED_UINT8
+        converter.inference_input_type = lite.constants.QUANTIZED_UINT8
+        converter.quantized_input_stats = {INPUT_NAME: (-in_min * std, std)}
+        logging.info("input range [{:.2f}, {:.2f}], {} calibrated activations".format(
+            in_min, in_max, len(ranges)))
+
+    with open(out_path, 'wb') as f:
+        f.write(converter.convert())
+    return out_path
+
+
+class FloatModel(object):
+    """ the float inference graph, predict(batch) --> softmax (batch*h*w, class_num)
+    """
+
+    def __init__(self, graph_def):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.sess = tf.Session(graph=self.graph)
+        self.image = self.graph.get_tensor_by_name(INPUT_NAME + ':0')
+        self.predict_op = self.graph.get_tensor_by_name(OUTPUT_TENSOR + ':0')
+
+    def predict(self, batch):
+        return self.sess.run(self.predict_op, {self.image: batch})
+
+
+class TFLiteModel(object):
+    """ the tflite model, same interface as FloatModel. a uint8 input is quantized from the float batch
+    """
+
+    def __init__(self, model_path):
+        self.interpreter = lite.Interpreter(model_path=model_path)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+
+    def predict(self, batch):
+        if self.input['dtype'] == np.uint8:
+            scale, zero_point = self.input['quantization']
+            batch = np.clip(np.round(batch / scale + zero_point), 0, 255)
+        self.interpreter.set_tensor(self.input['index'], batch.astype(self.input['dtype']))
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output['index'])
+        if self.output['dtype'] == np.uint8:
+            scale, zero_point = self.output['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+def mean_iou(model, batches, class_num=num_classes):
+    """
+    :return:
+        mIoU over the classes present in the labels or the predictions, and the ms per batch
+    """
+    confusion = np.zeros((class_num, class_num), dtype=np.int64)
+    elapsed = 0.
+    for images, masks in batches:
+        start = time.time()
+        predict = model.predict(images)
+        elapsed += time.time() - start
+        pred = predict.reshape(-1, class_num).argmax(axis=1)
+        confusion += np.bincount(masks.ravel().astype(np.int64) * class_num + pred,
+                                 minlength=class_num ** 2).reshape(class_num, class_num)
+    union = confusion.sum(axis=0) + confusion.sum(axis=1) - np.diag(confusion)
+    present = union > 0
+    return float(np.mean(np.diag(confusion)[present] / union[present].astype(np.float64))), \
+        elapsed * 1000 / max(len(batches), 1)
+
+
+def quantize_report(pb_path, calib_records, eval_records, out_path, mode='full', calib_batches=10,
+                    eval_batches=20, batch_size=BS):
+    """ quantize the frozen model, and compare the int8 model with the float model
+
+    :return:
+        list of dict, the float row, the int8 row and the delta row
+    """
+    graph_def = placeholder_graph_def(pb_path, batch_size)
+    # the raw pixels for a model with the input normalization folded in (optimize_model.py)
+    normalize = not takes_raw_pixels(graph_def)
+    calibration = [images for images, _ in record_batches(calib_records, calib_batches, batch_size,
+                                                          normalize=normalize)]
+    convert(graph_def, out_path, calibration, mode)
+
+    evaluation = record_batches(eval_records, eval_batches, batch_size, normalize=normalize)
+    rows = []
+    for variant, model, size in (('float', FloatModel(graph_def), os.path.getsize(pb_path)),
+                                 ('int8/' + mode, TFLiteModel(out_path), os.path.getsize(out_path))):
+        miou, latency = mean_iou(model, evaluation)
+        rows.append({'variant': variant, 'size_mb': size / 1024.0 ** 2, 'ms_per_batch': latency, 'miou': miou})
+    rows.append({'variant': 'delta', 'size_mb': rows[1]['size_mb'] - rows[0]['size_mb'],
+                 'ms_per_batch': rows[1]['ms_per_batch'] - rows[0]['ms_per_batch'],
+                 'miou': rows[1]['miou'] - rows[0]['miou']})
+    for row in rows:
+        logging.info("{}".format(row))
+    return rows
+
+
+def main(_):
+    from benchmark_input import print_rows
+
+    out_path = FLAGS.out or os.path.splitext(FLAGS.model)[0] + '.tflite'
+    rows = quantize_report(FLAGS.model, FLAGS.calib_records, FLAGS.eval_records or FLAGS.calib_records, out_path,
+                           FLAGS.mode, FLAGS.calib_batches, FLAGS.eval_batches, FLAGS.batch_size)
+    print_rows(rows)
+
+    if FLAGS.report:
+        with open(FLAGS.report, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='post-training int8 quantization of the frozen model')
+
+    parser.add_argument('--model', '-m', help='the frozen model.pb of train_main', default='./final_model/model.pb')
+    parser.add_argument('--out', '-o', help='the tflite model path, default: model.tflite next to the model',
+                        default=None)
+    parser.add_argument('--calib_records', '-r', help='the tfrecords of the calibration set', required=True)
+    parser.add_argument('--eval_records', '-e', help='the tfrecords of the mIoU evaluation, default calib_records',
+                        default=None)
+    parser.add_argument('--mode', help='weights: int8 weights; full: int8 weights and activations',
+                        default='full', choices=('weights', 'full'))
+    parser.add_argument('--calib_batches', help='inter, the number of calibration batches', default=10, type=int)
+    parser.add_argument('--eval_batches', help='inter, the number of evaluation batches', default=20, type=int)
+    parser.add_argument('--batch_size', '-b', help='inter, the batch size of the frozen model', default=BS, type=int)
+    parser.add_argument('--report', help='path of the json report', default=None)
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
@@ -0,0 +1,212 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the offset index of the tfrecord files: record name --> (file, byte offset, length),
+for the random access of one sample by name, and the exact per-epoch shuffling.
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    the tfrecord format of one record is:
+        uint64 length, uint32 masked_crc32_of_length, byte data[length], uint32 masked_crc32_of_data
+    so the serialized example of a record at offset is data[offset + 12: offset + 12 + length].
+    only the not compressed files can be indexed (the offset in a gzip/zlib stream is meaningless).
+
+    the index file (./data/train.index.json):
+        {"version": 1, "files": [shard paths], "records": {name: [file id, offset, length]}}
+    it is written by dataset_gen.create_tfrecord (from the manifest, no extra read),
+    or by this module for existing record files (one scan of the length headers, and parse of the names):
+    $ python record_index.py -r "./data/train-*.tfrecords" -o ./data/train.index.json
+
+    lookup, eg:
+    $ python record_index.py -i ./data/train.index.json --name 2007_000032
+
+    RecordIndex.epoch_order gives a true permutation of all the records for each epoch,
+    only the list of names is in memory, not a shuffle buffer of decoded images.
+"""
+# ===================================================================================== #
+
+
+import os
+import re
+import json
+import glob
+import struct
+import argparse
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+
+INDEX_VERSION = 1
+
+HEADER_BYTES = 12   # uint64 length + uint32 crc
+FOOTER_BYTES = 4    # uint32 crc
+
+
+def base_path(record_path_):
+    """ the record path of a shard, ./data/train-00001-of-00004.tfrecords --> ./data/train.tfrecords
+    """
+    return re.sub(r'-\d{5}-of-\d{5}(\.\w+)$', r'\1', record_path_)
+
+
+def index_path(record_path_):
+    """ ./data/train.tfrecords --> ./data/train.index.json
+    """
+    return os.path.splitext(record_path_)[0] + '.index.json'
+
+
+def scan_file(path):
+    """ scan the record headers of one file, no crc check
+
+    :return:
+        a generator of (offset, length, serialized example)
+    """
+    with open(path, 'rb') as f:
+        offset = 0
+        while True:
+            header = f.read(HEADER_BYTES)
+            if len(header) < HEADER_BYTES:
+                break
+            length = struct.unpack('<Q', header[:8])[0]
+            data = f.read(length)
+            if len(data) < length:
+                raise IOError("{}: truncated record at offset {}".format(path, offset))
+            f.seek(FOOTER_BYTES, os.SEEK_CUR)
+            yield offset, length, data
+            offset += HEADER_BYTES + length + FOOTER_BYTES
+
+
+def record_name(serialized):
+    example = tf.train.Example.FromString(serialized)
+    return tf.compat.as_text(example.features.feature['name'].bytes_list.value[0])
+
+
+def build_index(files):
+    """ index the existing record files
+
+    :return:
+        dict, the index
+    """
+    records = {}
+    for file_id, path in enumerate(files):
+        for offset, length, data in scan_file(path):
+            records[record_name(data)] = [file_id, offset, length]
+    return {'version': INDEX_VERSION, 'files': list(files), 'records': records}
+
+
+def index_from_manifest(files, samples):
+    """ the index from the manifest entries of dataset_gen (dataset_manifest), no read of the record files
+    """
+    records = {}
+    for entry in samples.values():
+        for name, offset, length in entry['records']:
+            if offset is None:
+                raise ValueError("the compressed record files can not be indexed")
+            records[name] = [entry['shard'], offset, length]
+    return {'version': INDEX_VERSION, 'files': list(files), 'records': records}
+
+
+def save_index(path, index):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.rename(tmp, path)
+
+
+class RecordIndex(object):
+    """ random access to the records by name
+    """
+
+    def __init__(self, path):
+        with open(path) as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            raise ValueError("index file {} version {} is not supported".format(path, index.get('version')))
+        self.files = index['files']
+        self.records = index['records']
+        self.names = sorted(self.records)
+        self._handles = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.records
+
+    def get(self, name):
+        """ O(1) lookup, one seek and one read
+
+        :return:
+            the serialized example (string) of the record
+        """
+        file_id, offset, length = self.records[name]
+        with self._lock:
+            f = self._handles.get(file_id)
+            if f is None:
+                f = self._handles[file_id] = open(self.files[file_id], 'rb')
+            f.seek(offset + HEADER_BYTES)
+            data = f.read(length)
+        if len(data) != length:
+            raise IOError("{}: record {} is truncated".format(self.files[file_id], name))
+        return data
+
+    def example(self, name):
+        """
+        :return:
+            the tf.train.Example of the record
+        """
+        return tf.train.Example.FromString(self.get(name))
+
+    def epoch_order(self, epoch, seed=0):
+        """ the permutation of all the record names for the epoch, reproducible by (seed, epoch)
+        """
+        rng = np.random.RandomState((seed * 1000003 + epoch) % (2 ** 32))
+        return [self.names[i] for i in rng.permutation(len(self.names))]
+
+    def iter_epochs(self, num_epochs=None, seed=0, shuffle=True):
+        """ generator of the serialized examples, epoch after epoch
+
+        :param
+            num_epochs: inter, or None (forever)
+        """
+        epoch = 0
+        while num_epochs is None or epoch < num_epochs:
+            for name in (self.epoch_order(epoch, seed) if shuffle else self.names):
+                yield self.get(name)
+            epoch += 1
+
+    def close(self):
+        for f in self._handles.values():
+            f.close()
+        self._handles = {}
+
+
+def main(_):
+    if FLAGS.record:
+        files = sorted(glob.glob(FLAGS.record)) if any(c in FLAGS.record for c in '*?[') else [FLAGS.record]
+        index = build_index(files)
+        FLAGS.index = FLAGS.index or index_path(base_path(files[0]))
+        save_index(FLAGS.index, index)
+        print('{}: {} records of {} files'.format(FLAGS.index, len(index['records']), len(files)))
+
+    if FLAGS.name:
+        record_index = RecordIndex(FLAGS.index)
+        feature = record_index.example(FLAGS.name).features.feature
+        print('{}: {}'.format(FLAGS.name, dict((k, len(v.bytes_list.value[0]) if v.bytes_list.value else
+                                                   list(v.int64_list.value)) for k, v in feature.items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='build the offset index of tfrecord files, or lookup a record')
+
+    parser.add_argument('--record', '-r', help='the tfrecords file, or a glob pattern of the shards', default=None)
+    parser.add_argument('--index', '-i', help='path of the index file', default=None)
+    parser.add_argument('--name', help='lookup the record with this name', default=None)
+
+    FLAGS, _ = parser.parse_known_args()
+
+    tf.app.run()
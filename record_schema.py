@@ -0,0 +1,89 @@
+# ===================================================================================== #
+# coding:utf-8
+"""module, the tfrecord schema shared by dataset_gen (writer) and get_batch (reader).
+
+2026/10/18
+tensorflow ==1.11
+python ==2.7.15
+
+Note:
+    each record has a 'schema_version' int64 feature, which tells how the mask is stored:
+        version 1 (ONE_HOT): mask is (h, w, num_classes) one-hot uint8, the records written before
+                  the schema field existed have no 'schema_version', and are read as version 1.
+        version 2 (CLASS_ID): mask is (h, w) uint8 class id, num_classes times smaller.
+                  the one-hot expansion is done in the input graph (get_batch).
+
+    features:
+        'name': bytes, the file name without extension
+        'image': bytes, (h, w, 3) uint8 RGB
+        'mask': bytes, see above
+        'schema_version': int64
+        'image_format': bytes, 'raw' (image.tobytes, default), 'png' or 'jpeg' (encoded file bytes)
+        'mask_format': bytes, 'raw' (mask.tobytes, default) or 'png' (single channel class id png)
+        'scene', 'offset_y', 'offset_x': only for the tiles (dataset_gen --tile), bytes, int64, int64
+
+    the record file itself can be GZIP/ZLIB compressed, the compression is not stored in the
+    records, so the reader must be given the same compression as the writer (see record_options,
+    compression_type for tf.data).
+"""
+# ===================================================================================== #
+
+
+import tensorflow as tf
+
+
+ONE_HOT = 1
+CLASS_ID = 2
+
+SCHEMA_VERSION = CLASS_ID
+
+IMAGE_FORMATS = ('raw', 'png', 'jpeg')
+COMPRESSIONS = ('none', 'gzip', 'zlib')
+
+
+def feature_dict():
+    """ the feature dict for tf.parse_single_example / tf.parse_example
+    """
+    return {
+        'name': tf.FixedLenFeature([], tf.string),
+        'image': tf.FixedLenFeature([], tf.string),
+        'mask': tf.FixedLenFeature([], tf.string),
+        'schema_version': tf.FixedLenFeature([], tf.int64, default_value=ONE_HOT),
+        'image_format': tf.FixedLenFeature([], tf.string, default_value='raw'),
+        'mask_format': tf.FixedLenFeature([], tf.string, default_value='raw'),
+        'scene': tf.FixedLenFeature([], tf.string, default_value=''),
+        'offset_y': tf.FixedLenFeature([], tf.int64, default_value=0),
+        'offset_x': tf.FixedLenFeature([], tf.int64, default_value=0)}
+
+
+def record_options(compression='none'):
+    """ the tf.python_io.TFRecordOptions for the writer and the reader
+
+    :param
+        compression: string, 'none', 'gzip' or 'zlib'
+    :return:
+        TFRecordOptions, or None for no compression
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("compression must be one of {}, got {}".format(COMPRESSIONS, compression))
+    if compression == 'none':
+        return None
+    compression_type = {'gzip': tf.python_io.TFRecordCompressionType.GZIP,
+                        'zlib': tf.python_io.TFRecordCompressionType.ZLIB}[compression]
+    return tf.python_io.TFRecordOptions(compression_type)
+
+
+def compression_type(compression='none'):
+    """ the compression_type string of tf.data.TFRecordDataset: '', 'GZIP' or 'ZLIB'
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError("compression must be one of {}, got {}".format(COMPRESSIONS, compression))
+    return '' if compression == 'none' else compression.upper()
+
+
+def bytes_feature(value):
+    return tf.train.Feature(bytes_list=tf.train.BytesList(value=[tf.compat.as_bytes(value)]))
+
+
+def int64_feature(value):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[int(value)]))
@@ -62,8 +62,10 @@ Note: the main step as follow
 
 import tensorflow as tf
 from config import *
-from unet import unet
+from unet import unet, resolve_data_format
 from get_batch import batch_input
+from export_model import export_model
+import dataset_stats
 import argparse
 from tensorflow.python.framework import graph_util
 from tensorflow.python import debug as tf_debug
@@ -72,7 +74,7 @@ import numpy as np
 import cv2
 
 
-def total_loss(net_output, label):
+def total_loss(net_output, label, class_weights=None):
     """ loss calculate,
     the  shape of the inout label and logist(the network output) must be same.
     Note:
@@ -81,13 +83,14 @@ def total_loss(net_output, label):
         it does not have the last dimension of `labels`.
 
         in some case, we can also add class_weights to particular class,
-         if class distribution is not fair
+         if class distribution is not fair (class_weights, from the dataset stats file)
 
          in l2_loss*0.001, the 0.001 is the weight_decay_factor on L2 regularization
 
     :arg
         net_output: a tensor, output after the src image pass through the network
         label: a tensor, shape is same as net_output (x, 3) 3 means RGB channel
+        class_weights: None, or a list with num_classes float, the weight of the pixels of each class
     :return
         a scalar,
 
@@ -95,6 +98,9 @@ def total_loss(net_output, label):
     with tf.name_scope("loss"):
         with tf.name_scope("softmax_cross_entropy"):
             cross_entropy = tf.nn.softmax_cross_entropy_with_logits(labels=label, logits=net_output)
+            if class_weights is not None:
+                pixel_weights = tf.reduce_sum(tf.cast(label, tf.float32) * class_weights, axis=1)
+                cross_entropy = cross_entropy * pixel_weights
             segment_loss = tf.reduce_mean(cross_entropy)
             # loss_summary = tf.summary.scalar("{}_acc".format(phase), segment_loss)
 
@@ -160,7 +166,8 @@ def debug_main(_):
 
         with tf.variable_scope("source_input"):
 
-            name_batch, image_batch, label_batch = batch_input(tfrecord_path_train)
+            name_batch, image_batch, label_batch = batch_input(tfrecord_path_train, augment=FLAGS.augment,
+                                                               synthetic=FLAGS.synthetic)
 
             with tf.variable_scope("image_batch"):
                 image_tensor_batch = tf.identity(image_batch, name='image_tensor')
@@ -168,7 +175,7 @@ def debug_main(_):
             with tf.name_scope("label_batch"):
                 label_batch_ = tf.reshape(label_batch, (BS*image_size*image_size, num_classes))
 
-        model_train = unet(image_tensor_batch)
+        model_train = unet(image_tensor_batch, data_format=resolve_data_format(data_format))
 
         with tf.variable_scope("predict"):
             predict = tf.nn.softmax(model_train['output'], name="predict")
@@ -184,7 +191,9 @@ def debug_main(_):
         with tf.name_scope('optimizer'):
             optimizer = tf.train.GradientDescentOptimizer(lr)
             # optimizer = tf.train.AdamOptimizer(lr)
-            train_op = optimizer.minimize(loss_train)
+            # the moving statistics of the batch norms, used by the exported model
+            with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+                train_op = optimizer.minimize(loss_train)
 
         merged = tf.summary.merge([loss_summary, acc_summary])
         logging.info('variable initialization ...')
@@ -289,6 +298,10 @@ def main(_):
     :return:
     """
 
+    if class_weighting and not stats_path:
+        raise ValueError("config.class_weighting needs the dataset stats file (config.stats_path) "
+                         "of dataset_gen, got stats_path={}".format(stats_path))
+
     with tf.Session() as sess:
 
         if FLAGS.debug:
@@ -298,7 +311,8 @@ def main(_):
 
         with tf.variable_scope("source_input"):
 
-            name_batch, image_batch, label_batch = batch_input(tfrecord_path_train)
+            name_batch, image_batch, label_batch = batch_input(tfrecord_path_train, augment=FLAGS.augment,
+                                                               synthetic=FLAGS.synthetic)
 
             with tf.variable_scope("image_batch"):
                 image_tensor_batch = tf.identity(image_batch, name='image_tensor')
@@ -306,13 +320,18 @@ def main(_):
             with tf.name_scope("label_batch"):
                 label_batch_ = tf.reshape(label_batch, (BS*image_size*image_size, num_classes))
 
-        model_train = unet(image_tensor_batch)
+        model_train = unet(image_tensor_batch, data_format=resolve_data_format(data_format))
 
         with tf.variable_scope("predict"):
             predict_softmax = tf.nn.softmax(model_train['output'], name="predict")
 
+        class_weights = None
+        if class_weighting:
+            class_weights = dataset_stats.load_stats(stats_path)['class_weights']
+            logging.info("class weights: {}".format(class_weights))
+
         with tf.name_scope("loss"):
-            loss_train = total_loss(model_train['output'], label_batch_)
+            loss_train = total_loss(model_train['output'], label_batch_, class_weights)
             loss_summary = tf.summary.scalar("train_loss", loss_train)
 
         with tf.name_scope("acc"):
@@ -322,7 +341,9 @@ def main(_):
         with tf.name_scope('optimizer'):
             optimizer = tf.train.GradientDescentOptimizer(lr)
             # optimizer = tf.train.AdamOptimizer(lr)
-            train_op = optimizer.minimize(loss_train)
+            # the moving statistics of the batch norms, used by the exported model
+            with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+                train_op = optimizer.minimize(loss_train)
 
         merged = tf.summary.merge([loss_summary, acc_summary])
         logging.info('variable initialization ...')
@@ -337,11 +358,6 @@ def main(_):
         logging.info("saving sess.graph ...")
         writer_train = tf.summary.FileWriter(path_checker(summary_path + "train"), sess.graph)
 
-        # using for deploy # has a indicate sess.run ?
-        constant_graph = graph_util.convert_variables_to_constants(sess, sess.graph_def,
-                                                                   ["predict/predict",
-                                                                    "source_input/image_batch/image_tensor"])
-
         try:
             while not coord.should_stop():
                 logging.info('sess run for image pass through the network, please waite...')
@@ -375,8 +391,8 @@ def main(_):
         finally:
 
             logging.info('store the model to pd frozen file...')
-            with tf.gfile.FastGFile(FLAGS.model_save_path + 'model.pb', mode='wb') as f:  # save the final model
-                f.write(constant_graph.SerializeToString())
+            # the trained variables frozen in a new graph with a dynamic input (any batch / image size)
+            export_model(sess, FLAGS.model_save_path + 'model.pb')
 
             logging.info("train completed!")
             writer_train.close()
@@ -393,11 +409,18 @@ if __name__ == "__main__":
                         required=True, default='./final_model/')
     parser.add_argument('--debug',
                         help="debug model", default=False)
+    parser.add_argument('--augment', action='store_true',
+                        help="on-the-fly augmentation of the train input (default config.augmentation)",
+                        default=augmentation)
+    parser.add_argument('--synthetic', action='store_true',
+                        help="train on random input batches, no dataset (default config.synthetic_input)",
+                        default=synthetic_input)
     FLAGS, _ = parser.parse_known_args()
 
     logging.info('****FLAGES****\n--model_save_path:{}'
-                 '\n--debug{}\n****FLAGES****'.format(FLAGS.model_save_path,
-                                                         FLAGS.debug))
+                 '\n--debug{}\n--augment{}\n--synthetic{}\n****FLAGES****'.format(FLAGS.model_save_path,
+                                                                                   FLAGS.debug, FLAGS.augment,
+                                                                                   FLAGS.synthetic))
 
     tf.app.run()
     # debug_main()
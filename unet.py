@@ -24,17 +24,51 @@ Note:
 
 
     !!! the op tf.nn.conv2d_transpose consume the significant computation.
-    so
+    so the upsampling of unet is selectable (config.upsample_mode, see upsample), as well as the depth,
+    the base filter number and the skip connection (config.unet_depth, filters, skip_mode),
+    and the type of the conv blocks (config.conv_type: standard, depthwise-separable, inverted residual).
+    the cost of each variant: $ python benchmark_model.py --mode variants
+    the training memory is reduced by the gradient checkpointing (config.recompute, see recompute_segment),
+    peak memory vs step time: $ python benchmark_model.py --mode recompute
+    all the layer helpers take data_format ('NHWC' or 'NCHW', the layout of their input and output);
+    unet(data_format=) runs the whole network in one layout (config.data_format); 'auto' is resolved once by
+    the entry points (train_main, export_model, benchmark_model, resolve_data_format), from the layout report.
 """
 # ===================================================================================== #
 
 
+import os
+import json
+
 import tensorflow as tf
 from tensorflow.contrib.layers.python.layers import layers as tf_ctb_layers
 from config import *
 import numpy as np
 
 
+def _channel_axis(data_format):
+    """ the channel axis of a 4-d tensor: 3 for NHWC, 1 for NCHW
+    """
+    return 1 if data_format == 'NCHW' else 3
+
+
+def _layout(n, h, w, d, data_format):
+    """ the 4 dims (batch, height, width, channel) in the order of data_format
+    """
+    return [n, d, h, w] if data_format == 'NCHW' else [n, h, w, d]
+
+
+def _dims(input_, data_format):
+    """ the static (batch, height, width, channel) of a 4-d tensor in data_format, None if unknown
+    """
+    shape = input_.shape.as_list()
+    return (shape[0], shape[2], shape[3], shape[1]) if data_format == 'NCHW' else tuple(shape)
+
+
+def _norm(input_, data_format):
+    return tf_ctb_layers.batch_norm(input_, scale=True, data_format=data_format)
+
+
 def dense(input_, neural, name):
     """full connect layer
     """
@@ -44,14 +78,14 @@ def dense(input_, neural, name):
     return dense
 
 
-def conv_relu(input_, ksize, filter_num, name, activation=True):
+def conv_relu(input_, ksize, filter_num, name, activation=True, data_format='NHWC'):
     """ convolutional layer, with specific activation func and  batch_normal
     """
 
     with tf.variable_scope(name):
+        _, h, w, d = _dims(input_, data_format)  # _ is the batch size
         if activation is True:
-            _, h, w, d = input_.shape  # _ is the batch size
-            filter_shape = (ksize, ksize, input_.get_shape()[-1].value, filter_num)
+            filter_shape = (ksize, ksize, d, filter_num)
 
             # filter_ = tf.Variable(np.zeros(filter_shape, dtype=np.float32))
             filter_ = tf.get_variable('weights', filter_shape, tf.float32)
@@ -59,37 +93,98 @@ def conv_relu(input_, ksize, filter_num, name, activation=True):
             # bias = tf.Variable(np.zeros(filter_num, dtype=np.float32))
             bias = tf.get_variable('bias', filter_num, dtype=tf.float32)
 
-            conv = tf.nn.conv2d(input_, filter_, strides=[1, 1, 1, 1], padding="SAME")
-            conv = tf.nn.bias_add(conv, bias)
+            conv = tf.nn.conv2d(input_, filter_, strides=[1, 1, 1, 1], padding="SAME", data_format=data_format)
+            conv = tf.nn.bias_add(conv, bias, data_format=data_format)
             if batch_normalization:
-                btn = tf_ctb_layers.batch_norm(conv, scale=True)
+                btn = _norm(conv, data_format)
                 output = tf.nn.relu(btn)
             else:
                 output = tf.nn.relu(conv)
 
         else:
-            filter_shape = [ksize, ksize, input_.get_shape()[-1].value, filter_num]
+            filter_shape = [ksize, ksize, d, filter_num]
 
             filter_ = tf.get_variable("weights", filter_shape, tf.float32)
             # filter_ = tf.Variable(np.zeros(filter_shape, dtype=np.float32))
 
             output = tf.nn.conv2d(input_, filter_,
                                   strides=[1, 1, 1, 1],
-                                  padding="SAME")
+                                  padding="SAME", data_format=data_format)
     logging.info("layer {0}, filter{1}, output{2}".format(name, filter_shape, output.shape))
     return output
 
 
-def pool(input_, ksize, type_, name):
+def separable_conv_relu(input_, ksize, filter_num, name, data_format='NHWC'):
+    """ depthwise-separable convolutional layer: ksize x ksize depthwise conv + 1x1 pointwise conv,
+    with bias, batch_normal (config) and relu, same interface as conv_relu
+
+    Note:
+        the cost is (ksize^2 * d + d * filter_num) instead of ksize^2 * d * filter_num multiply-adds per pixel
+    """
+    with tf.variable_scope(name):
+        d = input_.get_shape()[_channel_axis(data_format)].value
+        depthwise = tf.get_variable('depthwise_weights', (ksize, ksize, d, 1), tf.float32)
+        pointwise = tf.get_variable('weights', (1, 1, d, filter_num), tf.float32)
+        bias = tf.get_variable('bias', filter_num, dtype=tf.float32)
+
+        conv = tf.nn.separable_conv2d(input_, depthwise, pointwise, strides=[1, 1, 1, 1], padding="SAME",
+                                      data_format=data_format)
+        conv = tf.nn.bias_add(conv, bias, data_format=data_format)
+        if batch_normalization:
+            conv = _norm(conv, data_format)
+        output = tf.nn.relu(conv)
+
+    logging.info("layer {0}, separable filter{1}, output{2}".format(name, (ksize, ksize, d, filter_num),
+                                                                    output.shape))
+    return output
+
+
+def inverted_residual(input_, ksize, filter_num, name, expansion=6, data_format='NHWC'):
+    """ inverted residual block (mobilenet v2): 1x1 expansion conv + relu6, ksize x ksize depthwise conv + relu6,
+    1x1 linear projection conv; the input is added if it has filter_num channels. same interface as conv_relu
+    """
+    with tf.variable_scope(name):
+        d = input_.get_shape()[_channel_axis(data_format)].value
+        expand = tf.get_variable('expand_weights', (1, 1, d, d * expansion), tf.float32)
+        depthwise = tf.get_variable('depthwise_weights', (ksize, ksize, d * expansion, 1), tf.float32)
+        project = tf.get_variable('weights', (1, 1, d * expansion, filter_num), tf.float32)
+        bias = tf.get_variable('bias', filter_num, dtype=tf.float32)
+
+        net_ = tf.nn.relu6(tf.nn.conv2d(input_, expand, [1, 1, 1, 1], "SAME", data_format=data_format))
+        net_ = tf.nn.relu6(tf.nn.depthwise_conv2d(net_, depthwise, [1, 1, 1, 1], "SAME", data_format=data_format))
+        net_ = tf.nn.bias_add(tf.nn.conv2d(net_, project, [1, 1, 1, 1], "SAME", data_format=data_format), bias,
+                              data_format=data_format)
+        if batch_normalization:
+            net_ = _norm(net_, data_format)
+        output = net_ + input_ if d == filter_num else net_
+
+    logging.info("layer {0}, inverted residual x{1}, output{2}".format(name, expansion, output.shape))
+    return output
+
+
+def conv_block(input_, ksize, filter_num, name, type_='standard', data_format='NHWC'):
+    """ the 3x3 conv layer of the unet blocks, by type_: 'standard' (conv_relu), 'separable'
+    (separable_conv_relu) or 'inverted_residual'
+    """
+    if type_ == 'standard':
+        return conv_relu(input_, ksize, filter_num, name, data_format=data_format)
+    if type_ == 'separable':
+        return separable_conv_relu(input_, ksize, filter_num, name, data_format=data_format)
+    if type_ == 'inverted_residual':
+        return inverted_residual(input_, ksize, filter_num, name, data_format=data_format)
+    raise ValueError("conv type must be 'standard', 'separable' or 'inverted_residual', got {}".format(type_))
+
+
+def pool(input_, ksize, type_, name, data_format='NHWC'):
     """ pooling layer
     """
 
     with tf.name_scope(name):
-
+        window = _layout(1, ksize, ksize, 1, data_format)
         if type_ == "max":
-            pooling = tf.nn.max_pool(input_, [1, ksize, ksize, 1], strides=[1, ksize, ksize, 1], padding='SAME')
+            pooling = tf.nn.max_pool(input_, window, strides=window, padding='SAME', data_format=data_format)
         else:
-            pooling = tf.nn.avg_pool(input_, [1, ksize, ksize, 1], strides=[1, ksize, ksize, 1], padding='SAME')
+            pooling = tf.nn.avg_pool(input_, window, strides=window, padding='SAME', data_format=data_format)
 
     logging.info("layer {0}, {1}, {2}".format(name, pooling.shape, type_))
     return pooling
@@ -105,7 +200,13 @@ def dropout(input_, keep_prob_, name):
     return dropout_
 
 
-def deconv(input_, filter_num, factor, name):
+def _scale_dim(dim, factor):
+    """ a static dimension times factor, None (unknown) stays None
+    """
+    return None if dim is None else dim * factor
+
+
+def deconv(input_, filter_num, factor, name, data_format='NHWC'):
     """ de-convolutional layer, tf.nn.using conv2d_transpose()
 
     Note:
@@ -114,7 +215,7 @@ def deconv(input_, filter_num, factor, name):
 
     with tf.variable_scope(name):
 
-        batch_size_, h, w, d = input_.shape
+        batch_size_, h, w, d = _dims(input_, data_format)
 
         # filter_shape = (h, w, d, filter_num)
         # filter_shape = (h, w, filter_num, d)
@@ -125,15 +226,23 @@ def deconv(input_, filter_num, factor, name):
         # bias_ = tf.Variable(np.zeros(filter_num, dtype=np.float32))
         bias_ = tf.get_variable('bias', filter_num)
 
-        # output_shape_ = tf.stack([batch_size_, h * factor, w * factor, d])
-        output_shape_ = tf.TensorShape([batch_size_, h * factor, w * factor, d])
+        # the output shape from the runtime shape of the input, the batch size and the image size of
+        # the exported model are free; the static shape is set back for the fixed size training graph
+        input_shape_ = tf.unstack(tf.shape(input_))
+        if data_format == 'NCHW':
+            input_shape_ = [input_shape_[0], input_shape_[2], input_shape_[3], input_shape_[1]]
+        output_shape_ = tf.stack(_layout(input_shape_[0], input_shape_[1] * factor, input_shape_[2] * factor,
+                                         filter_num, data_format))
 
         deconv_ = tf.nn.conv2d_transpose(input_, filter_, output_shape=output_shape_,
-                                         strides=[1, factor, factor, 1], padding="SAME")
-        deconv_ = tf.nn.bias_add(deconv_, bias_)
+                                         strides=_layout(1, factor, factor, 1, data_format), padding="SAME",
+                                         data_format=data_format)
+        deconv_.set_shape(_layout(batch_size_, _scale_dim(h, factor), _scale_dim(w, factor), filter_num,
+                                  data_format))
+        deconv_ = tf.nn.bias_add(deconv_, bias_, data_format=data_format)
 
         if batch_normalization:
-            btn = tf_ctb_layers.batch_norm(deconv_, scale=True)
+            btn = _norm(deconv_, data_format)
             output = tf.nn.relu(btn)
         else:
             output = tf.nn.relu(deconv_)
@@ -151,13 +260,23 @@ def concat(input_a, input_b, name_, axis_=3):
     return concat_
 
 
-def upsampling_2d(input_, factor, name):
+def upsampling_2d(input_, factor, name, data_format='NHWC'):
+    """ nearest neighbor resize, tf.image works on NHWC: a NCHW input is transposed to it and back
+    """
     with tf.name_scope(name):
-        _, h, w, d = input_.shape
+        if data_format == 'NCHW':
+            input_ = tf.transpose(input_, [0, 2, 3, 1])
+        _, h, w, d = input_.shape.as_list()
         # up = tf.image.resize_images()
         # up = cv2.resize(np.array(input_), (_, h*2, w*2, d), interpolation=cv2.INTER_LINEAR)
         # up = tf.stack([batch_size_, h * factor, w * factor, d])
-        upsampling = tf.image.resize_images(input_, (h*2, w*2), method=1)
+        if h is None or w is None:
+            size = tf.shape(input_)[1:3] * factor
+        else:
+            size = (h*factor, w*factor)
+        upsampling = tf.image.resize_images(input_, size, method=1)
+        if data_format == 'NCHW':
+            upsampling = tf.transpose(upsampling, [0, 3, 1, 2])
 
         logging.info("layer {0}, {1}".format(name, upsampling.shape))
         return upsampling
@@ -201,7 +320,7 @@ def bilinear_upsample_weights(factor, num_outputs):
     return weights
 
 
-def deconv_upsample(inputs, factor, name, padding = 'SAME', activation_fn = None):
+def deconv_upsample(inputs, factor, name, padding = 'SAME', activation_fn = None, data_format = 'NHWC'):
     """
     Convolution Transpose upsampling layer with bilinear interpolation weights:
     ISSUE: problems with odd scaling factors
@@ -213,18 +332,24 @@ def deconv_upsample(inputs, factor, name, padding = 'SAME', activation_fn = None
         padding: String, input padding
         activation_fn: Tensor fn, activation function on output (can be None)
 
+        data_format: String, 'NHWC' or 'NCHW' (the layout of inputs and outputs)
+
     Returns:
         outputs: Tensor, [batch_size, height * factor, width * factor, num_filters_in]
     """
 
     with tf.variable_scope(name):
-        stride_shape   = [1, factor, factor, 1]
+        stride_shape   = _layout(1, factor, factor, 1, data_format)
         input_shape    = tf.shape(inputs)
-        num_filters_in = inputs.get_shape()[-1].value
-        output_shape   = tf.stack([input_shape[0], input_shape[1] * factor, input_shape[2] * factor, num_filters_in])
+        num_filters_in = inputs.get_shape()[_channel_axis(data_format)].value
+        if data_format == 'NCHW':
+            output_shape = tf.stack([input_shape[0], num_filters_in, input_shape[2] * factor, input_shape[3] * factor])
+        else:
+            output_shape = tf.stack([input_shape[0], input_shape[1] * factor, input_shape[2] * factor, num_filters_in])
 
         weights = bilinear_upsample_weights(factor, num_filters_in)
-        outputs = tf.nn.conv2d_transpose(inputs, weights, output_shape, stride_shape, padding = padding)
+        outputs = tf.nn.conv2d_transpose(inputs, weights, output_shape, stride_shape, padding = padding,
+                                         data_format = data_format)
 
         if activation_fn is not None:
             outputs = activation_fn(outputs)
@@ -232,94 +357,204 @@ def deconv_upsample(inputs, factor, name, padding = 'SAME', activation_fn = None
         return outputs
 
 
-def unet(input_):
+def upsample(input_, filter_num, mode, name, conv_type='standard', data_format='NHWC'):
+    """ x2 upsampling layer of the decoder
 
-    inputs = input_
-    print ("the input shape: {}".format(inputs.shape))
-    net = {}
-
-    # #############conv
-    # block 1
-    net['conv1_1'] = conv_relu(input_=inputs, ksize=3, filter_num=filters, name="conv1_1")
-    net['conv1_2'] = conv_relu(net['conv1_1'], 3, filters, "conv1_2")
-    net['pool1'] = pool(net['conv1_2'], ksize=2, type_='max', name='pool1')
-
-    # block 2
-    net['conv2_1'] = conv_relu(net['pool1'], 3, filters * 2, "conv2_1")
-    net['conv2_2'] = conv_relu(net['conv2_1'], 3, filters * 2, "conv2_2")
-    net['pool2]'] = pool(net['conv2_2'], 2, 'max', 'pool2')
-
-    # block 3
-    net['conv3_1'] = conv_relu(net['pool2]'], 3, filters * 4, "conv3_1")
-    net['conv3_2'] = conv_relu(net['conv3_1'], 3, filters * 4, "conv3_2")
-    net['pool3'] = pool(net['conv3_2'], 2, 'max', 'pool3')
-    net['dropout3'] = dropout(net['pool3'], keep_prob, name='dropout3')
-
-    # block 4
-    net['conv4_1'] = conv_relu(net['dropout3'], 3, filters * 8, "conv4_1")
-    net['conv4_2'] = conv_relu(net['conv4_1'], 3, filters * 8, "conv4_2")
-    net['pool4'] = pool(net['conv4_2'], 2, 'max', 'pool4')
-    net['dropout4'] = dropout(net['pool4'], keep_prob, name='dropout4')
-
-
-    # block 5
-    net['conv5_1'] = conv_relu(net['dropout4'], 3, filters * 16, "conv5_1")
-    net['conv5_2'] = conv_relu(net['conv5_1'], 3, filters * 16, "conv5_2")
-    net['dropout5'] = dropout(net['conv5_2'], keep_prob, name='dropout5')
-
-    # #############deconv
-    # block 6
-    net['upsample6'] = deconv(net['dropout5'], filters * 16, 2, "upsample6")
-    # net['upsample6'] = deconv_upsample(net['dropout5'], 2, 'upsample6')
-    # net['upsample6'] = upsampling_2d(net['dropout5'], 2, "upsample6")
-    net['concat6'] = concat(net['upsample6'], net['conv4_2'], axis_=3, name_='concat6')
-
-    net['conv6_1'] = conv_relu(net['concat6'], 3, filters * 8, "conv6_1")
-    net['conv6_2'] = conv_relu(net['conv6_1'], 3, filters * 8, "conv6_2")
-    net['dropout6'] = dropout(net['conv6_2'], keep_prob, name='dropout6')
-
-    # block 7
-    net['upsample7'] = deconv(net['dropout6'], filters * 8, 2, "upsample7")
-    # net['upsample7'] = deconv_upsample(net['dropout6'], 2, "upsample7")
-    # net['upsample7'] = upsampling_2d(net['dropout6'], 2, "upsample7")
-    net['concat7'] = concat(net['upsample7'], net['conv3_2'], axis_=3, name_='concat7')
-
-    net['conv7_1'] = conv_relu(net['concat7'], 3, filters * 4, "conv7_1")
-    net['conv7_2'] = conv_relu(net['conv7_1'], 3, filters * 4, "conv7_2")
-    net['dropout7'] = dropout(net['conv7_2'], keep_prob, name='dropout7')
-
-    # block 8
-    net['upsample8'] = deconv(net['dropout7'], filters * 4, 2, "upsample8")
-    # net['upsample8'] = deconv_upsample(net['dropout7'], 2, "upsample8")
-    # net['upsample8'] = upsampling_2d(net['dropout7'], 2, "upsample8")
-    net['concat8'] = concat(net['upsample8'], net['conv2_2'], axis_=3, name_='concat8')
-
-    net['conv8_1'] = conv_relu(net['concat8'], 3, filters * 2, "conv8_1")
-    net['conv8_2'] = conv_relu(net['conv8_1'], 3, filters * 2, "conv8_2")
-
-    # block 9
-    net['upsample9'] = deconv(net['conv8_2'], filters * 2, 2, "upsample9")
-    # net['upsample9'] = deconv_upsample(net['conv8_2'], 2, "upsample9")
-    # net['upsample9'] = upsampling_2d(net['conv8_2'], 2, "upsample9")
-    net['concat9'] = concat(net['upsample9'], net['conv1_2'], axis_=3, name_='concat9')
-
-    net['conv9_1'] = conv_relu(net['concat9'], 3, filters, "conv9_1")
-    net['conv9_2'] = conv_relu(net['conv9_1'], 3, filters, "conv9_2")
-
-    # block 10
-    # the filter 3 is mean the image channel num
-
-    net['conv10'] = conv_relu(net['conv9_2'], 1, num_classes, "conv10", False)
-    # net['conv10'] = conv_relu(net['conv9_2'], 1, 3, "conv10", False)
-
-    with tf.variable_scope('net_output'):
-        net['output'] = tf.reshape(net['conv10'], (-1, num_classes), name='logits')
-    # net['output'] = tf.reshape(net['conv10'], (-1, 3))  # the 3 is the rgb channel
+    :param
+        filter_num: inter, the output channel number
+        mode: 'transpose': deconv, the conv2d_transpose with 3x3 learned filter + relu;
+              'bilinear': deconv_upsample, the conv2d_transpose initialized as the bilinear interpolation,
+                          channel preserving (1x1 conv if filter_num is different);
+              'resize': upsampling_2d (nearest neighbor resize), then 3x3 conv_block of conv_type
+    """
+    if mode == 'transpose':
+        return deconv(input_, filter_num, 2, name, data_format)
+
+    n, h, w, d = _dims(input_, data_format)
+    if mode == 'bilinear':
+        output = deconv_upsample(input_, 2, name, data_format=data_format)
+        output.set_shape(_layout(n, _scale_dim(h, 2), _scale_dim(w, 2), d, data_format))
+        logging.info("layer {0}, {1}".format(name, output.shape))
+        if filter_num != d:
+            output = conv_relu(output, 1, filter_num, name + "_proj", False, data_format)
+        return output
+    if mode == 'resize':
+        return conv_block(upsampling_2d(input_, 2, name, data_format), 3, filter_num, name + "_conv", conv_type,
+                          data_format)
+    raise ValueError("upsample mode must be 'transpose', 'bilinear' or 'resize', got {}".format(mode))
+
+
+def recompute_segment(fn, inputs, enabled=True):
+    """ gradient checkpointing of a segment of the network, tf.contrib.layers.recompute_grad
 
-    print ("the model output shape: {}".format(net["output"].shape))
+    Note:
+        the forward pass of fn keeps only its inputs and its output for the backward pass,
+        the tensors inside fn are computed again from the inputs when the gradients are computed:
+        less training memory for one more forward pass of the segment.
+        the variables of a recomputed segment are resource variables (required by the custom gradient),
+        with the same names.
+
+    :param
+        fn: func, tensors --> one tensor
+        inputs: list of tensors, the arguments of fn
+        enabled: False: just fn(*inputs)
+    """
+    if not enabled:
+        return fn(*inputs)
+    with tf.variable_scope(tf.get_variable_scope(), use_resource=True):
+        return tf.contrib.layers.recompute_grad(fn)(*inputs)
+
+
+def resolve_data_format(data_format, report_path=layout_report):
+    """ 'auto': the faster layout on this machine, read from the layout report (config.layout_report) of
+    $ python benchmark_model.py --mode layout; else data_format.
+    called once by the entry points, the layers and unet take the resolved 'NHWC' or 'NCHW'
+    """
+    if data_format not in ('NHWC', 'NCHW', 'auto'):
+        raise ValueError("data format must be 'NHWC', 'NCHW' or 'auto', got {}".format(data_format))
+    if data_format != 'auto':
+        return data_format
+
+    if not os.path.exists(report_path):
+        raise ValueError("data format 'auto': no layout report {}, measure it first: "
+                         "$ python benchmark_model.py --mode layout --report {}".format(report_path, report_path))
+    with open(report_path) as f:
+        best = json.load(f)['data_format']
+    logging.info("data format auto: {} (from {})".format(best, report_path))
+    return best
 
-    return net
 
+def unet(input_, depth=unet_depth, base_filters=filters, upsample_mode=upsample_mode, skip_mode=skip_mode,
+         class_num=num_classes, conv_type=conv_type, recompute=recompute, data_format=data_format,
+         is_training=True):
+    """ build the unet
 
+    Note:
+        encoder block i (1..depth): conv{i}_1, conv{i}_2 with base_filters * 2^(i-1) filters, then pool{i}
+        (dropout{i} after pool{i} from block 3); the bottom block ends with dropout{depth}.
+        decoder block b (depth+1..2*depth-1), at the level e = 2*depth - b of the encoder:
+        upsample{b}, skip with conv{e}_2, conv{b}_1, conv{b}_2 with base_filters * 2^(e-1) filters
+        (dropout{b} from level 3). conv{2*depth} is the 1x1 logits conv.
+        the defaults (config: depth 5, 'transpose', 'concat') are the original network, conv1_1 ... conv10.
+
+        the image size must be a multiple of 2^(depth-1). the batch size and the image size of input_ may be
+        unknown (None), eg the placeholder of the exported model (export_model.py), the output is then
+        (batch*h*w, class_num) of the fed batch.
+
+        conv_type: the 3x3 conv layers of the blocks are conv_block of conv_type, except conv1_1
+        (on the 3 channel image, a separable conv saves nothing); the skip structure, the layer names and
+        net['output'] are the same for all the types.
+
+    :param
+        depth: inter, the number of encoder blocks (the bottom included)
+        base_filters: inter, the filter number of the first conv layer, doubled at each level
+        upsample_mode: 'transpose', 'bilinear' or 'resize', see upsample
+        skip_mode: 'concat': concat the encoder feature (original); 'add': add it (the upsample gives the
+                    same channel number, the next conv is cheaper); 'none': no skip connection
+        class_num: inter, the channel number of the logits
+        conv_type: 'standard', 'separable' (depthwise-separable) or 'inverted_residual', see conv_block
+        recompute: the gradient checkpointing, see recompute_segment; 'none': all the activations are kept;
+                    'layer': each conv/upsample layer is a segment, its internal tensors (bias add, batch norm,
+                    depthwise and expansion outputs) are recomputed; 'block': each encoder block (2 convs) and
+                    decoder block (upsample, skip, 2 convs) is a segment, only the block boundaries are kept.
+                    the pooling and the dropout stay out of the segments (a recomputed dropout would draw
+                    another mask).
+        data_format: the layout of the layers, 'NHWC' or 'NCHW' ('auto': see resolve_data_format). input_ and
+                    net['output'] are NHWC whatever the layout: with NCHW, the image is transposed before conv1_1
+                    and the logits after the last conv; the other layers of net are NCHW.
+        is_training: bool, the mode of the batch norms, False for the inference graph (export_model.py):
+                    the moving statistics, which the training updates by the ops of tf.GraphKeys.UPDATE_OPS
+    :return:
+        dict, the layers by name, net['output']: the logits (-1, class_num)
+    """
+    if skip_mode not in ('concat', 'add', 'none'):
+        raise ValueError("skip mode must be 'concat', 'add' or 'none', got {}".format(skip_mode))
 
+    inputs = input_
+    print ("the input shape: {}".format(inputs.shape))
+    if recompute not in ('none', 'layer', 'block'):
+        raise ValueError("recompute must be 'none', 'layer' or 'block', got {}".format(recompute))
+    if data_format not in ('NHWC', 'NCHW'):
+        raise ValueError("unet data format must be 'NHWC' or 'NCHW', got {}: resolve 'auto' with "
+                         "resolve_data_format, from the report of $ python benchmark_model.py --mode layout"
+                         .format(data_format))
+    axis = _channel_axis(data_format)
+    if data_format == 'NCHW':
+        inputs = tf.transpose(inputs, [0, 3, 1, 2], name='to_nchw')
+
+    # the batch norms (config.batch_normalization) normalize with the batch statistics and update the
+    # moving ones (tf.GraphKeys.UPDATE_OPS) in training, with the moving statistics in inference
+    with tf.contrib.framework.arg_scope([tf_ctb_layers.batch_norm], is_training=is_training):
+        net = {}
+
+        def layer(fn, *inputs):
+            return recompute_segment(fn, inputs, recompute == 'layer')
+
+        # #############conv
+        top = inputs
+        for i in range(1, depth + 1):
+            block = {}
+
+            def encoder_block(x, i=i, block=block):
+                block['conv{}_1'.format(i)] = layer(lambda x_: conv_block(x_, 3, base_filters * 2 ** (i - 1),
+                                                                          "conv{}_1".format(i),
+                                                                          conv_type if i > 1 else 'standard',
+                                                                          data_format), x)
+                block['conv{}_2'.format(i)] = layer(lambda x_: conv_block(x_, 3, base_filters * 2 ** (i - 1),
+                                                                          "conv{}_2".format(i), conv_type,
+                                                                          data_format),
+                                                    block['conv{}_1'.format(i)])
+                return block['conv{}_2'.format(i)]
+
+            top = recompute_segment(encoder_block, [top], recompute == 'block')
+            net.update(block)
+            if i < depth:
+                top = net['pool{}'.format(i)] = pool(top, 2, 'max', 'pool{}'.format(i), data_format)
+            if i >= 3 or i == depth:
+                top = net['dropout{}'.format(i)] = dropout(top, keep_prob, name='dropout{}'.format(i))
+
+        # #############deconv
+        for b in range(depth + 1, 2 * depth):
+            e = 2 * depth - b   # the encoder level
+            skip = net['conv{}_2'.format(e)]
+            up_filters = skip.shape[axis].value if skip_mode == 'add' else top.shape[axis].value
+            block = {}
+
+            def decoder_block(x, skip_=None, b=b, e=e, up_filters=up_filters, block=block):
+                block['upsample{}'.format(b)] = layer(lambda x_: upsample(x_, up_filters, upsample_mode,
+                                                                          "upsample{}".format(b), conv_type,
+                                                                          data_format), x)
+                if skip_mode == 'concat':
+                    x = block['concat{}'.format(b)] = concat(block['upsample{}'.format(b)], skip_, axis_=axis,
+                                                             name_='concat{}'.format(b))
+                elif skip_mode == 'add':
+                    x = block['add{}'.format(b)] = tf.add(block['upsample{}'.format(b)], skip_, name='add{}'.format(b))
+                else:
+                    x = block['upsample{}'.format(b)]
+
+                block['conv{}_1'.format(b)] = layer(lambda x_: conv_block(x_, 3, base_filters * 2 ** (e - 1),
+                                                                          "conv{}_1".format(b), conv_type,
+                                                                          data_format), x)
+                block['conv{}_2'.format(b)] = layer(lambda x_: conv_block(x_, 3, base_filters * 2 ** (e - 1),
+                                                                          "conv{}_2".format(b), conv_type,
+                                                                          data_format),
+                                                    block['conv{}_1'.format(b)])
+                return block['conv{}_2'.format(b)]
+
+            # the skip tensor is an input of the segment only when it is used
+            top = recompute_segment(decoder_block, [top] if skip_mode == 'none' else [top, skip], recompute == 'block')
+            net.update(block)
+            if e >= 3:
+                top = net['dropout{}'.format(b)] = dropout(top, keep_prob, name='dropout{}'.format(b))
+
+        # the 1x1 logits conv
+        last = 'conv{}'.format(2 * depth)
+        net[last] = conv_relu(top, 1, class_num, last, False, data_format)
+
+        with tf.variable_scope('net_output'):
+            logits = tf.transpose(net[last], [0, 2, 3, 1], name='to_nhwc') if data_format == 'NCHW' else net[last]
+            net['output'] = tf.reshape(logits, (-1, class_num), name='logits')
 
+    print ("the model output shape: {}".format(net["output"].shape))
+
+    return net